@@ -0,0 +1,177 @@
+import csv
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from btcp.impairment import Impairment
+from btcp.stats import StatsExporter, json_lines
+from client_thread import ClientThread
+from server_thread import ServerThread
+
+# Impairment profiles in netem syntax, the same as the ones of the test framework
+profiles = {
+    "ideal": "",
+    "flipping": "corrupt 1%",
+    "duplicates": "duplicate 10%",
+    "lossy": "loss 10% 25%",
+    "bursty": "loss gemodel 1% 10% 70% 0.1%",
+    "reordering": "delay 20ms reorder 25% 50%",
+    "delayed": "delay 100ms 20ms",
+    "capped": "rate 10mbit",
+    "allbad": "corrupt 1% duplicate 10% loss 10% 25% delay 20ms reorder 25% 50%",
+}
+
+fields = ["window", "timeout", "size", "profile", "seed", "ok", "connect_ms", "transfer_s", "goodput_mbit",
+          "handshake_ms", "rtt_p50_ms", "segments", "retransmissions", "retransmission_ratio", "cpu_ms_per_mb"]
+
+
+def run_once(window, timeout, size, profile, seed, exporter=None):
+    """run a single transfer and return its measurements, the exporter samples the client socket while it runs"""
+    options = profiles[profile]
+    # The payload only depends on the size and the seed, so every run sends the same data
+    data = random.Random(seed).getrandbits(8 * size).to_bytes(size, "big")
+    with tempfile.TemporaryDirectory() as directory:
+        input_file = os.path.join(directory, "input.file")
+        with open(input_file, "wb") as f:
+            f.write(data)
+        server = ServerThread(window, timeout, False, Impairment.parse(options, seed) if options else None,
+                              output_file=None)
+        client = ClientThread(window, timeout, False, Impairment.parse(options, seed + 1) if options else None,
+                              input_file=input_file)
+        name = "{} {} {} {} {}".format(window, timeout, size, profile, seed)
+        if exporter is not None:
+            exporter.register(name, client.socket)
+        cpu = time.process_time()
+        server.start()
+        client.start()
+        server.join()
+        client.join()
+        cpu = time.process_time() - cpu
+        if exporter is not None:
+            # The final counters of the run are always exported, however short it was
+            exporter.export()
+            exporter.unregister(name)
+    stats = client.socket.stats
+    # Every byte of the data is sent in a segment of its own chunk, anything beyond those is a retransmission
+    chunks = -(-size // client.socket.layout.payload_size)
+    return {
+        "window": window,
+        "timeout": timeout,
+        "size": size,
+        "profile": profile,
+        "seed": seed,
+        "ok": server.get_recv_file() == data,
+        "connect_ms": round(client.connect_time * 1000, 3),
+        "transfer_s": round(client.send_time, 6),
+        "goodput_mbit": round(size * 8 / client.send_time / 1e6, 3) if client.send_time else None,
+        "handshake_ms": stats.handshake_time,
+        "rtt_p50_ms": stats.rtt.percentile(0.5),
+        "segments": stats.segments_sent,
+        "retransmissions": stats.retransmissions,
+        "retransmission_ratio": round(stats.retransmissions / chunks, 4) if chunks else 0,
+        "cpu_ms_per_mb": round(cpu * 1000 / (size / 1e6), 3) if size else None,
+    }
+
+
+def run_sweep(windows, timeouts, sizes, names, repeat, seed, exporter=None):
+    """run every combination of the parameters repeat times and yield the results"""
+    for window, timeout, size, profile in itertools.product(windows, timeouts, sizes, names):
+        for i in range(repeat):
+            yield run_once(window, timeout, size, profile, seed + 2 * i, exporter)
+
+
+def commit():
+    """return the commit of the working tree, so results of different commits can be told apart"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results, path):
+    """write the results as CSV or JSON depending on the extension of the path"""
+    revision = commit()
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["commit"] + fields)
+            writer.writeheader()
+            for result in results:
+                writer.writerow(dict(result, commit=revision))
+    else:
+        with open(path, "w") as f:
+            json.dump({"commit": revision, "results": results}, f, indent=2)
+
+
+def read_results(path):
+    """read results which were written by write_results"""
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            return [{key: value for key, value in row.items() if key != "commit"} for row in csv.DictReader(f)]
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def summarize(results):
+    """average the repeated runs of every configuration"""
+    groups = {}
+    for result in results:
+        key = tuple(str(result[field]) for field in ("window", "timeout", "size", "profile"))
+        groups.setdefault(key, []).append(result)
+    summary = {}
+    for key, runs in groups.items():
+        summary[key] = {field: sum(float(run[field] or 0) for run in runs) / len(runs)
+                        for field in ("connect_ms", "goodput_mbit", "retransmission_ratio", "cpu_ms_per_mb")}
+    return summary
+
+
+def print_summary(results, baseline=None):
+    """print the averages of every configuration, relative to the baseline results if given"""
+    summary = summarize(results)
+    previous = summarize(baseline) if baseline else {}
+    print("{:>6} {:>7} {:>9} {:>11} {:>10} {:>13} {:>9} {:>10}".format(
+        "window", "timeout", "size", "profile", "connect_ms", "goodput_mbit", "retrans", "cpu_ms/MB"))
+    for key, values in summary.items():
+        line = "{:>6} {:>7} {:>9} {:>11} {:>10.2f} {:>13.2f} {:>9.4f} {:>10.1f}".format(*key, *values.values())
+        if key in previous and previous[key]["goodput_mbit"]:
+            change = values["goodput_mbit"] / previous[key]["goodput_mbit"] - 1
+            line += " {:+.1%} goodput".format(change)
+        print(line)
+
+
+if __name__ == "__main__":
+    # Parse command line arguments
+    import argparse
+
+    parser = argparse.ArgumentParser(description="bTCP benchmarks")
+    parser.add_argument("-w", "--window", help="Window sizes to sweep", type=int, nargs="+", default=[5, 30])
+    parser.add_argument("-t", "--timeout", help="Timeout values (ms) to sweep", type=int, nargs="+", default=[100])
+    parser.add_argument("-s", "--size", help="Transfer sizes (bytes) to sweep", type=int, nargs="+",
+                        default=[1000000])
+    parser.add_argument("-p", "--profile", help="Impairment profiles to sweep", nargs="+", choices=profiles,
+                        default=["ideal", "lossy", "reordering"])
+    parser.add_argument("-r", "--repeat", help="Number of runs of every configuration", type=int, default=3)
+    parser.add_argument("--seed", help="Seed of the payload and the emulated network", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the results to a .json or .csv file")
+    parser.add_argument("-c", "--compare", help="Compare with the results of an earlier run")
+    parser.add_argument("--stats", help="Write the statistics of the client sockets as JSON lines to a file")
+    parser.add_argument("--stats-interval", help="Seconds between the statistics exports", type=float, default=1.0)
+    args = parser.parse_args()
+
+    stats_file = open(args.stats, "w") if args.stats else None
+    exporter = StatsExporter(json_lines(stats_file), args.stats_interval) if stats_file else None
+    if exporter:
+        exporter.start()
+    results = list(run_sweep(args.window, args.timeout, args.size, args.profile, args.repeat, args.seed, exporter))
+    if exporter:
+        exporter.stop()
+        stats_file.close()
+    if args.output:
+        write_results(results, args.output)
+    print_summary(results, read_results(args.compare) if args.compare else None)
+    sys.exit(0 if all(result["ok"] for result in results) else 1)
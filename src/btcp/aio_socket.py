@@ -0,0 +1,473 @@
+import asyncio
+import socket
+from typing import AsyncIterator, BinaryIO, Dict, Iterable, Iterator, Optional, Tuple, Type, Union
+
+from btcp.btcp_socket import BTCPSocket
+from btcp.codec import Header, frame_message, MESSAGE_HEADER
+from btcp.congestion import CongestionControl, Reno
+from btcp.constants import CLIENT_IP, SERVER_IP, SERVER_PORT, MAX_ATTEMPTS, HANDSHAKE_TIMEOUT, FIN_TIMEOUT, \
+    ACCEPT_TIMEOUT, RECV_BUFFER_SIZE, ACK_EVERY, ACK_DELAY
+from btcp.delayed_ack import DelayedAck
+from btcp.enums import State, Flag
+from btcp.listener import BTCPListener
+from btcp.receiver import BTCPReceiver
+from btcp.segment import Segment
+from btcp.send_window import SendWindow
+from btcp.sender import BTCPSender
+from btcp.trace import Tracer
+
+
+class DatagramLayer(asyncio.DatagramProtocol):
+    """ asyncio counterpart of the lossy layer
+    Received datagrams are handed to the lossy_layer_input method of the associated socket on the event loop.
+    """
+
+    def __init__(self, bTCP_sock):
+        self._bTCP_sock = bTCP_sock
+        self._transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self._transport = transport
+        # A single endpoint may carry the bursts of many connections
+        transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        self._bTCP_sock.lossy_layer_input(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        pass
+
+    @property
+    def address(self):
+        """ Local address of the endpoint """
+        return self._transport.get_extra_info('sockname')
+
+    def send_segment(self, segment, address=None) -> None:
+        """ Put the segment into the network, by default it is sent to the remote address of the endpoint """
+        self._transport.sendto(segment, address)
+
+    def send_burst(self, burst, size, address=None) -> None:
+        """ Put a burst of segments which are stored back to back into the network """
+        sendto = self._transport.sendto
+        for start in range(0, len(burst), size):
+            sendto(burst[start:start + size], address)
+
+    def release(self, segment) -> None:
+        """ Received datagrams are not pooled, so there is nothing to give back """
+
+    def destroy(self) -> None:
+        self._transport.close()
+
+
+class AsyncBTCPClientSocket(BTCPSender, BTCPSocket):
+    """ asyncio bTCP client socket
+    Segments are handled on the event loop as they arrive and the retransmission timers are loop callbacks, so many
+    sockets can share one loop without any threads. An application awaits connect, send and disconnect, and calls close
+    Given a cache of fast open cookies, which may be shared by many sockets, a repeat client sends the first data with
+    the SYN request. With streams enabled, send_streams sends several independent streams over the connection at once.
+    """
+
+    def __init__(self, window: int, timeout: int, show_prints: bool = False, short_segments: bool = True,
+                 congestion_control: Type[CongestionControl] = Reno, tracer: Optional[Tracer] = None,
+                 cookies: Optional[dict] = None, streams: bool = False, handshake_timeout: int = HANDSHAKE_TIMEOUT):
+        super().__init__(window, timeout, 'Client', show_prints, short_segments)
+        self.setup_sender(congestion_control, handshake_timeout, cookies, streams)
+        if tracer is not None:
+            self.trace(tracer, 'client')
+        self._lossy_layer = None
+        self._loop = None
+        self._timer = None  # handle of the pending retransmission timer
+        self._waiter = None  # future resolved when the current operation completes
+        self._send_window = None
+        self._attempts = 0
+        self._start_time = 0
+        self._give_up = 0  # time at which the running handshake is abandoned
+        self._server = None  # address of the server, under which its fast open cookie is stored
+        self._syn = None  # options and data of the SYN request
+        self._accepted = 0  # bytes of the data in the SYN request which the server accepted
+
+    async def connect(self, address=(SERVER_IP, SERVER_PORT), local_address=(CLIENT_IP, 0), data=b'') -> int:
+        """ Perform a three-way handshake to establish a connection
+        With a fast open cookie of the server, the SYN request carries the start of the data (a bytes-like object).
+        Returns the number of bytes of the data the server accepted, the application sends the rest with send.
+        """
+        # Only non-connected client can make a connection
+        if self.state is not State.OPEN:
+            return 0
+        self._loop = asyncio.get_running_loop()
+        if self._lossy_layer is None:
+            _, self._lossy_layer = await self._loop.create_datagram_endpoint(
+                lambda: DatagramLayer(self), local_addr=local_address, remote_addr=address)
+        self.state = State.CONN_PEND
+        start_time = self.time()
+        self._server = address
+        self._syn = self.syn_request(self.cookies, address, data)
+        self._accepted = 0
+        await self._run(self._send_syn)
+        if self.state is not State.CONN_EST:
+            self.state = State.OPEN
+        else:
+            self.stats.handshake_time = self.time() - start_time
+        return self._accepted
+
+    async def send(self, data: Union[bytes, BinaryIO, Iterable[bytes]]) -> None:
+        """ Send data originating from the application in a reliable way to the server
+        The data may be any bytes-like object, which must not change while sending, a binary file object or an iterable
+        of bytes-like chunks, which are copied.
+        """
+        # Only allow sending if the connection is established
+        if self.state is not State.CONN_EST:
+            return
+        await self._transfer(self.meta_data(data))
+
+    async def send_streams(self, streams: Dict[int, Union[bytes, BinaryIO, Iterable[bytes]]]) -> bool:
+        """ Sends the data of several streams keyed by their ID (0 to 65535) over the connection at once
+        Returns False without sending if the server did not agree on streams.
+        """
+        if self.state is not State.CONN_EST or not self.multi_stream:
+            return False
+        await self._transfer(self.meta_streams(streams))
+        return True
+
+    async def _transfer(self, segments: Iterator[Segment]) -> None:
+        self._send_window = SendWindow(segments, self._window)
+        if self._send_window:
+            await self._run(self._transmit)
+        self._send_window = None
+
+    async def send_message(self, data: bytes) -> None:
+        """ Sends the data as a single message, which the server receives as a whole with recv_message """
+        await self.send(frame_message(data))
+
+    async def disconnect(self) -> None:
+        """ Perform a three-way handshake to terminate a connection """
+        # Only connected client can disconnect
+        if self.state is not State.CONN_EST:
+            return
+        self.state = State.DISC_PEND
+        await self._run(self._send_fin)
+        self.state = State.OPEN
+
+    def close(self) -> None:
+        """ Clean up any state """
+        self._cancel_timer()
+        if self._lossy_layer is not None:
+            self._lossy_layer.destroy()
+
+    def lossy_layer_input(self, segment: bytes, address) -> None:
+        """ Called by the event loop whenever a segment arrives """
+        message = self.unpack(segment)
+        if message is None:
+            return
+        self.take_peer_window(message)
+        if message.flag is Flag.SYNACK and self.state is State.CONN_PEND:
+            self._handle_synack(message)
+        elif message.flag is Flag.ACK and self._send_window is not None:
+            self._handle_ack(message)
+        elif message.flag is Flag.FINACK and self.state is State.DISC_PEND:
+            self._handle_finack(message)
+
+    async def _run(self, start) -> None:
+        """ Starts an operation of the state machine and waits until it completes """
+        self._waiter = self._loop.create_future()
+        self._attempts = 0
+        self._give_up = self.handshake_deadline()
+        start()
+        await self._waiter
+
+    def _finish(self) -> None:
+        """ Completes the running operation """
+        self._cancel_timer()
+        if not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _send_syn(self) -> None:
+        """ Sends (or resends on expiry of its timer) the SYN request """
+        options, early = self._syn
+        self._retry(Flag.SYN, self._send_syn, options, early)
+
+    def _send_fin(self) -> None:
+        """ Sends (or resends on expiry of its timer) the FIN request """
+        self._retry(Flag.FIN, self._send_fin)
+
+    def _retry(self, flag: Flag, callback, options: dict = None, data: bytes = b'') -> None:
+        """ Posts a handshake segment and schedules its retry until the maximum attempts or the handshake timeout are
+        exceeded
+        """
+        if self._attempts >= MAX_ATTEMPTS or self.time() >= self._give_up:
+            self._finish()
+            return
+        if self._attempts > 0:
+            self.rtt.backoff()
+        self.post(seq_nr=self.seq_nr, ack_nr=self.ack_nr, flag=flag, data=data, options=options)
+        self._attempts += 1
+        self._start_time = self.time()
+        self._schedule(min(self._start_time + self.rtt.rto, self._give_up), callback)
+
+    def _handle_synack(self, message: Header) -> None:
+        early = self._syn[1]
+        if not self.valid_ack(message) and not (early and self.valid_ack(message, 1 + len(early))):
+            return
+        # Only an unambiguous SYN round trip is a valid RTT sample
+        if self._attempts == 1:
+            self.sample_rtt(self.time() - self._start_time)
+        # Enable the options the server agreed on and send ACK for the received SYNACK
+        self._accepted = self.accept_synack(message, early, self.cookies, self._server)
+        self.acknowledge_post(message, Flag.ACK)
+        self.state = State.CONN_EST
+        if self.show_prints:
+            print('-- Client established connection --')
+        self._finish()
+
+    def _handle_finack(self, message: Header) -> None:
+        if not self.valid_ack(message):
+            return
+        # Only an unambiguous FIN round trip is a valid RTT sample
+        if self._attempts == 1:
+            self.sample_rtt(self.time() - self._start_time)
+        self.seq_nr = self.safe_incr(self.seq_nr)
+        self.acknowledge_post(message, Flag.ACK)
+        if self.show_prints:
+            print('-- Client terminated connection --', flush=True)
+        self._finish()
+
+    def _handle_ack(self, message: Header) -> None:
+        self.handle_ack(self._send_window, message)
+        if self._send_window:
+            self._transmit(self.lost_segments(self._send_window))
+        else:
+            self._finish()
+
+    def _retransmit(self) -> None:
+        """ Resends the segments whose timer expired """
+        self._transmit(self.expired_segments(self._send_window))
+
+    def _transmit(self, burst: Optional[list] = None) -> None:
+        """ Sends the given retransmissions and new segments while both the receiver and the network have room
+        Afterwards the timer is re-armed.
+        """
+        deadline = self.transmit(self._send_window, burst if burst is not None else [])
+        self._schedule(deadline, self._retransmit)
+
+    def _schedule(self, deadline: int, callback) -> None:
+        """ Replaces the pending timer by one calling back at the deadline (in milliseconds) """
+        self._cancel_timer()
+        self._timer = self._loop.call_later(self.wait_time(deadline), callback)
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class AsyncBTCPServerSocket(BTCPListener):
+    """ The listening asyncio bTCP server socket
+    Incoming segments are demultiplexed by the address of the client into separate connections. A server application
+    awaits listen and accept, which returns a new connection, and calls close
+    With fast open enabled, clients receive a cookie with which their next connection may carry data in the SYN request.
+    """
+
+    def __init__(self, window: int, timeout: int, show_prints: bool = False, short_segments: bool = True,
+                 tracer: Optional[Tracer] = None, ack_every: int = ACK_EVERY, ack_delay: int = ACK_DELAY,
+                 fast_open: bool = False):
+        self.setup_listener(window, timeout, show_prints, short_segments, tracer, ack_every, ack_delay, fast_open)
+        self._accepted = asyncio.Queue()  # established connections which were not yet accepted
+        self._lossy_layer = None
+
+    async def listen(self, address=(SERVER_IP, SERVER_PORT)) -> None:
+        """ Starts receiving segments on the given address """
+        loop = asyncio.get_running_loop()
+        _, self._lossy_layer = await loop.create_datagram_endpoint(lambda: DatagramLayer(self), local_addr=address)
+
+    @property
+    def address(self):
+        """ Address on which the segments are received, with the port the operating system picked for port 0 """
+        return self._lossy_layer.address
+
+    def new_connection(self, address) -> 'AsyncBTCPServerConnection':
+        """ Creates the connection of the client with the given address """
+        return AsyncBTCPServerConnection(self._window, self._timeout, self.show_prints, self._short_segments, self,
+                                         address)
+
+    async def accept(self) -> 'AsyncBTCPServerConnection':
+        """ Waits until a client established a connection and returns it """
+        return await self._accepted.get()
+
+    def established(self, connection: 'AsyncBTCPServerConnection') -> None:
+        """ Hands the connection whose handshake completed to accept """
+        self._accepted.put_nowait(connection)
+
+    def close(self) -> None:
+        """ Clean up any state """
+        for connection in list(self._connections.values()):
+            connection.terminate()
+        if self._lossy_layer is not None:
+            self._lossy_layer.destroy()
+
+
+class AsyncBTCPServerConnection(BTCPReceiver, BTCPSocket):
+    """ A connection of the asyncio bTCP server socket
+    The server application receives the data of the client by awaiting recv or iterating over recv_stream, or over
+    recv_streams for the separate streams of a multi-stream connection
+    """
+
+    def __init__(self, window: int, timeout: int, show_prints: bool, short_segments: bool,
+                 listener: AsyncBTCPServerSocket, address):
+        super().__init__(window, timeout, 'Server', show_prints, short_segments)
+        self._lossy_layer = listener._lossy_layer
+        self._listener = listener
+        self._peer = self.address = address
+        self._loop = asyncio.get_running_loop()
+        self._readable = asyncio.Event()
+        self._eof = False  # set once the FIN request of the client was received
+        self._stream = None  # stream from which the messages are read
+        self._leftover = memoryview(b'')  # received data which was not yet returned in a message
+        self.setup_receiver(DelayedAck(listener._ack_every, listener._ack_delay))
+        self._ack_timer = None  # timer of the pending delayed ACK
+        self._timer = None
+        self._start_time = None  # arrival of the first SYN request
+
+    def lossy_layer_input(self, segment: bytes, address) -> None:
+        """ Called by the listening socket on the event loop whenever a segment for this connection arrives """
+        message = self.unpack(segment)
+        if message is None:
+            return
+        self.take_peer_window(message)
+        # Give up on the handshake only once the client goes silent
+        if self.state in (State.OPEN, State.CONN_PEND):
+            self._reschedule(ACCEPT_TIMEOUT, self.terminate)
+        if message.flag is Flag.SYN and self.state in (State.OPEN, State.CONN_PEND):
+            # Send SYNACK with the agreed options
+            self.state = State.CONN_PEND
+            self._start_time = self._start_time or self.time()
+            # Data accepted with the SYN request is delivered without waiting for the ACK of the client
+            if self.answer_syn(message, self._listener.fast_open):
+                self.seq_nr = self.safe_incr(self.seq_nr)
+                self._establish()
+                self._readable.set()
+        elif message.flag is Flag.SYN and self.state is State.CONN_EST:
+            # The SYNACK of a connection established by data in the SYN request was lost
+            self.repeat_synack()
+        elif message.flag is Flag.ACK and self.state is State.CONN_PEND and self.valid_ack(message):
+            self.seq_nr = self.safe_incr(self.seq_nr)
+            self._establish()
+        elif message.flag is Flag.ACK and self.state is State.DISC_PEND and self.valid_ack(message):
+            self.terminate()
+        elif message.flag is Flag.NONE and self.state in (State.CONN_PEND, State.CONN_EST):
+            # Data also establishes the connection in case the ACK of the handshake was lost
+            if self.state is State.CONN_PEND:
+                self._establish()
+            if message.dlen == 0:
+                self.cumulative_ack()
+                return
+            acknowledged = self.send_recv_ack(message)
+            self._readable.set()
+            # Send the held back ACK once its delay expires
+            if not acknowledged and self._ack_timer is None:
+                self._ack_timer = self._loop.call_later(self._delayed_ack.delay / 1000, self.cumulative_ack)
+        elif message.flag is Flag.FIN and self.state in (State.CONN_EST, State.DISC_PEND):
+            # Accept the disconnect request and wait for the last ACK until the FIN timeout
+            self.acknowledge_post(message, Flag.FINACK)
+            self.state = State.DISC_PEND
+            self._eof = True
+            self._readable.set()
+            self._reschedule(FIN_TIMEOUT, self.terminate)
+
+    async def recv(self) -> Optional[bytes]:
+        """ Send all incoming data to the application layer once the client disconnects """
+        return b''.join([chunk async for chunk in self.recv_stream()])
+
+    async def recv_stream(self) -> AsyncIterator[bytes]:
+        """ Yields the incoming data to the application as soon as it is in order
+        The streams of a multi-stream connection are yielded interleaved, recv_streams tells them apart.
+        """
+        async for _, chunk in self.recv_streams():
+            if chunk:
+                yield chunk
+
+    async def recv_streams(self) -> AsyncIterator[Tuple[int, bytes]]:
+        """ Yields the incoming data as (stream ID, chunk) as soon as it is in order within its stream
+        A stream ends with an empty chunk, without streams all data belongs to the default stream.
+        """
+        while True:
+            chunk = self.next_chunk()
+            if chunk is not None:
+                # Tell the sender once reading the data made enough room again
+                if self.state is State.CONN_EST and self.window_update_due():
+                    self.stats.window_updates += 1
+                    self.cumulative_ack()
+                yield chunk
+            elif self._eof:
+                return
+            else:
+                self._readable.clear()
+                await self._readable.wait()
+
+    async def recv_message(self) -> Optional[bytes]:
+        """ Receives the next message the client sent with send_message
+        Returns None once the client disconnected
+        """
+        header = await self.recv_exactly(MESSAGE_HEADER.size)
+        if header is None:
+            return None
+        return await self.recv_exactly(MESSAGE_HEADER.unpack(header)[0])
+
+    async def recv_exactly(self, size: int) -> Optional[bytes]:
+        """ Receives exactly size bytes of the incoming data, None if the client disconnected before """
+        if self._stream is None:
+            self._stream = self.recv_stream()
+        buffer = bytearray()
+        while len(buffer) < size:
+            if not self._leftover:
+                try:
+                    self._leftover = memoryview(await self._stream.__anext__())
+                except StopAsyncIteration:
+                    return None
+            taken = min(size - len(buffer), len(self._leftover))
+            buffer += self._leftover[:taken]
+            self._leftover = self._leftover[taken:]
+        return bytes(buffer)
+
+    def cumulative_ack(self) -> None:
+        """ Acknowledges all in-order data and reports the out-of-order blocks, a pending delayed ACK is then sent """
+        super().cumulative_ack()
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+
+    def close(self) -> None:
+        """ Clean up any state, the listening socket stays open
+        A disconnecting connection keeps answering retransmitted FIN requests until its teardown ends
+        """
+        if self.state is not State.DISC_PEND:
+            self.terminate()
+
+    def terminate(self) -> None:
+        """ Ends the connection right away, at the latest once the FIN timeout expires """
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.state is State.DISC_PEND and self.show_prints:
+            print(f'-- Server terminated connection --', flush=True)
+        self.state = State.OPEN
+        self._eof = True
+        self._readable.set()
+        self._listener.remove(self)
+
+    def _establish(self) -> None:
+        self.state = State.CONN_EST
+        self.stats.handshake_time = self.time() - self._start_time
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.show_prints:
+            print(f'-- Server established connection --', flush=True)
+        self._listener.established(self)
+
+    def _reschedule(self, delay: int, callback) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_later(delay / 1000, callback)
@@ -1,112 +1,232 @@
-import array
-import queue
 import random
-import struct
 import time
+from collections import deque
 from typing import Optional
 
-from btcp.constants import SEGMENT_KEYS, HEADER_FORMAT, DATA_FORMAT, PAYLOAD_SIZE, TWO_BYTES
-from btcp.enums import Flag, State
+from btcp.checksum import valid_many, HANDSHAKE_VALUES
+from btcp.codec import Header, SegmentEncoder, decode, encode_options, LEGACY, EXTENDED, HANDSHAKE_FLAGS
+from btcp.constants import TWO_BYTES, CHECKSUM_BATCH, MAX_WINDOW, MAX_WINDOW_SCALE, FLAG_OFFSET
+from btcp.enums import Flag, State, Option, TraceEvent
+from btcp.receive_buffer import ReceiveBuffer
+from btcp.rtt import RttEstimator
+from btcp.stats import SocketStats
 
 
 class BTCPSocket:
-    """ Base bTCP socket on which both client and server sockets are based """
+    """ Base bTCP socket on which both client and server sockets are based
+    The client sockets send with BTCPSender and the server connections receive with BTCPReceiver on top of it.
+    """
 
-    def __init__(self, window: int, timeout: int, name: str, show_prints: bool=False):
+    def __init__(self, window: int, timeout: int, name: str, show_prints: bool=False, short_segments: bool=True):
         self._window = window
         self._timeout = timeout
+        self.rtt = RttEstimator(timeout)
         self._name = name
         self.show_prints = show_prints
         self.recv_win = 0
         self.others_recv_win = 0
+        self.window_opened = False  # whether the last received segment enlarged the receive window of the other end
         self.state = State.OPEN
         self.seq_nr = self.start_random_sequence()
         self.ack_nr = 0
-        self.buffer = queue.Queue(window)
-
-    def handle_flow(self, expected: [Flag]) -> Optional[dict]:
-        """ Checks if any message was received and returns it if it was """
-        try:
-            segment = self.buffer.get(block=False)
-            message = self.unpack_segment(segment)
-            if message['flag'] in expected and self.valid_checksum(message):
-                self.others_recv_win = message['win']
-                return message
-        except queue.Empty:
-            pass
+        # Duplicated and control segments do not count against the window, so the buffer leaves room for them
+        self.buffer = ReceiveBuffer(2 * window)
+        self._batch = deque()  # segments taken from the buffer at once, with the results of their checksums
+        self._encoder = SegmentEncoder()
+        self._peer = None  # address of the other end, None for the default address of the lossy layer
+        self._offer_short = short_segments
+        self.short_segments = False  # only send the used bytes of a segment, enabled in the handshake
+        self._offer_streams = False  # whether this end offers to carry several streams over the connection
+        self.multi_stream = False  # whether every data segment starts with a stream header, agreed in the handshake
+        self.layout = LEGACY  # header of the segments after the handshake, extended if both ends support it
+        self.delayed_acks = False  # whether the other end takes ACKs covering several segments, agreed in the handshake
+        self.cumulative_acks = False  # whether ACKs cover all earlier data and carry SACK blocks, agreed on
+        self._win_scale = self.window_scale(window)  # shift offered for the windows advertised by this end
+        self._win_shift = 0  # shifts of the advertised windows of either end, agreed on in the handshake
+        self._peer_win_shift = 0
+        self._held = None  # received segment whose buffer is given back to the lossy layer by the next handle_flow
+        self.stats = SocketStats()
+        self.tracer = None  # packet tracer recording the segments of this socket, if any
+        self._trace_id = 0
+
+    def handle_flow(self, expected: [Flag], deadline: Optional[int] = None) -> Optional[Header]:
+        """ Waits until a message is received or the deadline (in milliseconds) passes and returns the message
+        The data of the message is a view on a reusable receive buffer, so it is only valid until the next call.
+        """
+        # The previous message was handled, so its buffer can be reused for new segments
+        if self._held is not None:
+            self._lossy_layer.release(self._held)
+            self._held = None
+        if not self._batch:
+            segment = self.buffer.get(self.wait_time(deadline))
+            if segment is None:
+                return None
+            self.take_batch(segment)
+        segment, verified = self._batch.popleft()
+        self._held = segment
+        message = self.unpack(segment, verified)
+        if message and message.flag in expected:
+            self.take_peer_window(message)
+            return message
         return None
 
-    def acknowledge_post(self, message: dict, flag: Flag) -> None:
+    def take_batch(self, segment: bytes) -> None:
+        """ Takes the segment together with all others waiting in the buffer, so that their checksums are checked
+        in a single call when there are enough of them
+        """
+        segments = [segment] + self.buffer.take_all()
+        # A SYN or SYNACK may change the header layout, so the segments behind it are checked once they are decoded
+        checked = next((i + 1 for i, queued in enumerate(segments)
+                        if len(queued) > FLAG_OFFSET and queued[FLAG_OFFSET] in HANDSHAKE_VALUES), len(segments))
+        if checked >= CHECKSUM_BATCH:
+            results = valid_many(segments[:checked], self.layout.header_size)
+        else:
+            results = [None] * checked
+        results += [None] * (len(segments) - checked)
+        self._batch.extend(zip(segments, results))
+
+    def unpack(self, segment: bytes, verified: Optional[bool] = None) -> Optional[Header]:
+        """ Decodes a received segment and counts it in the statistics """
+        message = decode(segment, verified, self.layout)
+        if message is None:
+            self.stats.checksum_failures += 1
+            if self.tracer is not None:
+                self.tracer.record(self._trace_id, TraceEvent.DROP, Flag.NONE, 0, 0, 0, 0)
+        else:
+            self.stats.segments_received += 1
+            self.stats.bytes_received += message.dlen
+            if self.tracer is not None:
+                self.tracer.record(self._trace_id, TraceEvent.RECV, message.flag, message.seq_nr, message.ack_nr,
+                                   message.win, message.dlen)
+        return message
+
+    def enqueue(self, segment: bytes) -> None:
+        """ Puts a received segment in the buffer, it is dropped right away if the buffer is full """
+        if not self.buffer.put(segment):
+            self.stats.queue_full_drops += 1
+            self._lossy_layer.release(segment)
+            if self.tracer is not None:
+                self.tracer.record(self._trace_id, TraceEvent.DROP, Flag.NONE, 0, 0, 0, 0)
+
+    def acknowledge_post(self, message: Header, flag: Flag, options: dict = None) -> None:
         """ Sends acknowledgement message """
         if flag not in [Flag.ACK, Flag.SYNACK, Flag.FINACK]:
             return
-        ack_nr = self.safe_incr(message['seq_nr'], (message['dlen'] if message['dlen'] > 0 else 1))
-        self.post(self.seq_nr, ack_nr, flag)
+        ack_nr = self.safe_incr(message.seq_nr, (message.dlen if message.dlen > 0 else 1))
+        self.post(self.seq_nr, ack_nr, flag, options=options)
 
-    def post(self, seq_nr: int, ack_nr: int, flag: Flag, data: bytes = b''):
-        segment = self.pack_segment(seq_nr=seq_nr, ack_nr=ack_nr, data=data, flag=flag)
+    def post(self, seq_nr: int, ack_nr: int, flag: Flag, data: bytes = b'', options: dict = None):
+        """ Encodes the segment with the current receive window and puts it into the network
+        Segments carrying handshake options are always sent in full size, so that legacy peers can read them
+        """
+        segment = self._encoder.encode(seq_nr, ack_nr, flag, self.advertised_window(flag), data,
+                                       encode_options(options or {}), short=self.short_segments and not options,
+                                       layout=self.layout)
         if self.show_prints:
             print(f'[seq: {seq_nr}; ack: {ack_nr}] {self._name} sent {flag.name}', flush=True)
-        self._lossy_layer.send_segment(segment)
+        self._lossy_layer.send_segment(segment, self._peer)
+        self.stats.segments_sent += 1
+        self.stats.bytes_sent += len(data)
+        if self.tracer is not None:
+            self.tracer.record(self._trace_id, TraceEvent.SEND, flag, seq_nr, ack_nr, self.recv_win, len(data))
+
+    def advertised_window(self, flag: Flag) -> int:
+        """ Updates the receive window and returns its value for the window field of a segment with the given flag
+        Like in TCP, the window in handshake segments is never scaled.
+        """
+        self.recv_win = self.receive_space()
+        shift = 0 if flag in HANDSHAKE_FLAGS else self._win_shift
+        return min(max(self.recv_win, 0) >> shift, MAX_WINDOW)
+
+    def receive_space(self) -> int:
+        """ Returns the number of segments this end can still take, segments waiting to be handled take up room """
+        return self._window - len(self.buffer) - len(self._batch)
+
+    def peer_window(self, message: Header) -> int:
+        """ Returns the receive window (in segments) advertised by the other end in the message """
+        return message.win if message.flag in HANDSHAKE_FLAGS else message.win << self._peer_win_shift
+
+    def take_peer_window(self, message: Header) -> None:
+        """ Takes the receive window advertised by the other end in the message and notes whether it grew """
+        win = self.peer_window(message)
+        self.window_opened = win > self.others_recv_win
+        self.others_recv_win = win
 
-    def valid_ack(self, message: dict, addition: int = 1) -> bool:
+    def sample_rtt(self, rtt: int) -> None:
+        """ Updates the RTT estimation with a valid measurement (in milliseconds) and records it """
+        self.rtt.sample(rtt)
+        self.stats.rtt.record(rtt)
+
+    def trace(self, tracer, name: str) -> None:
+        """ Records the segments of this socket with the packet tracer under the given connection name """
+        self.tracer = tracer
+        self._trace_id = tracer.register(name)
+
+    def snapshot(self) -> dict:
+        """ Returns the statistics together with the current state of the connection """
+        return dict(self.stats.snapshot(), state=self.state.name, srtt=self.rtt.srtt, rto=self.rtt.rto,
+                    recv_win=self.recv_win, others_recv_win=self.others_recv_win)
+
+    def offer_options(self) -> dict:
+        """ Returns the handshake options supported by this socket """
+        options = {Option.WINDOW_SCALE: bytes((self._win_scale,)), Option.EXTENDED_SEQUENCE: b'', Option.SACK: b'',
+                   Option.DELAYED_ACK: b''}
+        if self._offer_short:
+            options[Option.SHORT_SEGMENTS] = b''
+        if self._offer_streams:
+            options[Option.STREAMS] = b''
+        return options
+
+    def apply_options(self, options: dict) -> dict:
+        """ Enables the options supported by both ends and returns those which were agreed on
+        Legacy peers do not send any options, so the connection then keeps the legacy header and unscaled windows.
+        """
+        agreed = {option: value for option, value in self.offer_options().items() if option in options}
+        self.short_segments = Option.SHORT_SEGMENTS in agreed
+        self.multi_stream = Option.STREAMS in agreed
+        self.layout = EXTENDED if Option.EXTENDED_SEQUENCE in agreed else LEGACY
+        # Without the option, ACKs keep the legacy meaning of acknowledging exactly one segment
+        self.cumulative_acks = Option.SACK in agreed
+        # A delayed ACK covers several segments, so it needs cumulative ACKs
+        self.delayed_acks = Option.DELAYED_ACK in agreed and self.cumulative_acks
+        # Windows are only scaled if both ends sent a scale, each scales its own advertisements
+        scale = options.get(Option.WINDOW_SCALE, b'')
+        if Option.WINDOW_SCALE in agreed and len(scale) == 1:
+            self._win_shift = self._win_scale
+            self._peer_win_shift = min(scale[0], MAX_WINDOW_SCALE)
+        else:
+            agreed.pop(Option.WINDOW_SCALE, None)
+            self._win_shift = self._peer_win_shift = 0
+        return agreed
+
+    @staticmethod
+    def window_scale(window: int) -> int:
+        """ Returns the smallest shift with which the window fits in the window field """
+        scale = 0
+        while window >> scale > MAX_WINDOW and scale < MAX_WINDOW_SCALE:
+            scale += 1
+        return scale
+
+    def valid_ack(self, message: Header, addition: int = 1) -> bool:
         """ Checks if the received ACK number is good """
-        return self.safe_incr(self.seq_nr, addition) == message['ack_nr']
-
-    def pack_segment(self, seq_nr: int = -1, ack_nr: int = 0, data: bytes = b'', flag: Flag = Flag.NONE) -> bytes:
-        """ Creates a segment with the given data and current sequence and acknowledgement numbers """
-        data_size = len(data)
-        if data_size > PAYLOAD_SIZE:
-            raise ValueError
-        if seq_nr == -1:
-            seq_nr = self.seq_nr
-        self.recv_win = self._window - self.buffer.qsize()
-        header = struct.pack(HEADER_FORMAT,
-                             seq_nr,         # sequence number (halfword, 2 bytes)
-                             ack_nr,         # acknowledgement number (halfword, 2 bytes)
-                             flag.value,     # flags (byte),
-                             self.recv_win,  # window (byte)
-                             data_size,      # data length (halfword, 2 bytes)
-                             0)              # checksum (halfword, 2 bytes)
-        payload = struct.pack(DATA_FORMAT, data)
-        cksum = self.calc_checksum(header + payload)
-        header = struct.pack(HEADER_FORMAT, seq_nr, ack_nr, flag.value, self.recv_win, data_size, cksum)
-        return header + payload
-
-    def unpack_segment(self, segment: bytes) -> dict:
-        """ Creates a dictionary representation of the received segment """
-        unpacked = struct.unpack(HEADER_FORMAT + DATA_FORMAT, segment)
-        unpacked = dict(zip(SEGMENT_KEYS, unpacked))
-        unpacked['flag'] = Flag(unpacked['flag'])
-        return unpacked
-
-    def valid_checksum(self, msg: dict) -> bool:
-        """ Validates the received checksum """
-        packed_seg = struct.pack(HEADER_FORMAT + DATA_FORMAT, msg['seq_nr'], msg['ack_nr'], msg['flag'].value,
-                                 msg['win'], msg['dlen'], 0, msg['data'])
-        cksum = self.calc_checksum(packed_seg)
-        return cksum == msg['cksum']
-
-    def calc_checksum(self, segment: bytes) -> int:
-        """ Calculates the checksum for segment data """
-        if len(segment) % 2 == 1:  # padding
-            segment += b'\x00'
-        strarr = array.array('H', segment)  # split into 16-bit substrings
-        cksum = sum(strarr)  # sum
-        cksum = (cksum >> 16) + (cksum & 0xffff)  # carry
-        cksum += (cksum >> 16)  # carry in case of spill
-        cksum = ~cksum & 0xffff  # 1's complement
-        return cksum
+        return self.safe_incr(self.seq_nr, addition) == message.ack_nr
 
     def time(self) -> int:
         """ Returns current time in milliseconds """
         return int(round(time.time() * 1000))
 
+    def wait_time(self, deadline: Optional[int]) -> Optional[float]:
+        """ Returns the number of seconds left until the deadline or None if there is no deadline """
+        if deadline is None:
+            return None
+        return max(deadline - self.time(), 0) / 1000
+
     def start_random_sequence(self) -> int:
-        """ Generates a random two byte number """
-        return random.randint(0, TWO_BYTES)
+        """ Generates a random two byte number, it is sent in the legacy header of the SYN request """
+        return random.randrange(TWO_BYTES)
 
     def safe_incr(self, number: int, addition: int = 1) -> int:
-        """ Returns the successor with a wraparound condition in case its larger than two bytes """
+        """ Returns the successor with a wraparound condition in case it leaves the sequence space of the header """
         summed = number + addition
-        return summed if summed < TWO_BYTES else summed % TWO_BYTES
\ No newline at end of file
+        space = self.layout.seq_space
+        return summed if summed < space else summed % space
\ No newline at end of file
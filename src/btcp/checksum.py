@@ -0,0 +1,84 @@
+import struct
+import sys
+from typing import List, Sequence
+
+from btcp.constants import HEADER_SIZE, SEGMENT_SIZE, FLAG_OFFSET, DLEN_OFFSET, CKSUM_OFFSET
+from btcp.enums import Flag
+
+try:
+    import numpy
+except ImportError:  # without NumPy batches are validated one segment at a time
+    numpy = None
+
+CKSUM_FIELD = struct.Struct('!H')
+CKSUM_NATIVE = struct.Struct('=H')  # the checksum field as it is read while summing the segment
+DLEN_FIELD = struct.Struct('!H')
+ODD_BYTE = 1 if sys.byteorder == 'little' else 256  # weight of a zero padded trailing byte in the sum
+# Raw values of the flag byte of the segments whose padding is covered by the checksum as well
+HANDSHAKE_VALUES = frozenset((Flag.SYN.value, Flag.SYNACK.value))
+FLAG_VALUES = frozenset(flag.value for flag in Flag)
+
+
+def word_sum(buffer) -> int:
+    """ Sums the 16-bit words of the buffer in native byte order without copying it
+    An odd trailing byte is zero padded.
+    """
+    view = memoryview(buffer).cast('B')
+    even = len(view) & ~1
+    total = sum(view[:even].cast('H'))
+    if even != len(view):
+        total += view[-1] * ODD_BYTE
+    return total
+
+
+def fold(total: int) -> int:
+    """ Folds the carries of the word sum and returns its 1's complement """
+    total = (total >> 16) + (total & 0xffff)  # carry
+    total += (total >> 16)  # carry in case of spill
+    return ~total & 0xffff  # 1's complement
+
+
+def checksum(buffer) -> int:
+    """ Calculates the checksum of the buffer """
+    return fold(word_sum(buffer))
+
+
+def summed_length(segment, header_size: int = HEADER_SIZE) -> int:
+    """ Returns the number of bytes of a received segment which are covered by its checksum, 0 if it is malformed
+    The zero padding of a data segment does not change the checksum, so only its header and data are summed.
+    Handshake segments always have a legacy header, the others one of the given size.
+    """
+    if len(segment) < HEADER_SIZE or segment[FLAG_OFFSET] not in FLAG_VALUES:
+        return 0
+    if segment[FLAG_OFFSET] in HANDSHAKE_VALUES:
+        return len(segment)
+    dlen = DLEN_FIELD.unpack_from(segment, DLEN_OFFSET)[0]
+    end = header_size + dlen
+    return end if dlen <= SEGMENT_SIZE - header_size and end <= len(segment) else 0
+
+
+def valid(segment, length: int) -> bool:
+    """ Checks the checksum of the first length bytes of the segment """
+    # Sum the buffer in place and take out the checksum field instead of re-packing the segment without it
+    total = word_sum(memoryview(segment)[:length]) - CKSUM_NATIVE.unpack_from(segment, CKSUM_OFFSET)[0]
+    return fold(total) == CKSUM_FIELD.unpack_from(segment, CKSUM_OFFSET)[0]
+
+
+def valid_many(segments: Sequence, header_size: int = HEADER_SIZE) -> List[bool]:
+    """ Checks the checksums of many received segments at once, malformed segments are invalid
+    With NumPy the segments are copied into a single array and summed in one vectorised pass.
+    """
+    lengths = [summed_length(segment, header_size) for segment in segments]
+    if numpy is None or len(segments) < 2:
+        return [length > 0 and valid(segment, length) for segment, length in zip(segments, lengths)]
+    rows = numpy.zeros((len(segments), SEGMENT_SIZE), dtype=numpy.uint8)
+    for row, segment, length in zip(rows, segments, lengths):
+        row[:length] = numpy.frombuffer(segment, dtype=numpy.uint8, count=length)
+    words = rows.view(numpy.uint16)  # in native byte order like word_sum, odd lengths are zero padded
+    totals = words.sum(axis=1, dtype=numpy.uint64) - words[:, CKSUM_OFFSET // 2]
+    totals = (totals >> 16) + (totals & 0xffff)
+    totals = (totals >> 16) + (totals & 0xffff)
+    totals += totals >> 16
+    expected = rows[:, CKSUM_OFFSET].astype(numpy.uint64) << 8 | rows[:, CKSUM_OFFSET + 1]
+    results = (~totals & 0xffff) == expected
+    return [bool(result) and length > 0 for result, length in zip(results.tolist(), lengths)]
@@ -1,101 +1,129 @@
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Type, Union
+
 from btcp.btcp_socket import BTCPSocket
-from btcp.constants import CLIENT_IP, CLIENT_PORT, SERVER_IP, SERVER_PORT, MAX_ATTEMPTS, PAYLOAD_SIZE
+from btcp.codec import frame_message
+from btcp.congestion import CongestionControl, Reno
+from btcp.constants import CLIENT_IP, CLIENT_PORT, SERVER_IP, SERVER_PORT, MAX_ATTEMPTS, HANDSHAKE_TIMEOUT
 from btcp.enums import State, Flag
+from btcp.impairment import Impairment
 from btcp.lossy_layer import LossyLayer
 from btcp.segment import Segment
+from btcp.send_window import SendWindow
+from btcp.sender import BTCPSender
+from btcp.trace import Tracer
 
 
-class BTCPClientSocket(BTCPSocket):
+class BTCPClientSocket(BTCPSender, BTCPSocket):
     """ bTCP client socket
     A client application makes use of the services provided by bTCP by calling connect, send, disconnect, and close 
+    Given a cache of fast open cookies, which may be shared by many sockets, a repeat client sends the first data with
+    the SYN request. With streams enabled, send_streams sends several independent streams over the connection at once.
     """
 
-    def __init__(self, window: int, timeout: int, show_prints: bool):
-        super().__init__(window, timeout, 'Client', show_prints)
-        self._lossy_layer = LossyLayer(self, CLIENT_IP, CLIENT_PORT, SERVER_IP, SERVER_PORT)
+    def __init__(self, window: int, timeout: int, show_prints: bool, short_segments: bool = True,
+                 congestion_control: Type[CongestionControl] = Reno, port: int = CLIENT_PORT,
+                 impairment: Optional[Impairment] = None, tracer: Optional[Tracer] = None,
+                 cookies: Optional[dict] = None, streams: bool = False, handshake_timeout: int = HANDSHAKE_TIMEOUT):
+        super().__init__(window, timeout, 'Client', show_prints, short_segments)
+        self.setup_sender(congestion_control, handshake_timeout, cookies, streams)
+        # Concurrent clients need distinct ports, port 0 lets the operating system pick a free one
+        self._lossy_layer = LossyLayer(self, CLIENT_IP, port, SERVER_IP, SERVER_PORT, impairment)
+        self._lossy_layer.start()
+        if tracer is not None:
+            self.trace(tracer, 'client')
 
     def lossy_layer_input(self, segment: bytes, address) -> None:
         """ Called by the lossy layer from another thread whenever a segment arrives. """
-        self.buffer.put(segment, block=True, timeout=50)
+        self.enqueue(segment)
+
+    def lossy_layer_idle(self) -> None:
+        """ Called by the lossy layer from another thread whenever no segment arrived for a while """
 
-    def connect(self) -> None:
-        """ Perform a three-way handshake to establish a connection """
+    def connect(self, data=b'') -> int:
+        """ Perform a three-way handshake to establish a connection
+        With a fast open cookie of the server, the SYN request carries the start of the data (a bytes-like object).
+        Returns the number of bytes of the data the server accepted, the application sends the rest with send.
+        """
         # Only non-connected client can make a connection
         if self.state is not State.OPEN:
-            return
+            return 0
         # Initialize local variables
-        syn_count = syn_timer = start_timer = 0
-        # Attempt to connect while the state is unchanged or maximum attempts are exceeded
-        while self.state is State.OPEN and syn_count < MAX_ATTEMPTS:
+        syn_count = deadline = start_time = first_time = accepted = 0
+        options, early = self.syn_request(self.cookies, (SERVER_IP, SERVER_PORT), data)
+        give_up = self.handshake_deadline()
+        # Attempt to connect while the state is unchanged or maximum attempts or the handshake timeout are exceeded
+        while self.state is State.OPEN and syn_count < MAX_ATTEMPTS and self.time() < give_up:
             # Send SYN if it was not yet sent or if the timer expired
-            if syn_count == 0 or syn_timer > self._timeout:
-                self.post(seq_nr=self.seq_nr, ack_nr=self.ack_nr, flag=Flag.SYN)
+            if syn_count == 0 or self.time() >= deadline:
+                if syn_count > 0:
+                    self.rtt.backoff()
+                self.post(seq_nr=self.seq_nr, ack_nr=self.ack_nr, flag=Flag.SYN, data=early, options=options)
                 syn_count += 1
-                syn_timer = 0
-                start_timer = self.time()
-            # Handle the incoming traffic
-            message = self.handle_flow(expected=[Flag.SYNACK])
+                start_time = self.time()
+                first_time = first_time or start_time
+                deadline = start_time + self.rtt.rto
+            # Wait for the incoming traffic until the SYN timer expires
+            message = self.handle_flow(expected=[Flag.SYNACK], deadline=min(deadline, give_up))
             if message:
                 # Given an incorrect SEQ number reset the connect attempts
-                if not self.valid_ack(message):
+                if not self.valid_ack(message) and not (early and self.valid_ack(message, 1 + len(early))):
                     syn_count = 0
                     continue
-                # Send ACK for the received SYNACK
-                self.seq_nr = self.safe_incr(self.seq_nr)
-                self.ack_nr = self.safe_incr(message['seq_nr'])
+                # Only an unambiguous SYN round trip is a valid RTT sample
+                if syn_count == 1:
+                    self.sample_rtt(self.time() - start_time)
+                # Enable the options the server agreed on and send ACK for the received SYNACK
+                accepted = self.accept_synack(message, early, self.cookies, (SERVER_IP, SERVER_PORT))
                 self.acknowledge_post(message, Flag.ACK)
                 self.state = State.CONN_EST
+                self.stats.handshake_time = self.time() - first_time
                 if self.show_prints:
                     print('-- Client established connection --')
-            # Increase the timer
-            syn_timer = self.time() - start_timer
+        return accepted
 
-    def send(self, data: bytes) -> None:
-        """ Send data originating from the application in a reliable way to the server """
+    def send(self, data: Union[bytes, BinaryIO, Iterable[bytes]]) -> None:
+        """ Send data originating from the application in a reliable way to the server
+        The data may be any bytes-like object, a binary file object or an iterable of bytes-like chunks.
+        Segments are only built once the window reaches them, so a bytes-like object must not change while sending.
+        The chunks of a file object or an iterable are copied, so an iterable may reuse a single buffer for them.
+        """
         # Only allow sending if the connection is established
         if self.state is not State.CONN_EST:
             return
-        # Prepare the data for transfer
-        segments = self.meta_data(data)
-        # self.seq_nr = segments[-1].exp_ack
-        seg_end = len(segments)
-        # Window pointers
-        lower = 0
-        upper = self.recv_win if seg_end > self.recv_win else seg_end
-        recv_win_full = self.others_recv_win <= 0
-        recv_win_full_timer = start_time = 0
+        self.transfer(self.meta_data(data))
+
+    def send_streams(self, streams: Dict[int, Union[bytes, BinaryIO, Iterable[bytes]]]) -> bool:
+        """ Sends the data of several streams keyed by their ID (0 to 65535) over the connection at once
+        The streams share the window fairly and the server delivers each as soon as its own data is in order, so a loss
+        does not hold back the other streams. Returns False without sending if the server did not agree on streams.
+        """
+        if self.state is not State.CONN_EST or not self.multi_stream:
+            return False
+        self.transfer(self.meta_streams(streams))
+        return True
+
+    def transfer(self, segments: Iterator[Segment]) -> None:
+        """ Sends the segments in a reliable way, returns once all of them were acknowledged """
+        # Prepare the data for transfer, the segments are created lazily as the window advances
+        window = SendWindow(segments, self._window)
         # Send the data until all segments were acknowledged
-        while lower != upper:
-            # Send/resend segments
-            for segment in segments[lower:upper]:
-                # Counting pending segments
-                in_flight = sum([s.sent - s.is_acked for s in segments[lower:upper]])
-                if self.others_recv_win - in_flight <= 0:
-                    break
-                if not segment.sent or segment.timer > self._timeout:
-                    self.post(seq_nr=segment.seq_nr, ack_nr=self.ack_nr, flag=Flag.NONE, data=segment.data)
-                    segment.sent = True
-                    segment.timer = 0
-                    segment.start_time = self.time()
-            message = self.handle_flow(expected=[Flag.ACK])
+        while window:
+            # Resend the segments whose timer expired, and otherwise those which the acknowledgements of later ones
+            # revealed as lost without waiting for their timers
+            expired = self.expired_segments(window)
+            burst = expired + ([] if expired else self.lost_segments(window))
+            # Send them together with the new segments while both the receiver and the network have room for them
+            deadline = self.transmit(window, burst)
+            # Wait for the incoming traffic until the earliest retransmission timer or the persist timer expires
+            message = self.handle_flow(expected=[Flag.ACK], deadline=deadline)
             if message:
-                # Find the segment which was acknowledged
-                for segment in segments[lower:upper]:
-                    if message['ack_nr'] == segment.exp_ack:
-                        segment.is_acked = True
-                        self.seq_nr = segment.exp_ack
-                        break
-                # Move window for each acknowledged segment
-                for segment in segments[lower:upper]:
-                    # Stop when unacknowledged segment is encountered
-                    if not segment.is_acked:
-                        break
-                    lower += 1
-                    upper += 1 if upper < seg_end else 0
-            # Update timers for each sent and unacknowledged segment
-            for segment in segments[lower:upper]:
-                if segment.sent:
-                    segment.timer = self.time() - segment.start_time            
+                self.handle_ack(window, message)
+
+    def send_message(self, data: bytes) -> None:
+        """ Sends the data as a single message, which the server receives as a whole with recv_message
+        Any number of messages can be sent over the same connection, so only the first pays for the handshake.
+        """
+        self.send(frame_message(data))
 
     def disconnect(self) -> None:
         """ Perform a three-way handshake to terminate a connection """
@@ -103,58 +131,35 @@ class BTCPClientSocket(BTCPSocket):
         if self.state is not State.CONN_EST:
             return
         # Initialize local variables
-        fin_count = fin_timer = start_timer = 0
-        # Attempt to disconnect while the state is unchanged or maximum attempts are exceeded
-        while self.state is State.CONN_EST and fin_count < MAX_ATTEMPTS:
+        fin_count = deadline = start_time = 0
+        give_up = self.handshake_deadline()
+        # Attempt to disconnect while the state is unchanged or maximum attempts or the handshake timeout are exceeded
+        while self.state is State.CONN_EST and fin_count < MAX_ATTEMPTS and self.time() < give_up:
             # Send FIN if it was not yet sent or if the timer expired
-            if fin_count == 0 or fin_timer > self._timeout:
+            if fin_count == 0 or self.time() >= deadline:
+                if fin_count > 0:
+                    self.rtt.backoff()
                 self.post(seq_nr=self.seq_nr, ack_nr=self.ack_nr, flag=Flag.FIN)
                 fin_count += 1
-                fin_timer = 0
-                start_timer = self.time()
-            # Handle the incoming traffic
-            message = self.handle_flow(expected=[Flag.FINACK])
+                start_time = self.time()
+                deadline = start_time + self.rtt.rto
+            # Wait for the incoming traffic until the FIN timer expires
+            message = self.handle_flow(expected=[Flag.FINACK], deadline=min(deadline, give_up))
             if message:
                 # Given an incorrect SEQ number reset the disconnect attempts
                 if not self.valid_ack(message):
                     fin_count = 0
                     continue
+                # Only an unambiguous FIN round trip is a valid RTT sample
+                if fin_count == 1:
+                    self.sample_rtt(self.time() - start_time)
                 # Send ACK for the received FINACK
                 self.seq_nr = self.safe_incr(self.seq_nr)
                 self.acknowledge_post(message, Flag.ACK)
                 self.state = State.OPEN
                 if self.show_prints:
                     print('-- Client terminated connection --', flush=True)
-            # Increase the timer
-            fin_timer = self.time() - start_timer
 
     def close(self) -> None:
         """ Clean up any state """
         self._lossy_layer.destroy()
-
-    def meta_data(self, data: bytes) -> [Segment]:
-        """ Turns the data bytes into segments with their meta data """
-        split_data = self.split_data(data)
-        segments = []
-        for i, data in enumerate(split_data):
-            seq_nr = self.safe_incr(self.seq_nr, addition=i * PAYLOAD_SIZE)
-            exp_ack = self.safe_incr(seq_nr, addition=len(data))
-            segments.append(Segment(data=data, seq_nr=seq_nr, exp_ack=exp_ack))
-        return segments
-
-    def split_data(self, data: bytes) -> [bytes]:
-        """ Splits the data into chunks of 1008 bytes """
-        size = len(data)
-        last = size % PAYLOAD_SIZE  # remaining data for the last chunk
-        length = int(size / PAYLOAD_SIZE)
-        start = 0
-        to = PAYLOAD_SIZE if size >= PAYLOAD_SIZE else 0
-        split_data = []
-        for i in range(length):
-            split_data.append(data[start:to])
-            # if not the last thing:
-            if not i == length - 1:
-                start += PAYLOAD_SIZE
-                to += PAYLOAD_SIZE
-        split_data.append(data[to:to + last])
-        return split_data
\ No newline at end of file
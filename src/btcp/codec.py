@@ -0,0 +1,177 @@
+import struct
+from typing import Optional
+
+from btcp.checksum import CKSUM_FIELD, checksum, fold, valid, word_sum
+from btcp.constants import HEADER_FORMAT, HEADER_SIZE, PAYLOAD_SIZE, SEGMENT_SIZE, SACK_FORMAT, TWO_BYTES, \
+    FOUR_BYTES, FLAG_OFFSET, CKSUM_OFFSET, EXTENDED_HEADER_FORMAT, EXTENDED_HEADER_SIZE, EXTENDED_SACK_FORMAT, \
+    MESSAGE_FORMAT, STREAM_FORMAT
+from btcp.enums import Flag, Option
+
+HEADER = struct.Struct(HEADER_FORMAT)
+EXTENDED_HEADER = struct.Struct(EXTENDED_HEADER_FORMAT)
+SACK_BLOCK = struct.Struct(SACK_FORMAT)
+MESSAGE_HEADER = struct.Struct(MESSAGE_FORMAT)
+STREAM_HEADER = struct.Struct(STREAM_FORMAT)
+ZEROS = memoryview(bytes(PAYLOAD_SIZE))
+FLAGS = {flag.value: flag for flag in Flag}
+OPTIONS = {option.value: option for option in Option}
+HANDSHAKE_FLAGS = (Flag.SYN, Flag.SYNACK)  # flags of the segments which carry options in their padding
+
+
+class Header:
+    """ Lightweight view on a received segment, the data is a memoryview on the received buffer """
+    __slots__ = ('seq_nr', 'ack_nr', 'flag', 'win', 'dlen', 'cksum', 'data', 'options')
+
+    def __init__(self, seq_nr: int, ack_nr: int, flag: Flag, win: int, dlen: int, cksum: int, data: memoryview,
+                 options: Optional[dict] = None):
+        self.seq_nr = seq_nr
+        self.ack_nr = ack_nr
+        self.flag = flag
+        self.win = win
+        self.dlen = dlen
+        self.cksum = cksum
+        self.data = data
+        self.options = options
+
+
+class Layout:
+    """ Layout of the header of the segments of a connection, which is agreed on in the handshake
+    The extended header appends the high halves of the SEQ and ACK numbers to the legacy one, so that the flag, data
+    length and checksum stay in place. Handshake segments always use the legacy header, which every peer can read.
+    """
+    __slots__ = ('extended', 'header_size', 'payload_size', 'seq_space', 'sack_block')
+
+    def __init__(self, extended: bool):
+        self.extended = extended
+        self.header_size = EXTENDED_HEADER_SIZE if extended else HEADER_SIZE
+        self.payload_size = SEGMENT_SIZE - self.header_size
+        self.seq_space = FOUR_BYTES if extended else TWO_BYTES
+        self.sack_block = struct.Struct(EXTENDED_SACK_FORMAT) if extended else SACK_BLOCK
+
+
+LEGACY = Layout(extended=False)
+EXTENDED = Layout(extended=True)
+
+
+class SegmentEncoder:
+    """ Encodes segments into a single preallocated buffer which is reused for every segment
+    The returned view is only valid until the next segment is encoded. The buffer may be a slot of a larger buffer.
+    """
+
+    def __init__(self, buffer: Optional[memoryview] = None):
+        self._view = memoryview(bytearray(SEGMENT_SIZE)) if buffer is None else buffer
+        self._used = HEADER_SIZE
+
+    def encode(self, seq_nr: int, ack_nr: int, flag: Flag, win: int, data: bytes = b'', options: bytes = b'',
+               short: bool = False, data_sum: Optional[int] = None, layout: Layout = LEGACY) -> memoryview:
+        """ Encodes the segment and returns a view on the result
+        Options are placed in the padding behind the data. Unless the segment is short, it is padded to full size.
+        Given the cached word sum of the data, only the header is summed for the checksum.
+        """
+        if flag in HANDSHAKE_FLAGS:
+            layout = LEGACY
+        header_size = layout.header_size
+        dlen = len(data)
+        end = header_size + dlen
+        used = end + len(options)
+        if used > SEGMENT_SIZE:
+            raise ValueError
+        buffer = self._view
+        buffer[header_size:end] = data
+        buffer[end:used] = options
+        # Restore the padding which was overwritten by a longer previous segment
+        if used < self._used:
+            buffer[used:self._used] = ZEROS[:self._used - used]
+        self._used = used
+        # The legacy header only carries the low halves, a SYNACK may acknowledge a SEQ number which just wrapped
+        if layout.extended:
+            EXTENDED_HEADER.pack_into(buffer, 0, seq_nr & 0xffff, ack_nr & 0xffff, flag.value, win, dlen, 0,
+                                      seq_nr >> 16, ack_nr >> 16)
+        else:
+            HEADER.pack_into(buffer, 0, seq_nr & 0xffff, ack_nr & 0xffff, flag.value, win, dlen, 0)
+        # The zero padding does not change the checksum, so only the header, data and options are summed
+        if data_sum is not None and not options:
+            cksum = fold(word_sum(buffer[:header_size]) + data_sum)
+        else:
+            cksum = checksum(buffer[:used])
+        CKSUM_FIELD.pack_into(buffer, CKSUM_OFFSET, cksum)
+        return self._view[:end] if short else self._view
+
+
+def decode(segment: bytes, verified: Optional[bool] = None, layout: Layout = LEGACY) -> Optional[Header]:
+    """ Decodes a full size or short received segment, returns None if it is malformed or its checksum is invalid
+    The checksum is only checked if it was not already verified, for example in a batch with valid_many.
+    """
+    if verified is False or len(segment) < HEADER_SIZE:
+        return None
+    # The flag is at the same position in both layouts and tells whether the segment has a legacy handshake header
+    flag = FLAGS.get(segment[FLAG_OFFSET])
+    if flag is None:
+        return None
+    handshake = flag in HANDSHAKE_FLAGS
+    if handshake or not layout.extended:
+        layout = LEGACY
+        seq_nr, ack_nr, _, win, dlen, cksum = HEADER.unpack_from(segment)
+    elif len(segment) < EXTENDED_HEADER_SIZE:
+        return None
+    else:
+        seq_nr, ack_nr, _, win, dlen, cksum, seq_high, ack_high = EXTENDED_HEADER.unpack_from(segment)
+        seq_nr |= seq_high << 16
+        ack_nr |= ack_high << 16
+    end = layout.header_size + dlen
+    if dlen > layout.payload_size or len(segment) < end:
+        return None
+    view = memoryview(segment)
+    # Handshake segments carry options in their padding, so it is covered by the checksum as well
+    if not verified and not valid(view, len(view) if handshake else end):
+        return None
+    options = decode_options(view[end:]) if handshake else None
+    return Header(seq_nr, ack_nr, flag, win, dlen, cksum, view[layout.header_size:end], options)
+
+
+def encode_options(options: dict) -> bytes:
+    """ Encodes the options as a list of (kind, length, value) entries """
+    encoded = bytearray()
+    for option, value in options.items():
+        encoded += bytes((option.value, len(value))) + value
+    return bytes(encoded)
+
+
+def decode_options(padding: memoryview) -> dict:
+    """ Decodes the options from the padding of a segment, unknown options are skipped """
+    options = {}
+    i = 0
+    while i + 2 <= len(padding) and padding[i] != Option.END.value:
+        kind, length = padding[i], padding[i + 1]
+        value = bytes(padding[i + 2:i + 2 + length])
+        if len(value) < length:
+            break
+        if kind in OPTIONS:
+            options[OPTIONS[kind]] = value
+        i += 2 + length
+    return options
+
+
+def encode_sack(blocks: [(int, int)], layout: Layout = LEGACY) -> bytes:
+    """ Encodes the selectively acknowledged blocks as ACK payload """
+    block = layout.sack_block
+    payload = bytearray(len(blocks) * block.size)
+    for i, (start, end) in enumerate(blocks):
+        block.pack_into(payload, i * block.size, start, end)
+    return payload
+
+
+def decode_sack(data: memoryview, layout: Layout = LEGACY) -> [(int, int)]:
+    """ Decodes the selectively acknowledged blocks from the ACK payload """
+    block = layout.sack_block
+    if len(data) % block.size:
+        return []
+    return list(block.iter_unpack(data))
+
+
+def frame_message(data: bytes) -> [bytes]:
+    """ Prefixes the message with its length, so that the receiver can tell the messages in the stream apart
+    Returns the chunks to send, the message itself is not copied.
+    """
+    view = memoryview(data).cast('B')
+    return [MESSAGE_HEADER.pack(len(view)), view]
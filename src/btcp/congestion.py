@@ -0,0 +1,63 @@
+import abc
+
+from btcp.constants import INITIAL_CWND, MIN_CWND
+
+
+class CongestionControl(abc.ABC):
+    """ Base class of the pluggable congestion control algorithms
+    The congestion window (cwnd) and slow start threshold (ssthresh) are counted in segments.
+    """
+
+    def __init__(self):
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = float('inf')
+        self._prior = None  # windows before the last reduction on a loss, restored if the loss was spurious
+
+    @abc.abstractmethod
+    def on_ack(self, acked: int, in_flight: int) -> None:
+        """ Called when the given number of segments was newly acknowledged out of in_flight segments in flight """
+
+    @abc.abstractmethod
+    def on_loss(self, in_flight: int) -> None:
+        """ Called when a loss was detected while acknowledgements keep arriving """
+
+    @abc.abstractmethod
+    def on_timeout(self, in_flight: int) -> None:
+        """ Called when a retransmission timer expired """
+
+    def cwnd_limited(self, in_flight: int) -> bool:
+        """ Whether the congestion window, rather than the window of the receiver or the application, limited the
+        segments in flight. Only then an ACK shows that the network can take a larger window (RFC 7661).
+        """
+        return in_flight >= self.cwnd
+
+    def undo(self) -> None:
+        """ Called when the last detected loss turned out to be reordering, restores the windows from before it """
+        if self._prior is not None:
+            self.cwnd, self.ssthresh = max(self.cwnd, self._prior[0]), max(self.ssthresh, self._prior[1])
+            self._prior = None
+
+
+class Reno(CongestionControl):
+    """ Slow start and additive increase, multiplicative decrease congestion avoidance as described in RFC 5681 """
+
+    def on_ack(self, acked: int, in_flight: int) -> None:
+        # The window would otherwise keep growing while the receiver limits the sender
+        if not self.cwnd_limited(in_flight):
+            return
+        if self.cwnd < self.ssthresh:
+            # Slow start grows the window by one segment for every acknowledged segment
+            self.cwnd = min(self.cwnd + acked, self.ssthresh)
+        else:
+            # Congestion avoidance grows the window by about one segment per round trip
+            self.cwnd += acked / self.cwnd
+
+    def on_loss(self, in_flight: int) -> None:
+        self._prior = (self.cwnd, self.ssthresh)
+        self.ssthresh = max(in_flight / 2, MIN_CWND)
+        self.cwnd = self.ssthresh
+
+    def on_timeout(self, in_flight: int) -> None:
+        self._prior = None
+        self.ssthresh = max(in_flight / 2, MIN_CWND)
+        self.cwnd = 1
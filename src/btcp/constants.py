@@ -6,14 +6,46 @@ SERVER_PORT = 30000
 
 # Sizes
 HEADER_SIZE = 10
+FLAG_OFFSET = 4  # position of the flag byte in the header
+DLEN_OFFSET = 6  # position of the data length field in the header
+CKSUM_OFFSET = 8  # position of the checksum field in the header
 PAYLOAD_SIZE = 1008
 SEGMENT_SIZE = HEADER_SIZE + PAYLOAD_SIZE
+EXTENDED_HEADER_SIZE = 14  # header with 32-bit sequence and ACK numbers, which leaves less room for data
 TWO_BYTES = 2 ** 16
+FOUR_BYTES = 2 ** 32
 
 # Communication
 HEADER_FORMAT = '!HHbbHH'
-DATA_FORMAT = f'{PAYLOAD_SIZE}s'
+EXTENDED_HEADER_FORMAT = '!HHbbHHHH'  # the legacy header followed by the high halves of the SEQ and ACK numbers
 MAX_ATTEMPTS = 10
-SEGMENT_KEYS = ['seq_nr', 'ack_nr', 'flag', 'win', 'dlen', 'cksum', 'data']
+SACK_FORMAT = '!HH'  # start and end sequence number of a selectively acknowledged block in the ACK payload
+EXTENDED_SACK_FORMAT = '!II'
+MAX_SACK_BLOCKS = 32
+MAX_WINDOW = 127  # largest value of the signed window field
+MAX_WINDOW_SCALE = 14  # largest shift of the window field, like in TCP
 BUFFER_SIZE = 5
-FIN_TIMEOUT = 3000  # in reality it should be around 30 seconds up to 2 minutes
\ No newline at end of file
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # requested size of the UDP receive buffer of a shared endpoint
+FIN_TIMEOUT = 3000  # in reality it should be around 30 seconds up to 2 minutes
+ACCEPT_TIMEOUT = 3000  # time after which a handshake without new SYN requests is abandoned
+MIN_TIMEOUT = 50  # lower bound of the retransmission timeout in milliseconds
+MAX_TIMEOUT = 60000  # upper bound of the retransmission timeout in milliseconds
+INITIAL_CWND = 4  # initial congestion window in segments
+MIN_CWND = 2  # lower bound of the slow start threshold in segments
+RECV_BATCH = 64  # maximum number of datagrams read per wakeup of the network thread
+BUFFER_POOL_SIZE = 256  # number of reusable receive buffers of a lossy layer
+MAX_BURST = 64  # maximum number of segments sent in a single call, 64 full segments fit in one UDP datagram
+TRACE_CAPACITY = 65536  # number of records kept by the ring buffer of a packet tracer
+CHECKSUM_BATCH = 4  # minimum number of waiting segments of which the checksums are checked in a single call
+DUPACK_THRESHOLD = 3  # number of later acknowledged segments or duplicate ACKs after which a segment is lost
+ACK_EVERY = 2  # number of received data segments after which a delayed ACK is sent
+ACK_DELAY = 10  # longest delay of an ACK in milliseconds, well below the lower bound of the retransmission timeout
+QUICK_ACKS = 16  # number of data segments acknowledged right away at the start and after a disorder
+MESSAGE_FORMAT = '!I'  # length prefix of every message sent with send_message
+IDLE_TIMEOUT = 10000  # time in milliseconds after which an idle pooled connection is disconnected
+POOL_SIZE = 8  # maximum number of idle connections kept by a connection pool
+COOKIE_SIZE = 8  # length of a fast open cookie in bytes
+MAX_PROBE_INTERVAL = 8000  # upper bound in milliseconds of the backed off interval between zero window probes
+STREAM_FORMAT = '!HI'  # stream ID and stream offset in front of the data of a segment of a multi-stream connection
+DEFAULT_STREAM = 0  # stream which carries the data of send on a multi-stream connection
+HANDSHAKE_TIMEOUT = 3000  # time in milliseconds after which a client gives up on connecting or disconnecting
\ No newline at end of file
@@ -0,0 +1,46 @@
+from btcp.constants import QUICK_ACKS
+
+
+class DelayedAck:
+    """ Delayed acknowledgement policy of a receiver, like in TCP (RFC 1122)
+    In-order data is acknowledged once every few segments or when a short timer expires, so that a single ACK covers
+    several segments. Segments which reveal or fill a gap are acknowledged right away to drive fast retransmit.
+    Like the quick ACK mode of Linux, a number of segments at the start of the connection and after every disorder are
+    acknowledged right away as well, since the congestion window of the sender is then small and a delayed ACK would
+    stall it for the whole delay.
+    """
+
+    def __init__(self, every: int, delay: int):
+        self.every = every  # number of received segments after which an ACK is sent, 1 acknowledges every segment
+        self.delay = delay  # longest time (in milliseconds) for which received data is left unacknowledged
+        self.deadline = None  # time at which the pending ACK is due, None if all received data was acknowledged
+        self._unacked = 0
+        self._quick = QUICK_ACKS  # number of upcoming segments which are acknowledged right away
+
+    def on_data(self, now: int, in_order: bool, full: bool, window: int) -> bool:
+        """ Registers a received data segment, returns whether an ACK should be sent right away
+        Besides segments which are out of order or duplicates, a segment which is not full is acknowledged right away
+        since it ends a write of the sender. So is any segment once the last advertised window was almost full, as the
+        sender then waits for the window update.
+        """
+        self._unacked += 1
+        if not in_order:
+            self._quick = QUICK_ACKS
+            return True
+        if self._quick:
+            self._quick -= 1
+            return True
+        if not full or window < self.every or self._unacked >= self.every or self.due(now):
+            return True
+        if self.deadline is None:
+            self.deadline = now + self.delay
+        return False
+
+    def due(self, now: int) -> bool:
+        """ Checks whether the timer of the pending ACK expired """
+        return self.deadline is not None and now >= self.deadline
+
+    def sent(self) -> None:
+        """ Called whenever an ACK was sent, which covers all data received before it """
+        self._unacked = 0
+        self.deadline = None
@@ -21,3 +21,26 @@ class State(Enum):
     DISC_PEND = 3
     RECV = 4
     SEND = 5
+
+
+@unique
+class Option(Enum):
+    """ Options negotiated in the padding of the SYN and SYNACK segments """
+    END = 0
+    SHORT_SEGMENTS = 1
+    WINDOW_SCALE = 2
+    EXTENDED_SEQUENCE = 3
+    DELAYED_ACK = 4
+    FAST_OPEN = 5
+    STREAMS = 6
+    SACK = 7
+
+
+@unique
+class TraceEvent(Enum):
+    """ Events recorded by the packet tracer """
+    SEND = 0
+    RECV = 1
+    RETRANSMIT = 2
+    DROP = 3
+    ADVANCE = 4
@@ -0,0 +1,23 @@
+import hashlib
+import hmac
+import os
+
+from btcp.constants import COOKIE_SIZE
+
+
+class FastOpen:
+    """ Issues and checks the fast open cookies of a server, like TCP Fast Open (RFC 7413)
+    A cookie is a MAC of the IP address of the client under a secret of the server, so only a client which received it
+    in an earlier handshake from that address can present it. The server keeps no state per client.
+    """
+
+    def __init__(self):
+        self._secret = os.urandom(16)
+
+    def cookie(self, address) -> bytes:
+        """ Returns the cookie of the client with the given address """
+        return hmac.new(self._secret, address[0].encode(), hashlib.sha256).digest()[:COOKIE_SIZE]
+
+    def valid(self, address, cookie: bytes) -> bool:
+        """ Checks the cookie presented by the client with the given address """
+        return hmac.compare_digest(cookie, self.cookie(address))
@@ -0,0 +1,188 @@
+import heapq
+import random
+import re
+import threading
+import time
+from typing import Callable, Optional
+
+UNITS = {'us': 0.001, 'ms': 1, 's': 1000,  # delays in milliseconds
+         'bit': 1, 'kbit': 1e3, 'mbit': 1e6, 'gbit': 1e9,  # rates in bits per second
+         'bps': 8, 'kbps': 8e3, 'mbps': 8e6, 'gbps': 8e9}
+
+
+class Impairment:
+    """ Seeded emulator of an unreliable link, configured with the same parameters as netem
+    Every segment put into the network is lost, duplicated, corrupted, delayed and reordered, all decided by a single
+    random generator. Given the same seed and the same segments, the link therefore behaves the same in every run.
+    """
+
+    def __init__(self, loss: float = 0, loss_correlation: float = 0, gemodel: Optional[tuple] = None,
+                 duplicate: float = 0, corrupt: float = 0, reorder: float = 0, reorder_correlation: float = 0,
+                 delay: float = 0, jitter: float = 0, rate: Optional[float] = None, seed=None):
+        self.loss = loss  # probability that a segment is lost
+        self.loss_correlation = loss_correlation  # dependence of the loss of a segment on the previous one
+        self.gemodel = gemodel  # Gilbert-Elliott (p, r, 1-h, 1-k) bursty loss, which replaces the random loss
+        self.duplicate = duplicate  # probability that a segment is sent twice
+        self.corrupt = corrupt  # probability that a single bit of a segment is flipped
+        self.reorder = reorder  # probability that a segment skips the delay and overtakes the ones before it
+        self.reorder_correlation = reorder_correlation
+        self.delay = delay  # in milliseconds
+        self.jitter = jitter  # maximum deviation of the delay in milliseconds
+        self.rate = rate  # bandwidth cap in bits per second, None is unlimited
+        self._random = random.Random(seed)
+        self._last = {}  # previous random values of the correlated decisions
+        self._bad = False  # state of the Gilbert-Elliott model
+        self._link_free = 0  # time at which the capped link finished sending the previous segment
+
+    @classmethod
+    def parse(cls, options: str, seed=None) -> 'Impairment':
+        """ Creates the impairment from netem options, for example 'loss 10% 25% delay 20ms reorder 25% 50%' """
+        words = options.split()
+        kwargs = {}
+        i = 0
+
+        def values(count: int) -> [str]:
+            """ Takes at least one and up to count numeric arguments following the current option """
+            taken = []
+            while len(taken) < count and i + 1 + len(taken) < len(words) \
+                    and re.match(r'^[\d.]', words[i + 1 + len(taken)]):
+                taken.append(words[i + 1 + len(taken)])
+            if not taken:
+                raise ValueError(f'Missing value of impairment option: {words[i]}')
+            return taken
+
+        while i < len(words):
+            option = words[i]
+            if option == 'loss' and i + 1 < len(words) and words[i + 1] in ('gemodel', 'gimodel'):
+                i += 1
+                args = [cls._percent(arg) for arg in values(4)]
+                # Missing parameters take the netem defaults: r = 100%, 1-h = 100% and 1-k = 0%
+                kwargs['gemodel'] = tuple(args + [1, 1, 0][len(args) - 1:])
+            elif option == 'loss':
+                args = values(2)
+                kwargs['loss'] = cls._percent(args[0])
+                kwargs['loss_correlation'] = cls._percent(args[1]) if len(args) > 1 else 0
+            elif option in ('duplicate', 'corrupt'):
+                args = values(2)
+                kwargs[option] = cls._percent(args[0])
+            elif option == 'reorder':
+                args = values(2)
+                kwargs['reorder'] = cls._percent(args[0])
+                kwargs['reorder_correlation'] = cls._percent(args[1]) if len(args) > 1 else 0
+            elif option == 'delay':
+                args = values(3)
+                kwargs['delay'] = cls._unit(args[0], 'ms')
+                kwargs['jitter'] = cls._unit(args[1], 'ms') if len(args) > 1 else 0
+            elif option == 'rate':
+                args = values(1)
+                kwargs['rate'] = cls._unit(args[0], 'bit')
+            else:
+                raise ValueError(f'Unsupported impairment option: {option}')
+            i += 1 + len(args)
+        return cls(seed=seed, **kwargs)
+
+    @staticmethod
+    def _percent(value: str) -> float:
+        return float(value.rstrip('%')) / 100
+
+    @staticmethod
+    def _unit(value: str, default: str) -> float:
+        match = re.match(r'^([\d.]+)([a-z]*)$', value.lower())
+        if match is None or (match.group(2) or default) not in UNITS:
+            raise ValueError(f'Invalid impairment value: {value}')
+        return float(match.group(1)) * UNITS[match.group(2) or default]
+
+    def impair(self, segment: bytes, now: float) -> [(float, bytes)]:
+        """ Decides the fate of a segment sent at the given time (in seconds)
+        Returns the copies of the segment which reach the network with the time at which they are to be delivered.
+        """
+        if self._lost():
+            return []
+        data = bytes(segment)
+        if self.corrupt and self._random.random() < self.corrupt:
+            corrupted = bytearray(data)
+            bit = self._random.randrange(len(corrupted) * 8)
+            corrupted[bit // 8] ^= 1 << (bit % 8)
+            data = bytes(corrupted)
+        # Segments queue behind each other on a link with limited bandwidth
+        departure = now
+        if self.rate:
+            departure = max(now, self._link_free) + len(data) * 8 / self.rate
+            self._link_free = departure
+        # A reordered segment is sent right away while the others are delayed
+        delay = self.delay
+        if delay and self.reorder and self._correlated('reorder', self.reorder_correlation) < self.reorder:
+            delay = 0
+        elif self.jitter:
+            delay = max(delay + self._random.uniform(-self.jitter, self.jitter), 0)
+        due = departure + delay / 1000
+        copies = [(due, data)]
+        if self.duplicate and self._random.random() < self.duplicate:
+            copies.append((due, data))
+        return copies
+
+    def _lost(self) -> bool:
+        """ Decides whether the next segment is lost """
+        if self.gemodel:
+            p, r, bad_loss, good_loss = self.gemodel
+            # Move between the good and the bad state of the link, which have their own loss probability
+            if self._random.random() < (r if self._bad else p):
+                self._bad = not self._bad
+            return self._random.random() < (bad_loss if self._bad else good_loss)
+        return bool(self.loss) and self._correlated('loss', self.loss_correlation) < self.loss
+
+    def _correlated(self, name: str, correlation: float) -> float:
+        """ Returns a random value which depends on the previous value of the same decision, like netem does """
+        value = self._random.random()
+        if correlation:
+            value = correlation * self._last.get(name, value) + (1 - correlation) * value
+        self._last[name] = value
+        return value
+
+
+class DelayLine:
+    """ Holds delayed segments and sends them from a separate thread once they are due """
+
+    def __init__(self, send: Callable[[bytes, tuple], None]):
+        self._send = send
+        self._queue = []  # heap of (due time, counter, segment, address)
+        self._counter = 0  # keeps segments with the same due time in order
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, due: float, segment: bytes, address) -> None:
+        """ Schedules the segment to be sent at the due time (in seconds) """
+        with self._condition:
+            heapq.heappush(self._queue, (due, self._counter, segment, address))
+            self._counter += 1
+            self._condition.notify()
+
+    def stop(self) -> None:
+        """ Sends the segments which are still underway and stops the thread """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        with self._condition:
+            while not self._stopped:
+                wait = self._queue[0][0] - time.monotonic() if self._queue else None
+                if wait is None or wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                due, counter, segment, address = heapq.heappop(self._queue)
+                self._deliver(segment, address)
+            # Like on a real link, segments which were sent before the socket closed still arrive
+            while self._queue:
+                due, counter, segment, address = heapq.heappop(self._queue)
+                self._deliver(segment, address)
+
+    def _deliver(self, segment: bytes, address) -> None:
+        try:
+            self._send(segment, address)
+        except OSError:
+            # The segment is lost like any other on an unreliable link
+            pass
@@ -0,0 +1,59 @@
+import abc
+from typing import Optional
+
+from btcp.constants import FLAG_OFFSET, HEADER_SIZE
+from btcp.enums import Flag, State
+from btcp.fast_open import FastOpen
+from btcp.trace import Tracer
+
+
+class BTCPListener(abc.ABC):
+    """ Listening half shared by the thread and asyncio server sockets
+    Incoming segments are demultiplexed by the address of the client into separate connections, which a SYN request
+    opens and which are forgotten once they end.
+    """
+
+    def setup_listener(self, window: int, timeout: int, show_prints: bool, short_segments: bool,
+                       tracer: Optional[Tracer], ack_every: int, ack_delay: int, fast_open: bool) -> None:
+        """ Prepares the socket for demultiplexing the segments of its connections """
+        self._window = window
+        self._timeout = timeout
+        self._short_segments = short_segments
+        self._ack_every = ack_every  # delayed ACK policy of the connections, see DelayedAck
+        self._ack_delay = ack_delay
+        self.fast_open = FastOpen() if fast_open else None  # issues the cookies of the clients, None if disabled
+        self.show_prints = show_prints
+        self._connections = {}  # connections keyed by the address of the client
+        self._tracer = tracer  # packet tracer with which the segments of every connection are recorded
+
+    def lossy_layer_input(self, segment: bytes, address) -> None:
+        """ Hands a segment which arrived from the network to the connection of its client """
+        connection = self._connections.get(address)
+        syn = len(segment) >= HEADER_SIZE and segment[FLAG_OFFSET] == Flag.SYN.value
+        # A new SYN request of the client ends the previous connection from the same address right away
+        if connection is not None and connection.state is State.DISC_PEND and syn:
+            connection.terminate()
+            connection = None
+        if connection is None:
+            # Only a SYN request opens a new connection
+            if not syn:
+                self._lossy_layer.release(segment)
+                return
+            connection = self.new_connection(address)
+            if self._tracer is not None:
+                connection.trace(self._tracer, f'server {address[0]}:{address[1]}')
+            self._connections[address] = connection
+        connection.lossy_layer_input(segment, address)
+
+    @abc.abstractmethod
+    def new_connection(self, address):
+        """ Creates the connection of the client with the given address """
+
+    @abc.abstractmethod
+    def established(self, connection) -> None:
+        """ Hands the connection whose handshake completed to accept """
+
+    def remove(self, connection) -> None:
+        """ Stops demultiplexing segments to the closed connection """
+        if self._connections.get(connection.address) is connection:
+            del self._connections[connection.address]
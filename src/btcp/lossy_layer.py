@@ -1,28 +1,72 @@
+import errno
 import socket
 import select
+import struct
+import sys
 import threading
-from btcp.constants import SEGMENT_SIZE
-import random, time
+from collections import deque
+from btcp.constants import SEGMENT_SIZE, RECV_BATCH, BUFFER_POOL_SIZE
+from btcp.impairment import DelayLine
+import time
+
+# Linux can split one large datagram into equally sized datagrams (UDP generic segmentation offload)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+GSO_SIZE = struct.Struct('=H')
+# Errors with which the kernel refuses segmentation offload as such, anything else only fails the current burst
+GSO_UNSUPPORTED = (errno.EINVAL, errno.ENOPROTOOPT, errno.EOPNOTSUPP)
+# Without non-blocking reads only a single datagram can be read per wakeup
+DONTWAIT = getattr(socket, 'MSG_DONTWAIT', None)
+
+# Reusable receive buffers, so that no new object has to be allocated for every incoming segment.
+# Buffers are handed out by the network thread and given back by the socket once it handled the segment,
+# a buffer which is never given back is simply left to the garbage collector.
+class BufferPool:
+    def __init__(self, size=BUFFER_POOL_SIZE):
+        self._size = size
+        self._free = deque(bytearray(SEGMENT_SIZE) for _ in range(size))
+
+    # Take a free buffer, a new one is allocated when all are in use
+    def acquire(self):
+        try:
+            return self._free.pop()
+        except IndexError:
+            return bytearray(SEGMENT_SIZE)
+
+    # Give back the buffer of a received segment, the segment must not be used afterwards
+    def release(self, segment):
+        buffer = getattr(segment, 'obj', segment)
+        if type(buffer) is bytearray and len(buffer) == SEGMENT_SIZE and len(self._free) < self._size:
+            self._free.append(buffer)
 
 # Continuously read from the socket and whenever a segment arrives, 
 # call the lossy_layer_input method of the associated socket. 
+# Every datagram which is ready is read per wakeup, into a buffer taken from the pool.
 # When flagged, return from the function.
-def handle_incoming_segments(bTCP_sock, event, udp_sock):
+def handle_incoming_segments(bTCP_sock, event, udp_sock, pool):
     while not event.is_set():
         # We do not block here, because we might never check the loop condition in that case
         rlist, wlist, elist = select.select([udp_sock], [], [], 1)
-        if rlist:
+        # Let the socket run its timers while the network is quiet
+        if not rlist:
+            bTCP_sock.lossy_layer_idle()
+            continue
+        # Drain the socket without blocking, the first datagram is known to be ready
+        for i in range(RECV_BATCH if DONTWAIT else 1):
+            buffer = pool.acquire()
             try:
-                segment, address = udp_sock.recvfrom(SEGMENT_SIZE)
-                bTCP_sock.lossy_layer_input(segment, address)
-            except ConnectionResetError:
-                pass
+                size, address = udp_sock.recvfrom_into(buffer, SEGMENT_SIZE, DONTWAIT if i else 0)
+            except (BlockingIOError, ConnectionResetError):
+                pool.release(buffer)
+                break
+            bTCP_sock.lossy_layer_input(memoryview(buffer)[:size], address)
 
 # The lossy layer emulates the network layer in that it provides bTCP with 
-# an unreliable segment delivery service between a and b. When the lossy layer is created, 
+# an unreliable segment delivery service between a and b. When the lossy layer is started, 
 # a thread is started that calls handle_incoming_segments. 
+# Optionally the segments which are put into the network are impaired by a seeded emulator of an unreliable link,
+# which makes the tests repeatable without changing the network interface.
 class LossyLayer:
-    def __init__(self, bTCP_sock, a_ip, a_port, b_ip, b_port):
+    def __init__(self, bTCP_sock, a_ip, a_port, b_ip, b_port, impairment=None):
         self._bTCP_sock = bTCP_sock
         self._b_ip = b_ip
         self._b_port = b_port
@@ -30,27 +74,60 @@ class LossyLayer:
         self._udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._udp_sock.bind((a_ip, a_port))
         self._event = threading.Event()
-        self._thread = threading.Thread(target=handle_incoming_segments, args=(self._bTCP_sock, self._event, self._udp_sock))
+        self._pool = BufferPool()
+        self._gso = sys.platform.startswith('linux')
+        self._impairment = impairment
+        self._impairment_lock = threading.Lock()
+        self._delay_line = DelayLine(self._udp_sock.sendto) if impairment else None
+        self._thread = threading.Thread(target=handle_incoming_segments,
+                                        args=(self._bTCP_sock, self._event, self._udp_sock, self._pool))
+
+    # Start the network thread once the socket stored the lossy layer, as the first datagram may arrive right away
+    def start(self):
         self._thread.start()
 
     # Flag the thread that it can stop and close the socket.
     def destroy(self):
         self._event.set()
         self._thread.join()
+        if self._delay_line:
+            self._delay_line.stop()
         self._udp_sock.close()
 
-    # Put the segment into the network
-    def send_segment(self, segment):
-        self._udp_sock.sendto(segment, (self._b_ip, self._b_port))
-
-        # # Testing loss
-        # loss = random.uniform(0, 1)
-        # if loss > 0.25:
-        #     self._udp_sock.sendto(segment, (self._b_ip, self._b_port))
-        # else:
-        #     print('##### Segment lost #####')
-        # # Testing duplicates
-        # dup = random.uniform(0, 1)
-        # if dup < 0.1:
-        #     print('##### Duplicate was sent #####')
-        #     self._udp_sock.sendto(segment, (self._b_ip, self._b_port))
+    # Put the segment into the network, by default it is sent to b
+    def send_segment(self, segment, address=None):
+        address = address or (self._b_ip, self._b_port)
+        if self._impairment:
+            self._impair(segment, address)
+        else:
+            self._udp_sock.sendto(segment, address)
+
+    # Put a burst of segments which are stored back to back into the network in a single call.
+    # Every segment has the given size, except for the last one which may be shorter.
+    def send_burst(self, burst, size, address=None):
+        address = address or (self._b_ip, self._b_port)
+        if self._gso and len(burst) > size and not self._impairment:
+            try:
+                self._udp_sock.sendmsg([burst], [(socket.IPPROTO_UDP, UDP_SEGMENT, GSO_SIZE.pack(size))], 0, address)
+                return
+            except OSError as error:
+                # Fall back to a datagram per segment, for good only if segmentation offload is not supported
+                if error.errno in GSO_UNSUPPORTED:
+                    self._gso = False
+        sendto = self._impair if self._impairment else self._udp_sock.sendto
+        for start in range(0, len(burst), size):
+            sendto(burst[start:start + size], address)
+
+    # Give back the buffer of a received segment once it was handled
+    def release(self, segment):
+        self._pool.release(segment)
+
+    # Let the emulated link decide what happens to the segment, delayed copies are sent by the delay line
+    def _impair(self, segment, address):
+        with self._impairment_lock:
+            now = time.monotonic()
+            for due, copy in self._impairment.impair(segment, now):
+                if due <= now:
+                    self._udp_sock.sendto(copy, address)
+                else:
+                    self._delay_line.put(due, copy, address)
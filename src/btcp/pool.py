@@ -0,0 +1,114 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from btcp.client_socket import BTCPClientSocket
+from btcp.constants import IDLE_TIMEOUT, POOL_SIZE
+from btcp.enums import State
+
+
+class ConnectionPool:
+    """ Reuses established client connections to the server, so that only the first message pays for the handshake
+    Released connections are kept idle for later use until the idle timeout expires, after which a timer disconnects
+    them, also while the pool is not used. Every connection of the pool is bound to a free port picked by the operating
+    system.
+    """
+
+    def __init__(self, window: int, timeout: int, show_prints: bool = False, size: int = POOL_SIZE,
+                 idle_timeout: int = IDLE_TIMEOUT, **options):
+        self._window = window
+        self._timeout = timeout
+        self._show_prints = show_prints
+        self._size = size  # maximum number of idle connections
+        self._idle_timeout = idle_timeout  # in milliseconds
+        self._options = options  # further arguments of the client sockets
+        self._idle = []  # (connection, time of release) pairs, the most recently released last
+        self._lock = threading.Lock()
+        self._timer = None  # timer which expires the oldest idle connection, None while no connection is idle
+
+    def acquire(self) -> Optional[BTCPClientSocket]:
+        """ Returns an established connection, reusing an idle one if possible
+        Returns None if no new connection could be established
+        """
+        self._expire()
+        with self._lock:
+            connection = self._idle.pop()[0] if self._idle else None
+        if connection is not None:
+            return connection
+        connection = BTCPClientSocket(self._window, self._timeout, self._show_prints, port=0, **self._options)
+        connection.connect()
+        if connection.state is not State.CONN_EST:
+            connection.close()
+            return None
+        return connection
+
+    def release(self, connection: BTCPClientSocket) -> None:
+        """ Gives the connection back to the pool, it is disconnected if the pool already holds enough idle ones """
+        if connection.state is State.CONN_EST:
+            with self._lock:
+                if len(self._idle) < self._size:
+                    self._idle.append((connection, self._time()))
+                    connection = None
+        if connection is not None:
+            self._discard(connection)
+        self._expire()
+
+    @contextmanager
+    def connection(self) -> Iterator[Optional[BTCPClientSocket]]:
+        """ Acquires a connection for the duration of the with block """
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            if connection is not None:
+                self.release(connection)
+
+    def send_message(self, data: bytes) -> bool:
+        """ Sends a message over a pooled connection, returns whether a connection was available """
+        with self.connection() as connection:
+            if connection is None:
+                return False
+            connection.send_message(data)
+            return True
+
+    def close(self) -> None:
+        """ Disconnects all idle connections """
+        with self._lock:
+            idle, self._idle = self._idle, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _expire(self) -> None:
+        """ Disconnects the connections which were idle for longer than the idle timeout
+        The timer is then armed for the next connection to expire.
+        """
+        deadline = self._time() - self._idle_timeout
+        with self._lock:
+            expired = [connection for connection, released in self._idle if released <= deadline]
+            self._idle = [(connection, released) for connection, released in self._idle if released > deadline]
+            if self._idle and self._timer is None:
+                delay = self._idle[0][1] - deadline
+                self._timer = threading.Timer(delay / 1000, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        for connection in expired:
+            self._discard(connection)
+
+    def _on_timer(self) -> None:
+        """ Called by the timer once the oldest idle connection may have expired """
+        with self._lock:
+            self._timer = None
+        self._expire()
+
+    @staticmethod
+    def _discard(connection: BTCPClientSocket) -> None:
+        connection.disconnect()
+        connection.close()
+
+    @staticmethod
+    def _time() -> int:
+        return int(round(time.time() * 1000))
@@ -0,0 +1,74 @@
+from collections import deque
+from typing import Optional
+
+from btcp.constants import TWO_BYTES
+
+
+class ReassemblyBuffer:
+    """ Reorder buffer which releases the received data as soon as it is contiguous
+    Without keeping the data, only the received sequence number ranges are tracked, for a receiver which delivers the
+    data in another way but still acknowledges it.
+    """
+
+    def __init__(self, seq_nr: int, seq_space: int = TWO_BYTES, keep_data: bool = True):
+        self.seq_nr = seq_nr  # sequence number of the next expected byte
+        self._space = seq_space  # number of distinct sequence numbers before they wrap around
+        self._keep = keep_data
+        self.offset = 0  # stream offset of the next expected byte
+        self._pending = {}  # out-of-order chunks (or only their lengths) keyed by their stream offset
+        self._ready = deque()  # in-order chunks which were not yet delivered
+
+    def add(self, seq_nr: int, data: bytes) -> bool:
+        """ Stores the chunk starting at the given sequence number, returns False if it is a duplicate """
+        # Sequence numbers behind the next expected one were already received
+        distance = (seq_nr - self.seq_nr) % self._space
+        if distance >= self._space // 2:
+            return False
+        offset = self.offset + distance
+        if offset in self._pending:
+            return False
+        self._pending[offset] = data if self._keep else len(data)
+        # Release every chunk which became contiguous
+        while self.offset in self._pending:
+            chunk = self._pending.pop(self.offset)
+            size = self._length(chunk)
+            if self._keep:
+                self._ready.append(chunk)
+            self.offset += size
+            self.seq_nr = (self.seq_nr + size) % self._space
+        return True
+
+    @property
+    def held(self) -> int:
+        """ Number of chunks held until they are contiguous or delivered """
+        return len(self._pending) + len(self._ready) if self._keep else 0
+
+    @property
+    def has_gap(self) -> bool:
+        """ Whether out-of-order data is waiting for the data before it """
+        return bool(self._pending)
+
+    def sack_blocks(self, limit: int) -> [(int, int)]:
+        """ Returns up to limit (start, end) sequence number ranges of the received out-of-order data """
+        blocks = []
+        for offset in sorted(self._pending):
+            end = offset + self._length(self._pending[offset])
+            if blocks and blocks[-1][1] == offset:
+                blocks[-1][1] = end
+            elif len(blocks) < limit:
+                blocks.append([offset, end])
+            else:
+                break
+        return [(self._seq(start), self._seq(end)) for start, end in blocks]
+
+    def _seq(self, offset: int) -> int:
+        """ Converts a stream offset into a sequence number """
+        return (self.seq_nr + offset - self.offset) % self._space
+
+    def _length(self, chunk) -> int:
+        """ Returns the length of a pending chunk, of which only the length is kept without the data """
+        return len(chunk) if self._keep else chunk
+
+    def pop(self) -> Optional[bytes]:
+        """ Returns the next in-order chunk or None if there is none """
+        return self._ready.popleft() if self._ready else None
@@ -0,0 +1,53 @@
+import threading
+from collections import deque
+from typing import List, Optional
+
+
+class ReceiveBuffer:
+    """ Bounded buffer of the received segments between the network thread and the socket, dropping new segments
+    while it is full
+    Appending to and popping from a deque are atomic, so the lock is only taken to wake up a waiting consumer. The
+    network thread never blocks: a segment which does not fit is dropped like on a full router queue (drop-tail) and
+    the sender recovers it like any other loss.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity  # maximum number of segments held
+        self.drops = 0  # segments which were dropped because the buffer was full
+        self._segments = deque()
+        self._ready = threading.Condition(threading.Lock())
+        self._waiting = False  # whether the consumer waits for the next segment
+
+    def __len__(self) -> int:
+        return len(self._segments)
+
+    def put(self, segment) -> bool:
+        """ Appends the segment, returns False if it was dropped because the buffer is full """
+        if len(self._segments) >= self.capacity:
+            self.drops += 1
+            return False
+        self._segments.append(segment)
+        # The consumer sets the flag while holding the lock, so it either sees the segment or is notified
+        if self._waiting:
+            with self._ready:
+                self._ready.notify()
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """ Takes the oldest segment, waiting up to timeout seconds (forever if None), None if none arrived """
+        if not self._segments:
+            with self._ready:
+                self._waiting = True
+                try:
+                    if not self._segments:
+                        self._ready.wait(timeout)
+                finally:
+                    self._waiting = False
+        return self._segments.popleft() if self._segments else None
+
+    def take_all(self) -> List[bytes]:
+        """ Takes every segment in the buffer without waiting """
+        segments = []
+        while self._segments:
+            segments.append(self._segments.popleft())
+        return segments
@@ -0,0 +1,115 @@
+from typing import Optional, Tuple
+
+from btcp.codec import Header, encode_sack
+from btcp.constants import DEFAULT_STREAM, MAX_SACK_BLOCKS
+from btcp.delayed_ack import DelayedAck
+from btcp.enums import Flag, Option
+from btcp.fast_open import FastOpen
+from btcp.reassembly import ReassemblyBuffer
+from btcp.streams import StreamDemux
+
+
+class BTCPReceiver:
+    """ Receiving half of a bTCP socket, used next to BTCPSocket by the thread and asyncio server connections
+    It answers the SYN request, reassembles the received data per connection or per stream and acknowledges it.
+    """
+
+    def setup_receiver(self, delayed_ack: DelayedAck) -> None:
+        """ Prepares the socket for receiving data as a server connection """
+        self._delayed_ack = delayed_ack  # delayed ACK policy of the data this end receives
+        self._offer_streams = True
+        self.reassembly = None  # reorder buffer of the received data, created once a SYN request arrives
+        self.demux = None  # per stream reassembly of the received data of a multi-stream connection
+        self._synack = None  # SEQ number, ACK number and options of the last SYNACK
+
+    def answer_syn(self, message: Header, fast_open: Optional[FastOpen] = None) -> bool:
+        """ Answers a SYN request with a SYNACK carrying the agreed options, returns whether its data was accepted
+        With fast open enabled, the data of a client which presents the cookie of its address is accepted right away and
+        every other client which asks for it receives a cookie for its next connection.
+        """
+        options = self.apply_options(message.options)
+        early = False
+        if fast_open is not None and Option.FAST_OPEN in message.options:
+            early = message.dlen > 0 and not self.multi_stream \
+                and fast_open.valid(self._peer, message.options[Option.FAST_OPEN])
+            options[Option.FAST_OPEN] = fast_open.cookie(self._peer)
+        # The SYN takes up one sequence number, accepted data follows it
+        start = self.safe_incr(message.seq_nr)
+        # The streams of a multi-stream connection hold their own data, the connection only tracks what arrived
+        self.reassembly = ReassemblyBuffer(start, self.layout.seq_space, keep_data=not self.multi_stream)
+        self.demux = StreamDemux() if self.multi_stream else None
+        if early:
+            self.reassembly.add(start, bytes(message.data))
+        self.ack_nr = self.reassembly.seq_nr
+        self._synack = (self.seq_nr, self.ack_nr, options)
+        self.post(self.seq_nr, self.ack_nr, Flag.SYNACK, options=options)
+        return early
+
+    def repeat_synack(self) -> None:
+        """ Answers a retransmitted SYN request once the connection was already established by data in the SYN """
+        seq_nr, ack_nr, options = self._synack
+        self.post(seq_nr, ack_nr, Flag.SYNACK, options=options)
+
+    def send_recv_ack(self, message: Header) -> bool:
+        """ Stores the data of the segment in the reassembly buffer and acknowledges it
+        Returns False if the delayed ACK policy holds the acknowledgement back, it then tells when the ACK is due.
+        """
+        gap = self.reassembly.has_gap
+        # Store a copy of the data without the padding bytes, duplicates are ignored by the buffer
+        added = self.store_data(message)
+        in_order = added and not gap and not self.reassembly.has_gap
+        full = message.dlen == self.layout.payload_size
+        # Legacy clients only take an ACK of exactly one segment, also for a duplicate
+        if not self.cumulative_acks:
+            self.acknowledge_post(message, Flag.ACK)
+        elif not self.delayed_acks or self._delayed_ack.on_data(self.time(), in_order, full, self.recv_win):
+            self.cumulative_ack()
+        else:
+            return False
+        return True
+
+    def cumulative_ack(self) -> None:
+        """ Acknowledges all in-order data and reports the out-of-order blocks as selective acknowledgements """
+        sack = encode_sack(self.reassembly.sack_blocks(MAX_SACK_BLOCKS), self.layout) if self.cumulative_acks else b''
+        self.post(self.seq_nr, self.reassembly.seq_nr, Flag.ACK, data=sack)
+        self._delayed_ack.sent()
+
+    def store_data(self, message: Header) -> bool:
+        """ Stores the data of a received segment for delivery, returns False if it was a duplicate
+        On a multi-stream connection the data goes to its stream right away, the reassembly of the connection then only
+        tracks which segments arrived for the acknowledgements.
+        """
+        data = bytes(message.data)
+        added = self.reassembly.add(message.seq_nr, data)
+        if not added:
+            self.stats.duplicates += 1
+        elif self.demux is not None:
+            self.demux.add(data)
+        return added
+
+    def next_chunk(self) -> Optional[Tuple[int, bytes]]:
+        """ Returns the next (stream ID, chunk) of received data which can be delivered, None if there is none
+        Without streams, all data belongs to the default stream.
+        """
+        if self.demux is not None:
+            return self.demux.pop()
+        chunk = self.reassembly.pop()
+        return None if chunk is None else (DEFAULT_STREAM, chunk)
+
+    def receive_space(self) -> int:
+        """ Returns the number of segments this end can still take
+        Besides the segments waiting to be handled, the data the reassembly buffer holds until the application reads it
+        all takes up room.
+        """
+        held = self.reassembly.held if self.reassembly is not None else 0
+        if self.demux is not None:
+            held += self.demux.held
+        return super().receive_space() - held
+
+    def window_update_due(self) -> bool:
+        """ Whether the application read enough data since a small window was advertised that the sender should be
+        told right away, instead of waiting for the next data or probe
+        Like in TCP, the window is only reopened once it can take a good part of the buffer (silly window avoidance).
+        """
+        threshold = max(self._window // 2, 1)
+        return self.recv_win < threshold <= self.receive_space()
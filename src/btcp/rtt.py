@@ -0,0 +1,32 @@
+from btcp.constants import MIN_TIMEOUT, MAX_TIMEOUT
+
+
+class RttEstimator:
+    """ Estimates the retransmission timeout (in milliseconds) from RTT samples as described in RFC 6298 """
+
+    def __init__(self, timeout: int):
+        self.srtt = None  # smoothed round trip time
+        self.rttvar = None  # round trip time variation
+        self._rto = self._bound(timeout)
+
+    @property
+    def rto(self) -> int:
+        """ The current retransmission timeout """
+        return self._rto
+
+    def sample(self, rtt: int) -> None:
+        """ Updates the estimation with a measurement of a segment which was not retransmitted (Karn's rule) """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self._rto = self._bound(self.srtt + max(1, 4 * self.rttvar))
+
+    def backoff(self) -> None:
+        """ Doubles the retransmission timeout after it expired """
+        self._rto = self._bound(self._rto * 2)
+
+    def _bound(self, rto: float) -> int:
+        return int(min(max(rto, MIN_TIMEOUT), MAX_TIMEOUT))
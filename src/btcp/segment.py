@@ -1,11 +1,17 @@
 class Segment:
     """ Object that represents the segment with its meta data """
+    __slots__ = ('sent', 'seq_nr', 'exp_ack', 'is_acked', 'start_time', 'deadline', 'retransmitted', 'data',
+                 'data_sum', 'lost')
 
-    def __init__(self, data, sent=False, seq_nr=None, exp_ack=None, is_acked=False, timer=0, start_time=0):
+    def __init__(self, data, sent=False, seq_nr=None, exp_ack=None, is_acked=False, start_time=0, deadline=0,
+                 retransmitted=False):
         self.sent = sent
         self.seq_nr = seq_nr
         self.exp_ack = exp_ack
         self.is_acked = is_acked
-        self.timer = timer
         self.start_time = start_time
+        self.deadline = deadline
+        self.retransmitted = retransmitted
         self.data = data
+        self.data_sum = None  # word sum of the data, kept so that retransmissions only sum the header
+        self.lost = False  # deemed lost from the acknowledgements of later segments and retransmitted right away
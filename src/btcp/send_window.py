@@ -0,0 +1,200 @@
+import heapq
+import itertools
+from typing import Iterator, Optional
+
+from btcp.segment import Segment
+
+
+class SendWindow:
+    """ Ring buffer holding the window of segments which are being sent
+    Counting the segments in flight, looking up a segment by its expected ACK and advancing the window are O(1),
+    acknowledging a range of segments is linear in the length of the range.
+    The retransmission deadlines of all segments are kept in a single min-heap, so the next expiry is found without
+    scanning the window.
+    Losses are also detected from the acknowledgements, like in TCP: a segment is deemed lost once enough later segments
+    were selectively acknowledged or enough duplicate ACKs arrived, and the window then stays in recovery until every
+    segment which was in flight at the loss is acknowledged.
+    """
+
+    def __init__(self, segments: Iterator[Segment], size: int):
+        self._segments = segments
+        self._ring = [None] * size
+        self._head = 0  # slot of the oldest unacknowledged segment
+        self._count = 0  # number of segments in the window
+        self._sent = 0  # number of segments from the head which were already sent
+        self._slots = {}  # ring slots of the segments in the window keyed by their expected ACK number
+        self._timers = []  # heap of (deadline, tiebreaker, segment), outdated entries are skipped lazily
+        self._counter = itertools.count()
+        self._exhausted = False
+        self.in_flight = 0
+        self.dup_acks = 0  # consecutive ACKs which acknowledged nothing new at the start of the window
+        self._evidence = False  # whether acknowledgements arrived which may reveal a loss since the last check
+        self._partial = False  # whether an ACK during recovery moved the window without ending the recovery
+        self._recover = None  # last segment in flight when the recovery started, None outside of a recovery
+        self.fill()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def fill(self) -> None:
+        """ Pulls the upcoming segments into the free slots of the window """
+        size = len(self._ring)
+        while not self._exhausted and self._count < size:
+            segment = next(self._segments, None)
+            if segment is None:
+                self._exhausted = True
+                break
+            slot = (self._head + self._count) % size
+            self._ring[slot] = segment
+            self._slots[segment.exp_ack] = slot
+            self._count += 1
+
+    def next_unsent(self) -> Optional[Segment]:
+        """ Returns the first segment in the window which was not yet sent """
+        if self._sent == self._count:
+            return None
+        return self._ring[(self._head + self._sent) % len(self._ring)]
+
+    def mark_sent(self, segment: Segment, now: int, timeout: int) -> None:
+        """ Registers the (re)transmission of the segment and schedules its retransmission timer """
+        if segment.sent:
+            segment.retransmitted = True
+        else:
+            segment.sent = True
+            self._sent += 1
+            self.in_flight += 1
+        segment.start_time = now
+        segment.deadline = now + timeout
+        heapq.heappush(self._timers, (segment.deadline, next(self._counter), segment))
+
+    def next_deadline(self) -> Optional[int]:
+        """ Returns the earliest retransmission deadline or None if no segment is pending """
+        timers = self._timers
+        # Discard the timers of acknowledged or rescheduled segments
+        while timers and (timers[0][2].is_acked or timers[0][2].deadline != timers[0][0]):
+            heapq.heappop(timers)
+        return timers[0][0] if timers else None
+
+    def expired(self, now: int) -> [Segment]:
+        """ Removes and returns the pending segments whose retransmission timer expired
+        An expiry ends the recovery, the timeout takes over the loss recovery.
+        """
+        expired = []
+        deadline = self.next_deadline()
+        while deadline is not None and deadline <= now:
+            expired.append(heapq.heappop(self._timers)[2])
+            deadline = self.next_deadline()
+        if expired:
+            self._recover = None
+            self._partial = False
+        return expired
+
+    def ack(self, ack_nr: int, window_update: bool = False, cumulative: bool = True) -> [Segment]:
+        """ Cumulatively acknowledges every segment up to the one with the given expected ACK number
+        Without cumulative ACKs (legacy receivers) only the segment with exactly that expected ACK number is acked.
+        Returns the segments which were not acknowledged before
+        """
+        slot = self._slots.get(ack_nr)
+        if slot is None or not self._ring[slot].sent:
+            # An ACK for the start of the window only tells that a later segment arrived, unless it enlarged the window
+            # of the receiver, which then merely read data (like the window update rule of RFC 5681)
+            if cumulative and self._sent and ack_nr == self._ring[self._head].seq_nr and not window_update:
+                self.dup_acks += 1
+                self._evidence = True
+            return []
+        if not cumulative:
+            # The ACK tells nothing about the earlier segments, much like a selective acknowledgement of one segment
+            self._evidence = True
+            return self._ack_range(slot, slot)
+        self.dup_acks = 0
+        acked = self._ack_range(self._head, slot)
+        # A partial ACK during recovery reveals that the segment at the new start of the window was lost as well
+        if self._recover is not None and not self._recover.is_acked:
+            self._partial = True
+            self._evidence = True
+        return acked
+
+    def sack(self, start: int, end: int) -> [Segment]:
+        """ Acknowledges the segments covering the selectively acknowledged block [start, end)
+        Returns the segments which were not acknowledged before
+        """
+        last = self._slots.get(end)
+        if last is None or not self._ring[last].sent:
+            return []
+        # Walk back from the end of the block to the segment where it starts
+        size = len(self._ring)
+        first = last
+        while self._ring[first].seq_nr != start:
+            if first == self._head:
+                return []
+            first = (first - 1) % size
+        self._evidence = True
+        return self._ack_range(first, last)
+
+    def _ack_range(self, first: int, last: int) -> [Segment]:
+        """ Marks the segments in the ring slots from first up to and including last as acknowledged """
+        size = len(self._ring)
+        acked = []
+        slot = first
+        while True:
+            segment = self._ring[slot]
+            if not segment.is_acked:
+                segment.is_acked = True
+                self.in_flight -= 1
+                acked.append(segment)
+            if slot == last:
+                return acked
+            slot = (slot + 1) % size
+
+    @property
+    def in_recovery(self) -> bool:
+        return self._recover is not None
+
+    def enter_recovery(self) -> None:
+        """ Starts a recovery which lasts until all segments which are currently in flight are acknowledged """
+        self._recover = self._ring[(self._head + self._sent - 1) % len(self._ring)]
+
+    def lost(self, threshold: int) -> [Segment]:
+        """ Returns the segments in flight which are deemed lost and were not retransmitted for that reason yet
+        A segment is lost once at least threshold later segments were acknowledged. The first segment in the window is
+        also lost after threshold duplicate ACKs, which covers peers that do not send selective acknowledgements, or
+        after a partial ACK during recovery. The window is only scanned if new evidence arrived since the last call.
+        """
+        if not self._evidence:
+            return []
+        self._evidence = False
+        size = len(self._ring)
+        lost = []
+        acked = 0
+        # Walk back from the last segment in flight, counting the acknowledged segments behind each hole
+        for i in range(self._sent - 1, -1, -1):
+            segment = self._ring[(self._head + i) % size]
+            if segment.is_acked:
+                acked += 1
+            elif not segment.lost and (acked >= threshold or i == 0 and (self.dup_acks >= threshold or self._partial)):
+                segment.lost = True
+                lost.append(segment)
+        self._partial = False
+        lost.reverse()
+        return lost
+
+    def advance(self) -> Optional[int]:
+        """ Slides the window past the acknowledged segments at its start
+        Returns the expected ACK number of the last segment that left the window, or None if the window did not move
+        """
+        size = len(self._ring)
+        exp_ack = None
+        while self._count and self._ring[self._head].is_acked:
+            segment = self._ring[self._head]
+            del self._slots[segment.exp_ack]
+            self._ring[self._head] = None
+            self._head = (self._head + 1) % size
+            self._count -= 1
+            self._sent -= 1
+            exp_ack = segment.exp_ack
+            if segment is self._recover:
+                self._recover = None
+                self._partial = False
+        if exp_ack is not None:
+            self.fill()
+        return exp_ack
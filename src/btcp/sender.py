@@ -0,0 +1,304 @@
+from collections import deque
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Tuple, Type, Union
+
+from btcp.checksum import word_sum
+from btcp.codec import Header, SegmentEncoder, decode_sack, encode_options, STREAM_HEADER
+from btcp.congestion import CongestionControl
+from btcp.constants import SEGMENT_SIZE, MAX_BURST, DUPACK_THRESHOLD, PAYLOAD_SIZE, MAX_PROBE_INTERVAL, \
+    DEFAULT_STREAM, FOUR_BYTES
+from btcp.enums import Flag, Option, TraceEvent
+from btcp.segment import Segment
+from btcp.send_window import SendWindow
+
+
+class BTCPSender:
+    """ Sending half of a bTCP socket, used next to BTCPSocket by the thread and asyncio client sockets
+    It opens the connection, splits the data into segments and runs the congestion control, the retransmissions and
+    the persist timer of the send window.
+    """
+
+    def setup_sender(self, congestion_control: Type[CongestionControl], handshake_timeout: int,
+                     cookies: Optional[dict], streams: bool) -> None:
+        """ Prepares the socket for sending data as a client """
+        self.congestion = congestion_control()  # congestion control of the data this end sends
+        # The backed off retransmission timeout would otherwise let the attempts of a handshake take minutes
+        self.handshake_timeout = handshake_timeout  # in milliseconds
+        self.cookies = cookies  # fast open cookies keyed by the address of the server, None disables fast open
+        self._offer_streams = streams
+        self.reordering = DUPACK_THRESHOLD  # later segments which may arrive before a segment without it being lost
+        self._probe_deadline = None  # expiry of the persist timer, None unless the window of the receiver is zero
+        self._probe_interval = 0
+        self._burst = None  # encoders of the back to back slots of the burst buffer, allocated on first use
+        self._burst_view = None
+        self._stalled = False  # whether the sender is waiting for room in the window of the receiver
+
+    def handshake_deadline(self) -> int:
+        """ Returns the time at which a handshake starting now is abandoned """
+        return self.time() + self.handshake_timeout
+
+    def syn_request(self, cookies: Optional[dict], server, data=b'') -> Tuple[dict, memoryview]:
+        """ Returns the options of a SYN request to the server and the part of the data the request carries
+        With fast open enabled, the request asks for a cookie or presents the one received earlier from the server,
+        together with as much of the data (a bytes-like object) as fits in the segment next to the options.
+        """
+        options = self.offer_options()
+        if cookies is None:
+            return options, memoryview(b'')
+        options[Option.FAST_OPEN] = cookies.get(server, b'')
+        # Data in the SYN request carries no stream header, as the streams are not yet agreed on
+        if not options[Option.FAST_OPEN] or self._offer_streams:
+            return options, memoryview(b'')
+        return options, memoryview(data).cast('B')[:PAYLOAD_SIZE - len(encode_options(options))]
+
+    def accept_synack(self, message: Header, early: memoryview, cookies: Optional[dict], server) -> int:
+        """ Enables the options the server agreed on in its SYNACK and stores its cookie, returns the number of bytes
+        of the data in the SYN request which the server accepted
+        """
+        # The server acknowledges the data in the SYN request only if it accepted the cookie
+        accepted = len(early) if early and self.valid_ack(message, 1 + len(early)) else 0
+        self.apply_options(message.options)
+        if cookies is not None and message.options.get(Option.FAST_OPEN):
+            cookies[server] = message.options[Option.FAST_OPEN]
+        self.seq_nr = self.safe_incr(self.seq_nr, 1 + accepted)
+        self.ack_nr = self.safe_incr(message.seq_nr)
+        return accepted
+
+    def transmit(self, window: SendWindow, burst: list) -> int:
+        """ Sends the given retransmissions and the new segments while both the receiver and the network have room
+        Returns the deadline (in milliseconds) of the earliest retransmission timer or the persist timer.
+        """
+        segment = window.next_unsent()
+        while segment and window.in_flight < min(self.others_recv_win, self.congestion.cwnd):
+            window.mark_sent(segment, self.time(), self.rtt.rto)
+            burst.append(segment)
+            segment = window.next_unsent()
+        self.track_stall(segment is not None and window.in_flight >= self.others_recv_win)
+        # Flush the retransmissions and the new segments at once
+        if burst:
+            self.post_burst(burst, self.ack_nr)
+        # Probe the window of the receiver while it does not let any segment through
+        probe = self.persist(segment is not None and not window.in_flight and self.others_recv_win <= 0)
+        deadline = window.next_deadline()
+        if deadline is None:
+            deadline = probe if probe is not None else self.time() + self.rtt.rto
+        return deadline
+
+    def handle_ack(self, window: SendWindow, message: Header) -> None:
+        """ Takes the acknowledgements of the message for the segments of the send window and advances the window
+        The acknowledged segments grow the congestion window and yield an RTT sample, unless they were retransmitted.
+        """
+        # Acknowledge the segments cumulatively and those reported in the selective acknowledgement blocks
+        acked = window.ack(message.ack_nr, self.window_opened, self.cumulative_acks)
+        for start, end in decode_sack(message.data, self.layout):
+            acked += window.sack(start, end)
+        # Take back the reduction of the congestion window if the loss turns out to be reordering
+        if self.detect_spurious(acked):
+            self.congestion.undo()
+        # The congestion window does not grow while recovering from a loss
+        if acked and not window.in_recovery:
+            # The newly acknowledged segments were in flight until this ACK
+            self.congestion.on_ack(len(acked), window.in_flight + len(acked))
+        # Measure the RTT only if no retransmitted segment was acknowledged (Karn's rule)
+        if acked and not any(s.retransmitted for s in acked):
+            self.sample_rtt(self.time() - max(s.start_time for s in acked))
+        # Move window past the acknowledged segments
+        exp_ack = window.advance()
+        if exp_ack is not None:
+            self.seq_nr = exp_ack
+            self.trace_advance(exp_ack)
+
+    def expired_segments(self, window: SendWindow) -> list:
+        """ Marks the segments whose timer expired for retransmission and returns them, backing off the timeout once """
+        expired = window.expired(self.time())
+        if expired:
+            self.rtt.backoff()
+            self.congestion.on_timeout(window.in_flight)
+            self.stats.retransmissions += len(expired)
+        for segment in expired:
+            window.mark_sent(segment, self.time(), self.rtt.rto)
+        return expired
+
+    def lost_segments(self, window: SendWindow) -> list:
+        """ Marks the segments revealed as lost by the acknowledgements of later ones for retransmission, returns them
+        The first loss of a round trip starts a recovery which halves the congestion window once.
+        """
+        lost = window.lost(self.reordering)
+        if lost:
+            if not window.in_recovery:
+                self.congestion.on_loss(window.in_flight)
+                window.enter_recovery()
+            self.stats.retransmissions += len(lost)
+            self.stats.fast_retransmissions += len(lost)
+        for segment in lost:
+            window.mark_sent(segment, self.time(), self.rtt.rto)
+        return lost
+
+    def detect_spurious(self, acked: [Segment]) -> bool:
+        """ Raises the reordering threshold if a segment which was deemed lost turns out to have merely been delayed
+        An acknowledgement arriving within half a round trip after the retransmission was caused by the original.
+        """
+        if self.rtt.srtt is None:
+            return False
+        now = self.time()
+        spurious = [segment for segment in acked if segment.lost and now - segment.start_time < self.rtt.srtt / 2]
+        if spurious:
+            # Capped by the window, but never below the current threshold as tiny windows would otherwise lower it
+            self.reordering = max(self.reordering, min(self.reordering * 2, self._window))
+            self.stats.spurious_retransmissions += len(spurious)
+        return bool(spurious)
+
+    def persist(self, zero_window: bool) -> Optional[int]:
+        """ Runs the persist timer while the receiver holds back the sender with a zero window, returns its deadline
+        On expiry an empty segment probes the window, which the receiver answers with an ACK carrying its current
+        window. This way a lost window update cannot stall the connection. The probes back off exponentially.
+        """
+        if not zero_window:
+            self._probe_deadline = None
+            return None
+        now = self.time()
+        if self._probe_deadline is None:
+            self._probe_interval = self.rtt.rto
+        elif now >= self._probe_deadline:
+            self.post(self.seq_nr, self.ack_nr, Flag.NONE)
+            self.stats.window_probes += 1
+            self._probe_interval = min(self._probe_interval * 2, MAX_PROBE_INTERVAL)
+        else:
+            return self._probe_deadline
+        self._probe_deadline = now + self._probe_interval
+        return self._probe_deadline
+
+    def track_stall(self, stalled: bool) -> None:
+        """ Counts the moments at which the sender starts to wait for room in the window of the receiver """
+        if stalled and not self._stalled:
+            self.stats.zero_window_stalls += 1
+        self._stalled = stalled
+
+    def trace_advance(self, exp_ack: int) -> None:
+        """ Records that the send window moved up to the given sequence number """
+        if self.tracer is not None:
+            self.tracer.record(self._trace_id, TraceEvent.ADVANCE, Flag.NONE, exp_ack, self.ack_nr,
+                               self.others_recv_win, 0)
+
+    def post_burst(self, segments: [Segment], ack_nr: int) -> None:
+        """ Encodes the data segments back to back and puts each run of them into the network in a single call
+        A run ends after a segment which is shorter than a full sized one or once the burst buffer is full.
+        """
+        if self._burst is None:
+            view = memoryview(bytearray(MAX_BURST * SEGMENT_SIZE))
+            self._burst = [SegmentEncoder(view[i * SEGMENT_SIZE:(i + 1) * SEGMENT_SIZE]) for i in range(MAX_BURST)]
+            self._burst_view = view
+        win = self.advertised_window(Flag.NONE)
+        used = end = 0
+        self.stats.segments_sent += len(segments)
+        for segment in segments:
+            self.stats.bytes_sent += len(segment.data)
+            if self.tracer is not None:
+                self.tracer.record(self._trace_id, TraceEvent.RETRANSMIT if segment.retransmitted else TraceEvent.SEND,
+                                   Flag.NONE, segment.seq_nr, ack_nr, self.recv_win, len(segment.data))
+            if segment.data_sum is None:
+                segment.data_sum = word_sum(segment.data)
+            encoded = self._burst[used].encode(segment.seq_nr, ack_nr, Flag.NONE, win, segment.data,
+                                               short=self.short_segments, data_sum=segment.data_sum,
+                                               layout=self.layout)
+            if self.show_prints:
+                print(f'[seq: {segment.seq_nr}; ack: {ack_nr}] {self._name} sent {Flag.NONE.name}', flush=True)
+            used += 1
+            end = (used - 1) * SEGMENT_SIZE + len(encoded)
+            if len(encoded) < SEGMENT_SIZE or used == MAX_BURST:
+                self._lossy_layer.send_burst(self._burst_view[:end], SEGMENT_SIZE, self._peer)
+                used = end = 0
+        if used:
+            self._lossy_layer.send_burst(self._burst_view[:end], SEGMENT_SIZE, self._peer)
+
+    def meta_data(self, data: Union[bytes, BinaryIO, Iterable[bytes]]) -> Iterator[Segment]:
+        """ Turns the data into segments with their meta data
+        On a multi-stream connection the data is sent as the default stream.
+        """
+        if self.multi_stream:
+            return self.meta_streams({DEFAULT_STREAM: data})
+        return self.number_chunks(split_data(data, self.layout.payload_size))
+
+    def meta_streams(self, streams: Dict[int, Union[bytes, BinaryIO, Iterable[bytes]]]) -> Iterator[Segment]:
+        """ Turns the data of the streams keyed by their ID into segments with their meta data
+        The streams take turns one segment at a time, so each gets an equal share of the window. Every segment starts
+        with the stream header and a segment without data ends its stream.
+        """
+        size = self.layout.payload_size - STREAM_HEADER.size
+        turns = deque((stream, split_data(data, size), 0) for stream, data in streams.items())
+
+        def chunks() -> Iterator[bytes]:
+            while turns:
+                stream, split, offset = turns.popleft()
+                chunk = next(split, b'')
+                yield STREAM_HEADER.pack(stream, offset) + chunk
+                if chunk:
+                    turns.append((stream, split, (offset + len(chunk)) % FOUR_BYTES))
+
+        return self.number_chunks(chunks())
+
+    def number_chunks(self, chunks: Iterator) -> Iterator[Segment]:
+        """ Gives the chunks their consecutive sequence numbers, starting at the current one once iterated """
+        seq_nr = self.seq_nr
+        for chunk in chunks:
+            exp_ack = self.safe_incr(seq_nr, addition=len(chunk))
+            yield Segment(data=chunk, seq_nr=seq_nr, exp_ack=exp_ack)
+            seq_nr = exp_ack
+
+    @property
+    def cwnd(self) -> float:
+        """ Current congestion window in segments """
+        return self.congestion.cwnd
+
+    @property
+    def ssthresh(self) -> float:
+        """ Current slow start threshold in segments """
+        return self.congestion.ssthresh
+
+    def snapshot(self) -> dict:
+        """ Returns the statistics together with the current state of the connection and the congestion control """
+        return dict(super().snapshot(), cwnd=self.cwnd, ssthresh=self.ssthresh)
+
+
+def split_data(data: Union[bytes, BinaryIO, Iterable[bytes]], size: int) -> Iterator[bytes]:
+    """ Splits the data into chunks of at most the given size
+    Buffer objects are sliced without copying, so they must not change until they were sent. File objects and
+    iterables hand out chunks which the sender keeps until they are acknowledged, those are copied.
+    """
+    # Binary file objects are read one chunk at a time
+    if hasattr(data, 'read'):
+        yield from iter(lambda: data.read(size), b'')
+        return
+    # Objects supporting the buffer protocol are sliced in place
+    try:
+        view = memoryview(data).cast('B')
+    except TypeError:
+        yield from split_chunks(data, size)
+        return
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+
+def split_chunks(chunks: Iterable[bytes], size: int) -> Iterator[bytes]:
+    """ Re-splits an iterable of chunks into full sized chunks
+    Every chunk is copied, as an iterable may hand out the same buffer again with new contents (like a reused read
+    buffer) while the segments made from its earlier contents still wait for their acknowledgement.
+    """
+    pending = bytearray()
+    for chunk in chunks:
+        view = memoryview(chunk).cast('B')
+        start = 0
+        # Complete the partially filled chunk first
+        if pending:
+            start = size - len(pending)
+            pending += view[:start]
+            if len(pending) < size:
+                continue
+            yield bytes(pending)
+            pending = bytearray()
+        # Copy the full sized chunks out of the given chunk
+        while len(view) - start >= size:
+            yield bytes(view[start:start + size])
+            start += size
+        pending += view[start:]
+    if pending:
+        yield bytes(pending)
@@ -1,122 +1,293 @@
-from typing import Optional
+import heapq
+import itertools
+import threading
+from queue import Queue
+from typing import Iterator, Optional, Tuple
 from btcp.btcp_socket import BTCPSocket
-from btcp.constants import SERVER_IP, SERVER_PORT, CLIENT_IP, CLIENT_PORT, FIN_TIMEOUT, TWO_BYTES
+from btcp.codec import Header, MESSAGE_HEADER
+from btcp.constants import SERVER_IP, SERVER_PORT, CLIENT_IP, CLIENT_PORT, FIN_TIMEOUT, ACCEPT_TIMEOUT, \
+    ACK_EVERY, ACK_DELAY
+from btcp.delayed_ack import DelayedAck
 from btcp.enums import State, Flag
+from btcp.impairment import Impairment
+from btcp.listener import BTCPListener
 from btcp.lossy_layer import LossyLayer
+from btcp.receiver import BTCPReceiver
+from btcp.trace import Tracer
 
 
-class BTCPServerSocket(BTCPSocket):
-    """ The bTCP server socket
-    A server application makes use of the services provided by bTCP by calling accept, recv, and close
+class BTCPServerSocket(BTCPListener):
+    """ The listening bTCP server socket
+    Incoming segments are demultiplexed by the address of the client into separate connections. A server application
+    makes use of the services provided by bTCP by calling accept, which returns a new connection, and close
+    Handshakes are completed in the network thread and only established connections are queued for accept, so a client
+    which never finishes its handshake does not hold up the others.
+    Disconnecting connections linger in the network thread until the last ACK arrives or the FIN timeout expires, so
+    neither the application nor the next connection waits for the teardown.
+    With fast open enabled, clients receive a cookie with which their next connection may carry data in the SYN request.
     """
 
-    def __init__(self, window: int, timeout: int, show_prints: bool):
-        super().__init__(window, timeout, 'Server', show_prints)
-        self._lossy_layer = LossyLayer(self, SERVER_IP, SERVER_PORT, CLIENT_IP, CLIENT_PORT)
-        self.temp = {}
-        self.wraparound = 0
+    def __init__(self, window: int, timeout: int, show_prints: bool, short_segments: bool = True,
+                 impairment: Optional[Impairment] = None, tracer: Optional[Tracer] = None, ack_every: int = ACK_EVERY,
+                 ack_delay: int = ACK_DELAY, fast_open: bool = False):
+        self.setup_listener(window, timeout, show_prints, short_segments, tracer, ack_every, ack_delay, fast_open)
+        self._backlog = Queue()  # established connections which were not yet accepted
+        self._timers = []  # heap of (deadline, tiebreaker, connection) of the handshakes and teardowns in progress
+        self._counter = itertools.count()
+        self._timers_lock = threading.Lock()
+        self._lossy_layer = LossyLayer(self, SERVER_IP, SERVER_PORT, CLIENT_IP, CLIENT_PORT, impairment)
+        self._lossy_layer.start()
 
     def lossy_layer_input(self, segment: bytes, address) -> None:
         """ Called by the lossy layer from another thread whenever a segment arrives """
-        self.buffer.put(segment, block=True, timeout=50)
+        self.expire_timers()
+        super().lossy_layer_input(segment, address)
 
-    def accept(self) -> None:
-        """ Wait for the client to initiate a three-way handshake """
-        # Only non-connected server can accept a connection
-        if self.state is not State.OPEN:
+    def new_connection(self, address) -> 'BTCPServerConnection':
+        """ Creates the connection of the client with the given address """
+        return BTCPServerConnection(self._window, self._timeout, self.show_prints, self._short_segments, self, address)
+
+    def established(self, connection: 'BTCPServerConnection') -> None:
+        """ Queues the connection whose handshake completed for accept """
+        self._backlog.put(connection)
+
+    def lossy_layer_idle(self) -> None:
+        """ Called by the lossy layer from another thread whenever no segment arrived for a while
+        The handshake and FIN timeouts also expire while the network is quiet.
+        """
+        self.expire_timers()
+
+    def accept(self) -> 'BTCPServerConnection':
+        """ Wait until a client completed its three-way handshake and return the established connection """
+        return self._backlog.get()
+
+    def schedule(self, connection: 'BTCPServerConnection', deadline: int) -> None:
+        """ Lets the connection expire its handshake or teardown once the deadline (in milliseconds) passes """
+        with self._timers_lock:
+            heapq.heappush(self._timers, (deadline, next(self._counter), connection))
+
+    def expire_timers(self) -> None:
+        """ Ends the handshakes and teardowns whose timeout expired """
+        with self._timers_lock:
+            expired = []
+            while self._timers and self._timers[0][0] <= self._timers[0][2].time():
+                expired.append(heapq.heappop(self._timers)[2])
+        for connection in expired:
+            connection.expire()
+
+    def close(self) -> None:
+        """ Clean up any state """
+        self._lossy_layer.destroy()
+
+
+class BTCPServerConnection(BTCPReceiver, BTCPSocket):
+    """ A connection accepted by the bTCP server socket
+    A server application receives the data of the client by calling recv (or recv_stream and recv_into), and close
+    The separate streams of a multi-stream connection are received with recv_streams.
+    """
+
+    def __init__(self, window: int, timeout: int, show_prints: bool, short_segments: bool, listener: BTCPServerSocket,
+                 address):
+        super().__init__(window, timeout, 'Server', show_prints, short_segments)
+        self._listener = listener
+        self._peer = self.address = address
+        self.setup_receiver(DelayedAck(listener._ack_every, listener._ack_delay))
+        self._stream = None
+        self._leftover = memoryview(b'')
+        self.deadline = None  # end of the handshake or FIN timeout, None once the connection is established
+        self._start_time = None  # arrival of the first SYN request
+        # The application and the network thread both answer FIN requests, their FINACKs share the encoder
+        self._teardown_lock = threading.Lock()
+        self._lossy_layer = listener._lossy_layer
+
+    def lossy_layer_input(self, segment: bytes, address) -> None:
+        """ Called by the listening socket from the network thread whenever a segment for this connection arrives
+        The handshake and the teardown are handled right away in the network thread, in between the application reads
+        the segments from the buffer.
+        """
+        if self.state is State.CONN_EST:
+            self.enqueue(segment)
             return
-        # Wait for connection attempt while the state is unchanged
-        while State.OPEN:
-            # Handle the incoming traffic
-            message = self.handle_flow(expected=[Flag.SYN, Flag.ACK, Flag.NONE])
-            # Send SYNACK if the SYN request was received
-            if message and message['flag'] is Flag.SYN:
-                self.acknowledge_post(message, Flag.SYNACK)
-                self.ack_nr = self.safe_incr(message['seq_nr'])
-            # Establish the connection if the acknowledgement was received
-            elif message and message['flag'] is Flag.ACK:
-                if self.valid_ack(message):
-                    self.seq_nr = self.safe_incr(self.seq_nr)
-                    self.state = State.CONN_EST
-                    if self.show_prints:
-                        print(f'-- Server established connection --', flush=True)
-            # In case ACK was lost but the next segment of data was received
-            elif message and message['flag'] is Flag.NONE and message['dlen'] > 0:
-                self.state = State.CONN_EST
-                self.temp['ACK-lost'] = message
-                break
+        message = self.unpack(segment)
+        if message and self.state is not State.DISC_PEND:
+            self.take_peer_window(message)
+            self.handshake(message)
+        elif message:
+            with self._teardown_lock:
+                # Answer a retransmitted FIN request, the FINACK was lost
+                if message.flag is Flag.FIN:
+                    self.acknowledge_post(message, Flag.FINACK)
+                    self.linger()
+                # Terminate the connection if the acknowledgement was received
+                elif message.flag is Flag.ACK and self.valid_ack(message):
+                    self.terminate()
+        self._lossy_layer.release(segment)
+
+    def handshake(self, message: Header) -> None:
+        """ Takes a segment of the three-way handshake initiated by the client """
+        # Send SYNACK with the agreed options if the SYN request was received
+        if message.flag is Flag.SYN:
+            self.state = State.CONN_PEND
+            self._start_time = self._start_time or self.time()
+            # Give up on clients which stop sending SYN requests before the handshake completes
+            self.deadline = self.time() + ACCEPT_TIMEOUT
+            self._listener.schedule(self, self.deadline)
+            # Data accepted with the SYN request is delivered without waiting for the ACK of the client
+            if self.answer_syn(message, self._listener.fast_open):
+                self.seq_nr = self.safe_incr(self.seq_nr)
+                self.establish()
+        elif self.state is not State.CONN_PEND:
+            return
+        # Establish the connection if the acknowledgement was received
+        elif message.flag is Flag.ACK and self.valid_ack(message):
+            self.seq_nr = self.safe_incr(self.seq_nr)
+            self.establish()
+        # In case ACK was lost but the next segment of data was received
+        elif message.flag is Flag.NONE and message.dlen > 0:
+            self.send_recv_ack(message)
+            self.establish()
+
+    def establish(self) -> None:
+        """ Ends the handshake and hands the connection to accept """
+        self.state = State.CONN_EST
+        self.deadline = None
+        self.stats.handshake_time = self.time() - self._start_time
+        if self.show_prints:
+            print(f'-- Server established connection --', flush=True)
+        self._listener.established(self)
 
     def recv(self) -> Optional[bytes]:
-        """ Send any incoming data to the application layer """
+        """ Send all incoming data to the application layer once the client disconnects """
         # We can only receive if a connection has been established
         if self.state is not State.CONN_EST:
             return None
-        # Initialize local variables
-        data = []
-        acked = []
-        if 'ACK-lost' in self.temp:
-            self.send_recv_ack(self.temp['ACK-lost'], acked, data)
+        return b''.join(self.recv_stream())
+
+    def recv_stream(self) -> Iterator[bytes]:
+        """ Yields the incoming data to the application as soon as it is in order
+        The streams of a multi-stream connection are yielded interleaved, recv_streams tells them apart.
+        """
+        for _, chunk in self.recv_streams():
+            if chunk:
+                yield chunk
+
+    def recv_streams(self) -> Iterator[Tuple[int, bytes]]:
+        """ Yields the incoming data as (stream ID, chunk) as soon as it is in order within its stream
+        A stream ends with an empty chunk, without streams all data belongs to the default stream.
+        """
+        # We can only receive if a connection has been established
+        if self.state is not State.CONN_EST:
+            return
         # The server receives while the client does not disconnect
-        while self.state is State.CONN_EST:
-            message = self.handle_flow(expected=[Flag.NONE, Flag.FIN])
+        while True:
+            # Deliver the reassembled data before waiting for more
+            chunk = self.next_chunk()
+            if chunk is not None:
+                # Tell the sender once reading the data made enough room again
+                if self.state is State.CONN_EST and self.window_update_due():
+                    self.stats.window_updates += 1
+                    self.cumulative_ack()
+                yield chunk
+                continue
+            if self.state is not State.CONN_EST:
+                break
+            # Block until the next segment arrives or the delayed ACK is due
+            message = self.handle_flow(expected=[Flag.NONE, Flag.FIN, Flag.SYN], deadline=self._delayed_ack.deadline)
             if not message:
+                if self._delayed_ack.due(self.time()):
+                    self.cumulative_ack()
                 continue
-            if message['flag'] is Flag.NONE and message['dlen'] > 0:
-                self.send_recv_ack(message, acked, data)
+            if message.flag is Flag.NONE and message.dlen > 0:
+                self.send_recv_ack(message)
+            # The SYNACK of a connection established by data in the SYN request was lost
+            elif message.flag is Flag.SYN:
+                self.repeat_synack()
             # Accept the disconnect request
-            elif message['flag'] is Flag.FIN:
+            elif message.flag is Flag.FIN:
                 self.accept_disconnect(message)
             # Acknowledge the probe checking windows size
             else:
-                self.acknowledge_post(message, Flag.ACK)
-        # Sort the data according to the ACK numbers
-        data.sort(key=lambda tup: tup[1])
-        # Merge the data bytes into a single object
-        return b''.join([d for (d, _) in data])
-
-    def send_recv_ack(self, message: dict, acked: list, data: list) -> None:
-        self.acknowledge_post(message, Flag.ACK)
-        segment_id = self.calculate_id(message['seq_nr'], message['dlen'])
-        ack_nr = self.safe_incr(message['seq_nr'], message['dlen'])
-        # Only save the data if it was not yet acknowledged
-        if ack_nr not in acked:
-            # Append the data without the padding bytes and ACK number tuple
-            data.append((message['data'][:message['dlen']], segment_id))
-            acked.append(ack_nr)
-
-    def calculate_id(self, number: int, addition: int = 1) -> int:
-        """ Calculates the id for the segment """
-        summed = number + addition
-        if summed < TWO_BYTES:
-            return summed + (self.wraparound * TWO_BYTES)
-        else:
-            self.wraparound += 1
-            return summed % TWO_BYTES + (self.wraparound * TWO_BYTES)
-
-    def accept_disconnect(self, message: dict) -> None:
-        """ Internal function which handles the disconnect attempt """
+                self.cumulative_ack()
+
+    def recv_into(self, buffer) -> int:
+        """ Receives the incoming data into a writable buffer and returns the number of bytes written
+        Returns 0 once all data was received and the client disconnected
+        """
+        if self._stream is None:
+            self._stream = self.recv_stream()
+        if not self._leftover:
+            self._leftover = memoryview(next(self._stream, b''))
+        view = memoryview(buffer).cast('B')
+        size = min(len(view), len(self._leftover))
+        view[:size] = self._leftover[:size]
+        self._leftover = self._leftover[size:]
+        return size
+
+    def recv_message(self) -> Optional[bytes]:
+        """ Receives the next message the client sent with send_message
+        Returns None once the client disconnected
+        """
+        header = self.recv_exactly(MESSAGE_HEADER.size)
+        if header is None:
+            return None
+        return self.recv_exactly(MESSAGE_HEADER.unpack(header)[0])
+
+    def recv_exactly(self, size: int) -> Optional[bytes]:
+        """ Receives exactly size bytes of the incoming data, None if the client disconnected before """
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        while received < size:
+            written = self.recv_into(view[received:])
+            if not written:
+                return None
+            received += written
+        return bytes(buffer)
+
+    def accept_disconnect(self, message: Header) -> None:
+        """ Internal function which handles the disconnect attempt
+        The connection lingers in the network thread afterwards, so the application does not wait for the last ACK
+        """
         # Only connected server can begin disconnect request and if the FIN segment was received
         if self.state is not State.CONN_EST:
             return
-        # Send the initial FINACK
-        self.acknowledge_post(message, Flag.FINACK)
-        # Initialize timer
-        timer = 0
-        start_time = self.time()
-        # Attempt to disconnect until the state is changed or timer is exceeded
-        while self.state is State.CONN_EST:
-            message = self.handle_flow(expected=[Flag.FIN, Flag.ACK])
-            # Send FINACK if repeated FIN request was received or if it was not yet sent
-            if message and message['flag'] is Flag.FIN:
-                self.acknowledge_post(message, Flag.FINACK)
-                start_time = self.time()
-            # Terminate the connection if the acknowledgement was received
-            elif message and message['flag'] is Flag.ACK and self.valid_ack(message) or timer > FIN_TIMEOUT:
-                self.state = State.OPEN
-                if self.show_prints:
-                    print(f'-- Server terminated connection --', flush=True)
-            timer = self.time() - start_time
+        # Disconnect first, the network thread only takes the last ACK (which may arrive as soon as the FINACK is out)
+        # and only expires the FIN timeout of a disconnecting connection. It waits for the initial FINACK to be sent.
+        with self._teardown_lock:
+            self.state = State.DISC_PEND
+            # Send the initial FINACK and hand the rest of the teardown to the network thread
+            self.acknowledge_post(message, Flag.FINACK)
+            self.linger()
+
+    def linger(self) -> None:
+        """ (Re)starts the FIN timeout during which retransmitted FIN requests are answered """
+        self.deadline = self.time() + FIN_TIMEOUT
+        self._listener.schedule(self, self.deadline)
+
+    def expire(self) -> None:
+        """ Ends the handshake or the teardown if its deadline passed """
+        # A connection whose timeout was restarted is still scheduled with its new deadline
+        if self.deadline is None or self.deadline > self.time():
+            return
+        if self.state is State.DISC_PEND:
+            self.terminate()
+        elif self.state is State.CONN_PEND:
+            # Forget the abandoned handshake, so a later SYN request of the same client opens a fresh connection
+            self.state = State.OPEN
+            self._listener.remove(self)
+
+    def terminate(self) -> None:
+        """ Ends the teardown once the last ACK arrived or the FIN timeout expired """
+        if self.state is not State.DISC_PEND:
+            return
+        self.state = State.OPEN
+        self._listener.remove(self)
+        if self.show_prints:
+            print(f'-- Server terminated connection --', flush=True)
 
     def close(self) -> None:
-        """ Clean up any state """
-        self._lossy_layer.destroy()
\ No newline at end of file
+        """ Clean up any state, the listening socket stays open
+        A disconnecting connection keeps lingering until its teardown ends
+        """
+        if self.state is not State.DISC_PEND:
+            self._listener.remove(self)
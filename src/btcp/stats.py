@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from typing import Callable, Optional, TextIO
+
+HISTOGRAM_BUCKETS = 32  # bucket i counts the values from 2 ** (i - 1) up to 2 ** i, the last one all larger ones
+
+
+class Histogram:
+    """ Histogram with power of two buckets, recording a value costs a few integer operations """
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int) -> None:
+        """ Adds a non-negative value to the histogram """
+        self.counts[min(int(value).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, fraction: float) -> Optional[int]:
+        """ Returns the upper bound of the bucket in which the given fraction of the values is reached """
+        if not self.count:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return min(2 ** i - 1, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        """ Returns a summary of the recorded values with the non-empty buckets keyed by their upper bound """
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': {2 ** i - 1: count for i, count in enumerate(self.counts) if count},
+        }
+
+
+class SocketStats:
+    """ Counters of a bTCP socket, which are cheap enough to be updated for every segment """
+    __slots__ = ('segments_sent', 'bytes_sent', 'segments_received', 'bytes_received', 'retransmissions',
+                 'fast_retransmissions', 'spurious_retransmissions', 'duplicates', 'checksum_failures',
+                 'zero_window_stalls', 'window_probes', 'window_updates', 'queue_full_drops', 'rtt', 'handshake_time')
+
+    def __init__(self):
+        self.segments_sent = 0
+        self.bytes_sent = 0  # payload bytes, headers and padding are not counted
+        self.segments_received = 0
+        self.bytes_received = 0
+        self.retransmissions = 0
+        self.fast_retransmissions = 0  # retransmissions of segments which were deemed lost before their timer expired
+        self.spurious_retransmissions = 0  # fast retransmissions of segments which turned out to be only reordered
+        self.duplicates = 0  # received data segments which were already received before
+        self.checksum_failures = 0  # received segments which were malformed or corrupted
+        self.zero_window_stalls = 0  # times the sender had to wait because the window of the receiver was full
+        self.window_probes = 0  # probes sent while the receiver advertised a zero window
+        self.window_updates = 0  # ACKs sent only to tell the sender that the window reopened
+        self.queue_full_drops = 0  # received segments which did not fit in the receive buffer
+        self.rtt = Histogram()  # round trip time samples in milliseconds
+        self.handshake_time = None  # duration of the three-way handshake in milliseconds
+
+    def snapshot(self) -> dict:
+        """ Returns a copy of the counters """
+        snapshot = {name: getattr(self, name) for name in self.__slots__}
+        snapshot['rtt'] = self.rtt.snapshot()
+        return snapshot
+
+
+class StatsExporter:
+    """ Periodically passes the snapshots of the registered sockets to a sink from a background thread """
+
+    def __init__(self, sink: Callable[[dict], None], interval: float = 1.0):
+        self._sink = sink
+        self._interval = interval  # in seconds
+        self._sockets = {}
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+
+    def register(self, name: str, socket) -> None:
+        """ Includes the socket in the exports under the given name """
+        with self._lock:
+            self._sockets[name] = socket
+
+    def unregister(self, name: str) -> None:
+        with self._lock:
+            self._sockets.pop(name, None)
+
+    def export(self) -> None:
+        """ Passes the current snapshots to the sink """
+        with self._lock:
+            sockets = list(self._sockets.items())
+        self._sink({'time': time.time(), 'sockets': {name: socket.snapshot() for name, socket in sockets}})
+
+    def start(self) -> None:
+        self._event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """ Stops exporting after a last export """
+        self._event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.export()
+
+    def _run(self) -> None:
+        while not self._event.wait(self._interval):
+            self.export()
+
+
+def json_lines(file: TextIO) -> Callable[[dict], None]:
+    """ Returns a sink which writes every export as a line of JSON to the file """
+    def sink(export: dict) -> None:
+        file.write(json.dumps(export) + '\n')
+        file.flush()
+    return sink
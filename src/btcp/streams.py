@@ -0,0 +1,46 @@
+from collections import deque
+from typing import Optional, Tuple
+
+from btcp.codec import STREAM_HEADER
+from btcp.constants import FOUR_BYTES
+from btcp.reassembly import ReassemblyBuffer
+
+
+class StreamDemux:
+    """ Reassembles the streams of a multi-stream connection separately
+    The data of every segment is passed on as soon as it arrives, even if earlier segments of the connection are still
+    missing. Each stream is then delivered once its own data is contiguous, so a loss only holds back the stream it hit.
+    """
+
+    def __init__(self):
+        self._streams = {}  # reassembly buffers of the streams keyed by their ID, offsets wrap around at four bytes
+        self._ends = {}  # offsets at which the streams end, once their last segment arrived
+        self._ready = deque()  # (stream ID, chunk) in the order in which they became deliverable
+
+    @property
+    def held(self) -> int:
+        """ Number of chunks held until they are contiguous within their stream or delivered """
+        return len(self._ready) + sum(buffer.held for buffer in self._streams.values())
+
+    def add(self, data: bytes) -> None:
+        """ Takes the data of a segment, which starts with the stream header, an empty chunk ends its stream """
+        stream, offset = STREAM_HEADER.unpack_from(data)
+        buffer = self._streams.get(stream)
+        if buffer is None:
+            buffer = self._streams[stream] = ReassemblyBuffer(0, FOUR_BYTES)
+        if len(data) == STREAM_HEADER.size:
+            self._ends[stream] = offset
+        else:
+            buffer.add(offset, data[STREAM_HEADER.size:])
+        chunk = buffer.pop()
+        while chunk is not None:
+            self._ready.append((stream, chunk))
+            chunk = buffer.pop()
+        if self._ends.get(stream) == buffer.seq_nr:
+            del self._ends[stream]
+            del self._streams[stream]
+            self._ready.append((stream, b''))
+
+    def pop(self) -> Optional[Tuple[int, bytes]]:
+        """ Returns the next (stream ID, chunk) which can be delivered or None if there is none """
+        return self._ready.popleft() if self._ready else None
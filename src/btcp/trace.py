@@ -0,0 +1,140 @@
+import itertools
+import json
+import struct
+import sys
+import time
+from collections import namedtuple
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from btcp.constants import TRACE_CAPACITY, TWO_BYTES, FOUR_BYTES
+from btcp.enums import Flag, TraceEvent
+
+MAGIC = b'BTCPTRC3'
+FILE_HEADER = struct.Struct('!8sII')  # magic, number of records and length of the connection names
+RECORD = struct.Struct('!dHBBIIiH')  # time, connection, event, flag, seq, ack, unscaled window and data length
+FLAGS = {flag.value: flag for flag in Flag}
+EVENTS = {event.value: event for event in TraceEvent}
+
+TraceRecord = namedtuple('TraceRecord', ['time', 'connection', 'event', 'flag', 'seq_nr', 'ack_nr', 'win', 'dlen'])
+
+
+class Tracer:
+    """ Records the headers of the sent and received segments into a preallocated ring buffer
+    Recording packs a fixed size record in place, so the tracer can stay enabled under load. Once the ring is full the
+    oldest records are overwritten. A tracer may be shared by many sockets, each registers as a separate connection.
+    """
+
+    def __init__(self, capacity: int = TRACE_CAPACITY):
+        self._capacity = capacity
+        self._buffer = bytearray(capacity * RECORD.size)
+        self._counter = itertools.count()  # taking the next index is atomic, so threads never share a slot
+        self._count = 0
+        self._names = []
+
+    def register(self, name: str) -> int:
+        """ Adds a connection to the trace and returns its identifier """
+        self._names.append(name)
+        return len(self._names) - 1
+
+    def record(self, connection: int, event: TraceEvent, flag: Flag, seq_nr: int, ack_nr: int, win: int,
+               dlen: int) -> None:
+        """ Records an event of a segment of the connection """
+        index = next(self._counter)
+        RECORD.pack_into(self._buffer, index % self._capacity * RECORD.size, time.time(), connection, event.value,
+                         flag.value, seq_nr, ack_nr, win, dlen)
+        self._count = max(self._count, index + 1)
+
+    def flush(self, file: BinaryIO) -> int:
+        """ Writes the recorded events from old to new to the binary file, returns the number of records """
+        count = min(self._count, self._capacity)
+        start = self._count % self._capacity if self._count > self._capacity else 0
+        view = memoryview(self._buffer)
+        names = json.dumps(self._names).encode()
+        file.write(FILE_HEADER.pack(MAGIC, count, len(names)))
+        file.write(names)
+        file.write(view[start * RECORD.size:count * RECORD.size])
+        file.write(view[:start * RECORD.size])
+        return count
+
+
+def read_trace(file: BinaryIO) -> Tuple[List[str], List[TraceRecord]]:
+    """ Reads a binary trace and returns the names of the connections and the records """
+    magic, count, length = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('Not a bTCP trace')
+    names = json.loads(file.read(length))
+    records = []
+    for fields in RECORD.iter_unpack(file.read(count * RECORD.size)):
+        stamp, connection, event, flag, seq_nr, ack_nr, win, dlen = fields
+        records.append(TraceRecord(stamp, connection, EVENTS[event], FLAGS[flag], seq_nr, ack_nr, win, dlen))
+    return names, records
+
+
+def timelines(records: List[TraceRecord]) -> Dict[int, List[Tuple[float, TraceEvent, int, Optional[int]]]]:
+    """ Rebuilds the sequence and ACK numbers over time of every connection
+    The numbers are unwrapped into positions in the byte stream of either end, so that the timeline grows
+    monotonically. Received segments carry the sequence numbers of the other end and acknowledge those of this end.
+    Connections with numbers beyond two bytes negotiated the extended header and wrap around at four bytes instead.
+    A SYN request acknowledges nothing yet, so its ACK number is None and does not serve as the start of the positions.
+    """
+    lines = {}
+    last = {}  # last raw and unwrapped numbers per connection and stream
+    extended = {record.connection for record in records if max(record.seq_nr, record.ack_nr) >= TWO_BYTES}
+    start = records[0].time if records else 0
+    for record in records:
+        # Dropped segments could not be decoded, so their numbers are unknown
+        if record.event is TraceEvent.DROP:
+            continue
+        received = record.event is TraceEvent.RECV
+        space = FOUR_BYTES if record.connection in extended else TWO_BYTES
+        seq_nr = _unwrap(last, (record.connection, 'remote' if received else 'local'), record.seq_nr, space)
+        ack_nr = None
+        if record.flag is not Flag.SYN:
+            ack_nr = _unwrap(last, (record.connection, 'local' if received else 'remote'), record.ack_nr, space)
+        lines.setdefault(record.connection, []).append((record.time - start, record.event, seq_nr, ack_nr))
+    return lines
+
+
+def _unwrap(last: dict, key, number: int, space: int) -> int:
+    """ Turns a sequence number into a position relative to the first one seen, assuming it moved less than half of
+    the sequence space
+    """
+    if key not in last:
+        last[key] = (number, 0)
+        return 0
+    raw, position = last[key]
+    distance = (number - raw) % space
+    if distance >= space // 2:
+        distance -= space
+    last[key] = (number, position + distance)
+    return position + distance
+
+
+def throughput(records: List[TraceRecord], interval: float = 0.1) -> Dict[int, List[Tuple[float, float]]]:
+    """ Computes the bytes per second of data which every connection sent or received in each interval (in seconds) """
+    series = {}
+    start = records[0].time if records else 0
+    for record in records:
+        if record.event is not TraceEvent.DROP and record.flag is Flag.NONE and record.dlen:
+            buckets = series.setdefault(record.connection, {})
+            bucket = int((record.time - start) / interval)
+            buckets[bucket] = buckets.get(bucket, 0) + record.dlen
+    return {connection: [(bucket * interval, total / interval) for bucket, total in sorted(buckets.items())]
+            for connection, buckets in series.items()}
+
+
+def summary(names: List[str], records: List[TraceRecord]) -> str:
+    """ Describes the events and the throughput of every connection in the trace """
+    lines = []
+    rates = throughput(records)
+    for connection, name in enumerate(names):
+        events = [record.event for record in records if record.connection == connection]
+        counts = ', '.join(f'{event.name.lower()}: {events.count(event)}' for event in TraceEvent)
+        peak = max((rate for _, rate in rates.get(connection, [])), default=0)
+        lines.append(f'{name}: {counts}; peak throughput {peak / 1e6:.2f} MB/s')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'rb') as f:
+        print(summary(*read_trace(f)))
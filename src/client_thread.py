@@ -1,3 +1,5 @@
+import time
+
 from btcp.client_socket import BTCPClientSocket
 from threading import Thread
 
@@ -5,17 +7,24 @@ from threading import Thread
 class ClientThread(Thread):
     """ Simulates the client with a single socket """
 
-    def __init__(self, window, timeout, show_prints):
+    def __init__(self, window, timeout, show_prints, impairment=None, input_file='src/inputs/input.file'):
         super().__init__()
-        self.socket = BTCPClientSocket(window, timeout, show_prints)
+        self.socket = BTCPClientSocket(window, timeout, show_prints, impairment=impairment)
+        self.input_file = input_file
         self.sent_bytes = b''
+        self.connect_time = None  # duration of the handshake in seconds
+        self.send_time = None  # duration of the transfer in seconds
 
     def run(self):
         """ The main loop of the client """
+        start = time.perf_counter()
         self.socket.connect()
-        with open('src/inputs/output.file', 'rb') as f:
+        self.connect_time = time.perf_counter() - start
+        with open(self.input_file, 'rb') as f:
             self.sent_bytes = f.read()
+        start = time.perf_counter()
         self.socket.send(self.sent_bytes)
+        self.send_time = time.perf_counter() - start
         self.socket.disconnect()
         self.socket.close()
 
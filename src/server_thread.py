@@ -1,3 +1,4 @@
+from contextlib import nullcontext
 from btcp.server_socket import BTCPServerSocket
 from threading import Thread
 
@@ -5,17 +6,24 @@ from threading import Thread
 class ServerThread(Thread):
     """ Simulates the server with a single socket """
 
-    def __init__(self, window, timeout, show_prints):
+    def __init__(self, window, timeout, show_prints, impairment=None, output_file=None):
         super().__init__()
-        self.socket = BTCPServerSocket(window, timeout, show_prints)
+        self.socket = BTCPServerSocket(window, timeout, show_prints, impairment=impairment)
+        self.output_file = output_file  # file the data is written to while it arrives, None keeps it in memory only
         self.received_bytes = b''
 
     def run(self):
         """ The main loop of the server """
-        self.socket.accept()
-        self.received_bytes = self.socket.recv()
-        with open('src/inputs/output.file', 'wb') as f:
-            f.write(self.received_bytes)
+        connection = self.socket.accept()
+        received = bytearray()
+        # Write the data to disk while the transfer is still running
+        with open(self.output_file, 'wb') if self.output_file else nullcontext() as f:
+            for chunk in connection.recv_stream():
+                if f:
+                    f.write(chunk)
+                received += chunk
+        self.received_bytes = bytes(received)
+        connection.close()
         self.socket.close()
 
     def get_recv_file(self):
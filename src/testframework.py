@@ -1,15 +1,20 @@
+import os
 import sys
+import tempfile
 import time
 import unittest
 from socket import *
 
+from btcp.impairment import Impairment
 from client_thread import ClientThread
 from server_thread import ServerThread
 
 timeout = 100  # Set the default timeout
 winsize = 5  # Set the windows size
-run_commands = False  # Set to True if you want to run commands
+run_commands = False  # Set to True if you want to run commands, otherwise the network is emulated in-process
 show_prints = False  # Set to True if you want to see the prints
+seed = 0  # Seed of the emulated network, the same seed gives the same impairments
+input_file = "src/inputs/input.file"  # Set the file which the client sends
 
 intf = "lo"
 netem_add = "sudo tc qdisc add dev {} root netem".format(intf)
@@ -53,8 +58,13 @@ class TestbTCPFramework(unittest.TestCase):
         """Prepare for testing"""
         if run_commands:
             run_command(netem_add)
-        self.server = ServerThread(winsize, timeout, show_prints)
-        self.client = ClientThread(winsize, timeout, show_prints)
+        self.options = None
+
+    def impair(self, options):
+        """impair the loopback interface with netem, or emulate the impairments on both ends if commands are not run"""
+        if run_commands:
+            run_command(netem_change.format(options))
+        self.options = options
 
     def tearDown(self):
         """Clean up after testing"""
@@ -67,48 +77,57 @@ class TestbTCPFramework(unittest.TestCase):
 
     def test_flipping_network(self):
         """reliability over network with bit flips (which sometimes results in lower layer packet loss)"""
-        if run_commands:
-            run_command(netem_change.format("corrupt 1%"))
+        self.impair("corrupt 1%")
         self.run_test()
 
     def test_duplicates_network(self):
         """reliability over network with duplicate packets"""
-        if run_commands:
-            run_command(netem_change.format("duplicate 10%"))
+        self.impair("duplicate 10%")
         self.run_test()
 
     def test_lossy_network(self):
         """reliability over network with packet loss"""
-        if run_commands:
-            run_command(netem_change.format("loss 10% 25%"))
+        self.impair("loss 10% 25%")
         self.run_test()
 
     def test_reordering_network(self):
         """reliability over network with packet reordering"""
-        if run_commands:
-            run_command(netem_change.format("delay 20ms reorder 25% 50%"))
+        self.impair("delay 20ms reorder 25% 50%")
         self.run_test()
 
     def test_delayed_network(self):
         """reliability over network with delay relative to the timeout value"""
-        if run_commands:
-            run_command(netem_change.format("delay "+str(timeout)+"ms 20ms"))
+        self.impair("delay "+str(timeout)+"ms 20ms")
         self.run_test()
 
     def test_allbad_network(self):
         """reliability over network with all of the above problems"""
-        if run_commands:
-            run_command(netem_change.format("corrupt 1% duplicate 10% loss 10% 25% delay 20ms reorder 25% 50%"))
+        self.impair("corrupt 1% duplicate 10% loss 10% 25% delay 20ms reorder 25% 50%")
         self.run_test()
 
     def run_test(self):
-        self.server.start()
-        self.client.start()
-        self.server.join()
-        self.client.join()
+        emulate = self.options and not run_commands
+        # The server writes into a temporary file, so the tracked files in src/inputs stay untouched
+        with tempfile.TemporaryDirectory() as directory:
+            output_file = os.path.join(directory, "output.file")
+            self.server = ServerThread(winsize, timeout, show_prints,
+                                       Impairment.parse(self.options, seed) if emulate else None,
+                                       output_file=output_file)
+            self.client = ClientThread(winsize, timeout, show_prints,
+                                       Impairment.parse(self.options, seed + 1) if emulate else None,
+                                       input_file=input_file)
+            self.server.start()
+            self.client.start()
+            self.server.join()
+            self.client.join()
+            with open(output_file, "rb") as f:
+                written = f.read()
+        with open(input_file, "rb") as f:
+            original = f.read()
         sent = self.client.get_sent_file()
         recv = self.server.get_recv_file()
         self.assertEqual(sent, recv)
+        self.assertEqual(original, written)
 
 
 if __name__ == "__main__":
@@ -118,9 +137,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="bTCP tests")
     parser.add_argument("-w", "--window", help="Define bTCP window size used", type=int, default=100)
     parser.add_argument("-t", "--timeout", help="Define the timeout value used (ms)", type=int, default=timeout)
+    parser.add_argument("-s", "--seed", help="Define the seed of the emulated network", type=int, default=seed)
+    parser.add_argument("-n", "--netem", help="Impair the loopback interface with netem (requires sudo)",
+                        action="store_true", default=run_commands)
     args, extra = parser.parse_known_args()
     timeout = args.timeout
     winsize = args.window
+    seed = args.seed
+    run_commands = args.netem
 
     # Pass the extra arguments to unit test
     sys.argv[1:] = extra
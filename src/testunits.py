@@ -0,0 +1,915 @@
+import asyncio
+import errno
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import benchmark
+from btcp.aio_socket import AsyncBTCPClientSocket, AsyncBTCPServerSocket
+from btcp.btcp_socket import BTCPSocket
+from btcp.client_socket import BTCPClientSocket
+from btcp.checksum import summed_length, valid, valid_many, numpy
+from btcp.codec import SegmentEncoder, decode, encode_options, encode_sack, decode_sack, LEGACY, EXTENDED, \
+    frame_message, MESSAGE_HEADER
+from btcp.congestion import CongestionControl, Reno
+from btcp.constants import TWO_BYTES, MIN_TIMEOUT, MAX_TIMEOUT, INITIAL_CWND, SEGMENT_SIZE, HEADER_SIZE, \
+    DUPACK_THRESHOLD, QUICK_ACKS, COOKIE_SIZE, HANDSHAKE_TIMEOUT, ACK_EVERY, ACK_DELAY, SERVER_IP, \
+    SERVER_PORT, CKSUM_OFFSET
+from btcp.delayed_ack import DelayedAck
+from btcp.enums import Option, Flag, State, TraceEvent
+from btcp.fast_open import FastOpen
+from btcp.impairment import Impairment
+from btcp.listener import BTCPListener
+from btcp.lossy_layer import BufferPool, LossyLayer
+from btcp.pool import ConnectionPool
+from btcp.reassembly import ReassemblyBuffer
+from btcp.receive_buffer import ReceiveBuffer
+from btcp.receiver import BTCPReceiver
+from btcp.rtt import RttEstimator
+from btcp.segment import Segment
+from btcp.send_window import SendWindow
+from btcp.sender import BTCPSender, split_data
+from btcp.stats import StatsExporter, json_lines
+from btcp.server_socket import BTCPServerSocket, BTCPServerConnection
+from btcp.streams import StreamDemux
+from btcp.trace import Tracer, TraceRecord, read_trace, throughput, timelines
+
+size = 100  # Set the payload size of the segments in the send window
+
+
+def make_window(count, slots, timeout=100):
+    """create a send window of count segments of which the first slots are sent"""
+    segments = [Segment(bytes(size), seq_nr=i * size, exp_ack=(i + 1) * size) for i in range(count)]
+    window = SendWindow(iter(segments), slots)
+    for segment in segments[:slots]:
+        window.mark_sent(segment, 0, timeout)
+    return window, segments
+
+
+class Sender(BTCPSender, BTCPSocket):
+    """sending half of a socket without a network"""
+
+    def __init__(self, window, timeout):
+        super().__init__(window, timeout, 'test')
+        self.setup_sender(Reno, HANDSHAKE_TIMEOUT, None, False)
+
+
+class Receiver(BTCPReceiver, BTCPSocket):
+    """receiving half of a socket without a network"""
+
+    def __init__(self, window, timeout):
+        super().__init__(window, timeout, 'test')
+        self.setup_receiver(DelayedAck(ACK_EVERY, ACK_DELAY))
+
+
+class RawClient:
+    """client which puts hand-made legacy segments into the network, so that a test decides which ones are lost"""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((SERVER_IP, 0))
+        self.sock.settimeout(2)
+        self.encoder = SegmentEncoder()
+
+    def send(self, seq_nr, ack_nr, flag, options=None, data=b''):
+        segment = self.encoder.encode(seq_nr, ack_nr, flag, 10, data, options=encode_options(options or {}))
+        self.sock.sendto(bytes(segment), (SERVER_IP, SERVER_PORT))
+
+    def receive(self):
+        return decode(self.sock.recv(SEGMENT_SIZE))
+
+    def close(self):
+        self.sock.close()
+
+
+class TestbTCPUnits(unittest.TestCase):
+    """Unit tests of the building blocks of bTCP"""
+
+    def test_reassembly_wraparound(self):
+        """data is reordered and acknowledged across the wraparound of the sequence numbers"""
+        buffer = ReassemblyBuffer(TWO_BYTES - 50)
+        self.assertTrue(buffer.add(50, b'b' * 100))
+        self.assertTrue(buffer.has_gap)
+        self.assertEqual(buffer.sack_blocks(4), [(50, 150)])
+        self.assertTrue(buffer.add(TWO_BYTES - 50, b'a' * 100))
+        self.assertFalse(buffer.has_gap)
+        self.assertEqual(buffer.seq_nr, 150)
+        self.assertEqual([buffer.pop(), buffer.pop(), buffer.pop()], [b'a' * 100, b'b' * 100, None])
+        # Sequence numbers before the wraparound were already received
+        self.assertFalse(buffer.add(TWO_BYTES - 50, b'a' * 100))
+
+    def test_cumulative_ack(self):
+        """an ACK acknowledges every segment up to the one it expects and the window slides past them"""
+        window, segments = make_window(6, 4)
+        self.assertEqual(window.ack(segments[2].exp_ack), segments[:3])
+        self.assertEqual(window.in_flight, 1)
+        self.assertEqual(window.advance(), segments[2].exp_ack)
+        # The free slots are filled with the upcoming segments
+        self.assertEqual(len(window), 3)
+        self.assertIs(window.next_unsent(), segments[4])
+
+    def test_rtt_estimation(self):
+        """the retransmission timeout follows the RTT samples, doubles on expiry and stays within its bounds"""
+        rtt = RttEstimator(100)
+        self.assertEqual(rtt.rto, 100)
+        rtt.sample(200)
+        self.assertEqual(rtt.rto, 200 + 4 * 100)
+        rtt.backoff()
+        self.assertEqual(rtt.rto, 1200)
+        # A new sample replaces the backed off timeout
+        rtt.sample(200)
+        self.assertEqual(rtt.rto, 200 + 4 * 75)
+        self.assertEqual(RttEstimator(1).rto, MIN_TIMEOUT)
+        for _ in range(20):
+            rtt.backoff()
+        self.assertEqual(rtt.rto, MAX_TIMEOUT)
+
+    def test_karn(self):
+        """retransmitted segments are marked, so that their ACKs are not taken as RTT samples"""
+        window, segments = make_window(2, 2)
+        self.assertFalse(segments[0].retransmitted)
+        window.mark_sent(segments[0], 150, 100)
+        self.assertTrue(segments[0].retransmitted)
+        self.assertEqual(window.in_flight, 2)
+        self.assertEqual(window.next_deadline(), 100)
+        self.assertEqual(window.expired(100), [segments[1]])
+
+    def test_selective_ack(self):
+        """a SACK block acknowledges the segments it covers and the holes behind enough of them are lost"""
+        window, segments = make_window(4, 4)
+        self.assertEqual(window.sack(segments[2].seq_nr, segments[3].exp_ack), segments[2:])
+        self.assertIsNone(window.advance())
+        self.assertEqual(window.lost(3), [])
+        window.sack(segments[1].seq_nr, segments[1].exp_ack)
+        self.assertEqual(window.lost(3), [segments[0]])
+        # A block which does not match the segment boundaries acknowledges nothing
+        self.assertEqual(window.sack(segments[0].seq_nr + 1, segments[0].exp_ack), [])
+
+    def test_legacy_ack(self):
+        """without cumulative ACKs only the segment which the ACK expects is acknowledged"""
+        window, segments = make_window(4, 4)
+        self.assertEqual(window.ack(segments[2].exp_ack, cumulative=False), [segments[2]])
+        self.assertIsNone(window.advance())
+        self.assertEqual(window.ack(segments[0].exp_ack, cumulative=False), [segments[0]])
+        self.assertEqual(window.advance(), segments[0].exp_ack)
+        # An ACK of a segment which already left the window is no duplicate ACK
+        window.ack(segments[0].exp_ack, cumulative=False)
+        self.assertEqual(window.dup_acks, 0)
+
+    def test_sack_option(self):
+        """cumulative ACKs are only used if both ends offered the SACK option"""
+        sock = BTCPSocket(10, 100, 'test')
+        options = sock.offer_options()
+        sock.apply_options(options)
+        self.assertTrue(sock.cumulative_acks and sock.delayed_acks)
+        # Delayed ACKs cover several segments, so they are off without cumulative ACKs
+        del options[Option.SACK]
+        sock.apply_options(options)
+        self.assertFalse(sock.cumulative_acks or sock.delayed_acks)
+        sock.apply_options({})
+        self.assertFalse(sock.cumulative_acks)
+
+    def test_reno(self):
+        """Reno goes through slow start, congestion avoidance, fast recovery and timeouts"""
+        reno = Reno()
+        self.assertEqual(reno.cwnd, INITIAL_CWND)
+        reno.on_ack(2, INITIAL_CWND)
+        self.assertEqual(reno.cwnd, INITIAL_CWND + 2)
+        # The window does not grow while the receiver limits the sender
+        reno.on_ack(2, 1)
+        self.assertEqual(reno.cwnd, INITIAL_CWND + 2)
+        reno.on_loss(8)
+        self.assertEqual((reno.cwnd, reno.ssthresh), (4, 4))
+        reno.on_ack(4, 4)
+        self.assertEqual(reno.cwnd, 5)
+        # A spurious loss restores the windows from before it
+        reno.undo()
+        self.assertEqual((reno.cwnd, reno.ssthresh), (INITIAL_CWND + 2, float('inf')))
+        reno.on_timeout(10)
+        self.assertEqual((reno.cwnd, reno.ssthresh), (1, 5))
+        reno.undo()
+        self.assertEqual(reno.cwnd, 1)
+        with self.assertRaises(TypeError):
+            CongestionControl()
+
+    def test_buffer_pool(self):
+        """released receive buffers are handed out again, up to the size of the pool"""
+        pool = BufferPool(size=1)
+        buffer = pool.acquire()
+        self.assertEqual(len(buffer), SEGMENT_SIZE)
+        # Once all buffers are in use a new one is allocated
+        extra = pool.acquire()
+        self.assertIsNot(extra, buffer)
+        # A received segment is a view of its buffer
+        pool.release(memoryview(buffer)[:10])
+        self.assertIs(pool.acquire(), buffer)
+        pool.release(buffer)
+        pool.release(extra)
+        pool.release(bytes(SEGMENT_SIZE))
+        self.assertIs(pool.acquire(), buffer)
+        self.assertIsNot(pool.acquire(), extra)
+
+    def test_impairment_options(self):
+        """impairment options are parsed like netem options and bad ones are refused"""
+        impairment = Impairment.parse('loss 10% 25% delay 20ms 5ms rate 1mbit', seed=0)
+        self.assertEqual((impairment.loss, impairment.loss_correlation), (0.1, 0.25))
+        for options in ('loss', 'loss gemodel', 'delay 20ms rate', 'delay 5xs', 'jitter 5ms'):
+            with self.assertRaises(ValueError):
+                Impairment.parse(options)
+
+    def test_impairment_seed(self):
+        """a seeded impairment loses, duplicates, corrupts and delays the same segments in every run"""
+        options = 'loss 10% 25% duplicate 10% corrupt 10% delay 20ms 5ms reorder 25% 50%'
+        segments = [bytes([i]) * 100 for i in range(200)]
+
+        def run(seed):
+            impairment = Impairment.parse(options, seed)
+            return [impairment.impair(segment, i / 100) for i, segment in enumerate(segments)]
+
+        fates = run(7)
+        self.assertEqual(run(7), fates)
+        self.assertNotEqual(run(8), fates)
+        # Every kind of decision was taken at least once, so the comparison covers all of them
+        self.assertIn([], fates)
+        self.assertIn(2, [len(copies) for copies in fates])
+        self.assertTrue(any(data != segment for copies, segment in zip(fates, segments) for _, data in copies))
+        self.assertGreater(len({round(due - i / 100, 6) for i, copies in enumerate(fates) for due, _ in copies}), 2)
+
+    def test_tracer(self):
+        """a flushed trace reads back with the names of the connections and the newest records"""
+        tracer = Tracer(capacity=2)
+        client = tracer.register('client')
+        server = tracer.register('server')
+        tracer.record(client, TraceEvent.SEND, Flag.SYN, 1, 0, 10, 0)
+        tracer.record(server, TraceEvent.RECV, Flag.SYN, 1, 0, 10, 0)
+        tracer.record(server, TraceEvent.SEND, Flag.SYNACK, 7, 2, 10, 0)
+        file = io.BytesIO()
+        self.assertEqual(tracer.flush(file), 2)
+        file.seek(0)
+        names, records = read_trace(file)
+        self.assertEqual(names, ['client', 'server'])
+        # Once the ring is full the oldest records are overwritten
+        self.assertEqual([record[1:6] for record in records],
+                         [(server, TraceEvent.RECV, Flag.SYN, 1, 0), (server, TraceEvent.SEND, Flag.SYNACK, 7, 2)])
+        with self.assertRaises(ValueError):
+            read_trace(io.BytesIO(bytes(64)))
+
+    def test_trace_timelines(self):
+        """the timelines of a trace unwrap the numbers from the start of the handshake and the throughput counts data"""
+        records = [TraceRecord(*fields) for fields in (
+            # The ACK number of the SYN request is not yet meaningful
+            (8.0, 0, TraceEvent.SEND, Flag.SYN, 65530, 9999, 10, 0),
+            (8.0625, 0, TraceEvent.RECV, Flag.SYNACK, 500, 65531, 10, 0),
+            (8.25, 0, TraceEvent.SEND, Flag.ACK, 65531, 501, 10, 0),
+            (8.25, 0, TraceEvent.SEND, Flag.NONE, 65531, 501, 10, 1000),
+            (8.375, 0, TraceEvent.SEND, Flag.NONE, 995, 501, 10, 1000),
+            (8.4375, 0, TraceEvent.DROP, Flag.NONE, 0, 0, 0, 0),
+            (8.5, 0, TraceEvent.RECV, Flag.ACK, 501, 1995, 10, 0))]
+        lines = timelines(records)
+        self.assertEqual([line[1:] for line in lines[0]],
+                         [(TraceEvent.SEND, 0, None), (TraceEvent.RECV, 0, 1), (TraceEvent.SEND, 1, 1),
+                          (TraceEvent.SEND, 1, 1), (TraceEvent.SEND, 1001, 1), (TraceEvent.RECV, 1, 2001)])
+        self.assertEqual(lines[0][-1][0], 0.5)
+        # Both data segments were sent in the second interval of 250 ms
+        self.assertEqual(throughput(records, interval=0.25), {0: [(0.25, 8000)]})
+
+    def test_tracer_scaled_window(self):
+        """the trace records windows which only fit in the window field once they are scaled"""
+        window = 40000
+        tracer = Tracer()
+        listener = BTCPServerSocket(window, 100, False, tracer=tracer)
+        self.addCleanup(listener.close)
+        received = []
+        server = threading.Thread(target=lambda: received.append(listener.accept().recv()), daemon=True)
+        server.start()
+        client = BTCPClientSocket(window, 100, False, tracer=tracer)
+        self.addCleanup(client.close)
+        client.connect()
+        client.send(b'scaled')
+        client.disconnect()
+        server.join(10)
+        self.assertEqual(received, [b'scaled'])
+        file = io.BytesIO()
+        tracer.flush(file)
+        file.seek(0)
+        _, records = read_trace(file)
+        self.assertIn((TraceEvent.SEND, Flag.SYNACK), [(record.event, record.flag) for record in records])
+        self.assertGreaterEqual(max(record.win for record in records), 32768)
+
+    def check_valid_many(self):
+        """checks a batch of checksums at once and one by one with the same results"""
+        encoder = SegmentEncoder()
+        segments = [bytes(encoder.encode(i, 0, Flag.NONE, 5, bytes([i]) * (i * 101), short=i % 2 == 1))
+                    for i in range(1, 5)]
+        corrupted = bytearray(segments[1])
+        corrupted[HEADER_SIZE] ^= 1
+        segments[1] = bytes(corrupted)
+        expected = [True, False, True, True]
+        self.assertEqual([valid(segment, summed_length(segment)) for segment in segments], expected)
+        self.assertEqual(valid_many(segments), expected)
+        self.assertEqual(valid_many(segments[1:2]), [False])
+        # Malformed segments are invalid
+        self.assertEqual(valid_many([segments[0], segments[0][:HEADER_SIZE - 1]]), [True, False])
+
+    def test_valid_many_fallback(self):
+        """without NumPy a batch of checksums is checked one segment at a time"""
+        with mock.patch('btcp.checksum.numpy', None):
+            self.check_valid_many()
+
+    @unittest.skipUnless(numpy, 'NumPy is not installed')
+    def test_valid_many_numpy(self):
+        """with NumPy a batch of checksums is checked at once"""
+        self.check_valid_many()
+        segments = [bytes(SegmentEncoder().encode(i, 0, Flag.NONE, 5, b'data')) for i in range(3)]
+        with mock.patch('btcp.checksum.valid', side_effect=AssertionError('checked one by one')):
+            self.assertEqual(valid_many(segments), [True] * 3)
+
+    def test_codec_round_trip(self):
+        """segments decode to what was encoded in both header layouts"""
+        encoder = SegmentEncoder()
+        for layout, seq_nr, ack_nr in ((LEGACY, 65000, 12), (EXTENDED, 70000, 80000)):
+            for short in (False, True):
+                segment = bytes(encoder.encode(seq_nr, ack_nr, Flag.NONE, 7, b'data', short=short, layout=layout))
+                message = decode(segment, layout=layout)
+                self.assertEqual((message.seq_nr, message.ack_nr, message.flag, message.win, message.dlen),
+                                 (seq_nr, ack_nr, Flag.NONE, 7, 4))
+                self.assertEqual(bytes(message.data), b'data')
+            blocks = [(seq_nr, seq_nr + 100), (seq_nr + 300, seq_nr + 400)]
+            self.assertEqual(decode_sack(memoryview(encode_sack(blocks, layout)), layout), blocks)
+
+    def test_codec_handshake(self):
+        """handshake segments carry their options and always have the legacy header"""
+        options = {Option.SHORT_SEGMENTS: b'', Option.WINDOW_SCALE: bytes([3])}
+        segment = bytes(SegmentEncoder().encode(1, 0, Flag.SYN, 5, options=encode_options(options), layout=EXTENDED))
+        message = decode(segment, layout=EXTENDED)
+        self.assertEqual((message.seq_nr, message.flag, message.options), (1, Flag.SYN, options))
+        # A flipped bit in the options breaks the checksum
+        corrupted = bytearray(segment)
+        corrupted[-1] ^= 1
+        self.assertIsNone(decode(bytes(corrupted), layout=EXTENDED))
+        corrupted = bytearray(segment)
+        corrupted[CKSUM_OFFSET] ^= 1
+        self.assertIsNone(decode(bytes(corrupted)))
+
+    def test_short_segments(self):
+        """short segments are only sent once both ends agreed on them, handshake segments stay full size"""
+        data = b'x' * 10
+        short = bytes(SegmentEncoder().encode(1, 2, Flag.NONE, 5, data, short=True))
+        self.assertEqual(len(short), HEADER_SIZE + len(data))
+        self.assertEqual(bytes(decode(short).data), data)
+        client, server = Sender(10, 100), Receiver(10, 100)
+        server._lossy_layer = mock.Mock()
+        agreed = server.apply_options(client.offer_options())
+        self.assertIn(Option.SHORT_SEGMENTS, agreed)
+        self.assertTrue(server.short_segments)
+        # The SYNACK carries the agreed options, so it is sent in full size for legacy clients
+        server.post(server.seq_nr, 1, Flag.SYNACK, options=agreed)
+        server.post(server.seq_nr, 1, Flag.ACK)
+        sent = [len(call.args[0]) for call in server._lossy_layer.send_segment.call_args_list]
+        self.assertEqual(sent, [SEGMENT_SIZE, server.layout.header_size])
+        # A legacy client does not send options and keeps receiving full size segments
+        server.apply_options({})
+        self.assertFalse(server.short_segments)
+        # Either end can turn the mode off
+        client._offer_short = False
+        self.assertNotIn(Option.SHORT_SEGMENTS, server.apply_options(client.offer_options()))
+
+    def test_duplicate_acks(self):
+        """duplicate ACKs reveal the loss of the first segment, window updates do not count as duplicates"""
+        window, segments = make_window(4, 4)
+        window.ack(segments[0].seq_nr, window_update=True)
+        self.assertEqual(window.dup_acks, 0)
+        for _ in range(3):
+            self.assertEqual(window.ack(segments[0].seq_nr), [])
+        self.assertEqual(window.dup_acks, 3)
+        self.assertEqual(window.lost(3), [segments[0]])
+        # A segment is only reported as lost once
+        self.assertEqual(window.lost(3), [])
+
+    def test_reordering_threshold(self):
+        """a retransmission which turns out to be spurious raises the reordering threshold up to the window"""
+        sock = Sender(5, 100)
+        sock.rtt.sample(100)
+        window, segments = make_window(1, 1)
+        segments[0].lost = True
+        window.mark_sent(segments[0], sock.time(), 100)
+        self.assertTrue(sock.detect_spurious(segments))
+        self.assertEqual(sock.reordering, 5)
+        # The threshold never falls below the current one, even if the window is smaller
+        sock = Sender(1, 100)
+        sock.rtt.sample(100)
+        self.assertTrue(sock.detect_spurious(segments))
+        self.assertEqual(sock.reordering, DUPACK_THRESHOLD)
+
+    def test_delayed_ack(self):
+        """in-order data is acknowledged every few segments or once the delay expires, anything else right away"""
+        ack = DelayedAck(2, 10)
+        # The segments at the start of the connection are acknowledged right away
+        for _ in range(QUICK_ACKS):
+            self.assertTrue(ack.on_data(0, True, True, 10))
+        ack.sent()
+        self.assertFalse(ack.on_data(0, True, True, 10))
+        self.assertEqual(ack.deadline, 10)
+        self.assertTrue(ack.on_data(5, True, True, 10))
+        ack.sent()
+        self.assertIsNone(ack.deadline)
+        self.assertFalse(ack.on_data(20, True, True, 10))
+        self.assertFalse(ack.due(29))
+        self.assertTrue(ack.due(30))
+        ack.sent()
+        # A segment which is not full ends a write of the sender
+        self.assertTrue(ack.on_data(40, True, False, 10))
+        ack.sent()
+        # A segment out of order is acknowledged right away and so are the segments after the disorder
+        self.assertTrue(ack.on_data(40, False, True, 10))
+        self.assertTrue(ack.on_data(40, True, True, 10))
+
+    def test_connection_pool(self):
+        """messages sent through a connection pool share one connection and are received whole"""
+        self.assertEqual(b''.join(frame_message(b'abc')), MESSAGE_HEADER.pack(3) + b'abc')
+        messages = [bytes([i]) * (i * 700) for i in range(5)]
+        received = []
+        listener = BTCPServerSocket(10, 100, False)
+
+        def serve():
+            # Only a single connection is accepted, so the messages only arrive if the pool reuses it
+            connection = listener.accept()
+            message = connection.recv_message()
+            while message is not None:
+                received.append(message)
+                message = connection.recv_message()
+            connection.close()
+
+        server = threading.Thread(target=serve, daemon=True)
+        server.start()
+        pool = ConnectionPool(10, 100)
+        for message in messages:
+            self.assertTrue(pool.send_message(message))
+        pool.close()
+        server.join(10)
+        listener.close()
+        self.assertEqual(received, messages)
+
+    def test_fast_open_cookies(self):
+        """a fast open cookie is only accepted from the address it was issued to and by the server which issued it"""
+        fast_open = FastOpen()
+        cookie = fast_open.cookie(('127.0.0.1', 20000))
+        self.assertEqual(len(cookie), COOKIE_SIZE)
+        # The cookie belongs to the IP address of the client, whichever port it connects from
+        self.assertTrue(fast_open.valid(('127.0.0.1', 20001), cookie))
+        self.assertFalse(fast_open.valid(('127.0.0.2', 20000), cookie))
+        self.assertFalse(fast_open.valid(('127.0.0.1', 20000), bytes(COOKIE_SIZE)))
+        self.assertFalse(FastOpen().valid(('127.0.0.1', 20000), cookie))
+
+    def test_fast_open(self):
+        """a client fetches a cookie in its first handshake and sends data in the SYN request of the next ones"""
+        listener = BTCPServerSocket(10, 100, False, fast_open=True)
+        self.addCleanup(listener.close)
+        received = []
+
+        def serve(count):
+            for _ in range(count):
+                connection = listener.accept()
+                received.append(connection.recv())
+                connection.close()
+
+        def transfer(cookies, data):
+            client = BTCPClientSocket(10, 100, False, port=0, cookies=cookies)
+            self.addCleanup(client.close)
+            accepted = client.connect(data)
+            client.send(data[accepted:])
+            client.disconnect()
+            return accepted
+
+        server = threading.Thread(target=serve, args=(3,), daemon=True)
+        server.start()
+        cookies = {}
+        # The first connection asks for a cookie, so the data follows the handshake
+        self.assertEqual(transfer(cookies, b'first'), 0)
+        cookie = cookies[(SERVER_IP, SERVER_PORT)]
+        self.assertEqual(len(cookie), COOKIE_SIZE)
+        # With the cookie the data is carried in the SYN request
+        self.assertEqual(transfer(cookies, b'second'), len(b'second'))
+        # A stale cookie falls back to a normal handshake and is replaced
+        cookies[(SERVER_IP, SERVER_PORT)] = bytes(COOKIE_SIZE)
+        self.assertEqual(transfer(cookies, b'third'), 0)
+        self.assertEqual(cookies[(SERVER_IP, SERVER_PORT)], cookie)
+        server.join(10)
+        self.assertEqual(received, [b'first', b'second', b'third'])
+        # The server delivers the data of the SYN request before the client acknowledged the SYNACK
+        client = RawClient()
+        self.addCleanup(client.close)
+        client.send(100, 0, Flag.SYN, {Option.FAST_OPEN: cookie}, b'early')
+        synack = client.receive()
+        self.assertEqual((synack.flag, synack.ack_nr), (Flag.SYNACK, 106))
+        connection = listener.accept()
+        stream = connection.recv_stream()
+        self.assertEqual(next(stream), b'early')
+        rest = []
+        reader = threading.Thread(target=lambda: rest.append(b''.join(stream)), daemon=True)
+        reader.start()
+        # A retransmitted SYN request is answered with the same SYNACK once the connection is established
+        client.send(100, 0, Flag.SYN, {Option.FAST_OPEN: cookie}, b'early')
+        repeated = client.receive()
+        self.assertEqual((repeated.flag, repeated.seq_nr, repeated.ack_nr), (Flag.SYNACK, synack.seq_nr, 106))
+        client.send(106, synack.seq_nr + 1, Flag.FIN)
+        self.assertEqual(client.receive().flag, Flag.FINACK)
+        reader.join(10)
+        self.assertEqual(rest, [b''])
+
+    def test_receive_buffer(self):
+        """a full receive buffer drops new segments instead of blocking the network thread"""
+        buffer = ReceiveBuffer(2)
+        self.assertTrue(buffer.put(b'a'))
+        self.assertTrue(buffer.put(b'b'))
+        self.assertFalse(buffer.put(b'c'))
+        self.assertEqual((len(buffer), buffer.drops), (2, 1))
+        self.assertEqual(buffer.get(0), b'a')
+        self.assertEqual(buffer.take_all(), [b'b'])
+        self.assertIsNone(buffer.get(0))
+
+    def test_window_update(self):
+        """a small advertised window is only reopened once reading made room for a good part of the buffer"""
+        sock = Receiver(10, 100)
+        for _ in range(9):
+            sock.buffer.put(b'')
+        sock.advertised_window(Flag.ACK)
+        self.assertEqual(sock.recv_win, 1)
+        for _ in range(3):
+            sock.buffer.get(0)
+        self.assertFalse(sock.window_update_due())
+        sock.buffer.get(0)
+        self.assertTrue(sock.window_update_due())
+
+    def test_reassembly_ranges(self):
+        """without keeping the data only the received ranges are tracked"""
+        buffer = ReassemblyBuffer(0, keep_data=False)
+        buffer.add(100, b'b' * 100)
+        self.assertEqual(buffer.sack_blocks(4), [(100, 200)])
+        self.assertEqual(buffer.held, 0)
+        buffer.add(0, b'a' * 100)
+        self.assertEqual(buffer.seq_nr, 200)
+        self.assertIsNone(buffer.pop())
+
+    def test_streams(self):
+        """a loss only holds back the stream it hit, the others are delivered and ended in the meantime"""
+        sock = Sender(10, 100)
+        segments = [bytes(segment.data) for segment in sock.meta_streams({1: b'a' * 1500, 2: b'b' * 10})]
+        demux = StreamDemux()
+
+        def delivered():
+            chunks = []
+            chunk = demux.pop()
+            while chunk is not None:
+                chunks.append(chunk)
+                chunk = demux.pop()
+            return chunks
+
+        # The first segment of stream 1 is late, stream 2 is delivered and ended in the meantime
+        for data in segments[1:]:
+            demux.add(data)
+        self.assertEqual(delivered(), [(2, b'b' * 10), (2, b'')])
+        demux.add(segments[0])
+        chunks = delivered()
+        self.assertEqual(b''.join(data for _, data in chunks), b'a' * 1500)
+        self.assertEqual(chunks[-1], (1, b''))
+
+    def test_asyncio_transfer(self):
+        """an asyncio client sends its data to an asyncio server on loopback"""
+        data = bytes(range(256)) * 100
+
+        async def transfer():
+            listener = AsyncBTCPServerSocket(10, 100)
+            await listener.listen((SERVER_IP, 0))
+            client = AsyncBTCPClientSocket(10, 100)
+            await client.connect(listener.address)
+            connection = await listener.accept()
+            received = asyncio.ensure_future(connection.recv())
+            await client.send(data)
+            await client.disconnect()
+            client.close()
+            result = await asyncio.wait_for(received, 10)
+            listener.close()
+            return result
+
+        self.assertEqual(asyncio.run(transfer()), data)
+
+    def test_asyncio_concurrent_clients(self):
+        """the asyncio server keeps the connections of two clients which send at the same time apart"""
+        messages = [bytes([1]) * 5000, bytes([2]) * 7000]
+
+        async def send(address, data):
+            client = AsyncBTCPClientSocket(10, 100)
+            await client.connect(address)
+            await client.send(data)
+            await client.disconnect()
+            client.close()
+
+        async def transfer():
+            listener = AsyncBTCPServerSocket(10, 100)
+            await listener.listen((SERVER_IP, 0))
+            clients = asyncio.gather(*(send(listener.address, data) for data in messages))
+            connections = [await listener.accept() for _ in messages]
+            received = await asyncio.wait_for(asyncio.gather(*(c.recv() for c in connections)), 10)
+            await clients
+            listener.close()
+            return received
+
+        self.assertEqual(sorted(asyncio.run(transfer())), messages)
+
+    def test_asyncio_connect_timeout(self):
+        """an asyncio client gives up on a server which never answers once the handshake timeout expires"""
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind((SERVER_IP, 0))
+
+        async def connect():
+            client = AsyncBTCPClientSocket(10, 100, handshake_timeout=300)
+            accepted = await client.connect(silent.getsockname())
+            client.close()
+            return client, accepted
+
+        start = time.monotonic()
+        client, accepted = asyncio.run(connect())
+        elapsed = time.monotonic() - start
+        silent.close()
+        self.assertEqual((client.state, accepted), (State.OPEN, 0))
+        self.assertTrue(0.3 <= elapsed < 2, elapsed)
+
+    def test_concurrent_clients(self):
+        """one listener keeps the connections of several clients on ports picked by the system apart"""
+        messages = [bytes([i]) * (3000 + i * 1000) for i in range(3)]
+        received = []
+        listener = BTCPServerSocket(10, 100, False)
+
+        def receive(connection):
+            received.append(connection.recv())
+            connection.close()
+
+        def serve():
+            receivers = [threading.Thread(target=receive, args=(listener.accept(),)) for _ in messages]
+            for receiver in receivers:
+                receiver.start()
+            for receiver in receivers:
+                receiver.join(10)
+
+        def send(data):
+            client = BTCPClientSocket(10, 100, False, port=0)
+            client.connect()
+            client.send(data)
+            client.disconnect()
+            client.close()
+
+        server = threading.Thread(target=serve, daemon=True)
+        server.start()
+        clients = [threading.Thread(target=send, args=(data,)) for data in messages]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(10)
+        server.join(10)
+        listener.close()
+        self.assertEqual(sorted(received), messages)
+
+    @mock.patch('btcp.server_socket.ACCEPT_TIMEOUT', 300)
+    def test_abandoned_handshake(self):
+        """the listener forgets a handshake which was abandoned and the client can connect again from its address"""
+        received = []
+        listener = BTCPServerSocket(10, 100, False)
+        self.addCleanup(listener.close)
+        server = threading.Thread(target=lambda: received.append(listener.accept().recv()), daemon=True)
+        server.start()
+        # A SYN request whose client never completes the handshake
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind((SERVER_IP, 0))
+        address = silent.getsockname()
+        silent.sendto(bytes(SegmentEncoder().encode(1, 0, Flag.SYN, 10, options=encode_options({}))),
+                      (SERVER_IP, SERVER_PORT))
+        silent.close()
+        # The handshake expires in the network thread, also without any further traffic
+        deadline = time.monotonic() + 3
+        while address not in listener._connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        while address in listener._connections and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertNotIn(address, listener._connections)
+        client = BTCPClientSocket(10, 100, False, port=address[1])
+        self.addCleanup(client.close)
+        client.connect()
+        self.assertIs(client.state, State.CONN_EST)
+        client.send(b'again')
+        client.disconnect()
+        server.join(10)
+        self.assertEqual(received, [b'again'])
+
+    def test_listener_hooks(self):
+        """a listener which does not create its connections fails when it is created"""
+        class Incomplete(BTCPListener):
+            def established(self, connection):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_silent_handshakes(self):
+        """clients which never finish their handshake do not hold up the handshake of another client"""
+        listener = BTCPServerSocket(10, 100, False)
+        self.addCleanup(listener.close)
+        accepted = []
+        server = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+        server.start()
+        for _ in range(2):
+            silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.addCleanup(silent.close)
+            silent.bind((SERVER_IP, 0))
+            silent.sendto(bytes(SegmentEncoder().encode(1, 0, Flag.SYN, 10, options=encode_options({}))),
+                          (SERVER_IP, SERVER_PORT))
+        client = BTCPClientSocket(10, 100, False, port=0)
+        self.addCleanup(client.close)
+        start = time.monotonic()
+        client.connect()
+        elapsed = time.monotonic() - start
+        self.assertIs(client.state, State.CONN_EST)
+        self.assertLess(elapsed, 0.5)
+        # Only the established connection is handed to accept
+        server.join(2)
+        self.assertEqual([connection.state for connection in accepted], [State.CONN_EST])
+
+    def disconnect_raw(self):
+        """connect a raw client to a new listener and disconnect it without sending the final ACK"""
+        listener = BTCPServerSocket(10, 100, False)
+        self.addCleanup(listener.close)
+        connections = []
+
+        def serve():
+            connection = listener.accept()
+            connections.append(connection)
+            connection.recv()
+            connection.close()
+
+        server = threading.Thread(target=serve, daemon=True)
+        server.start()
+        client = RawClient()
+        self.addCleanup(client.close)
+        client.send(100, 0, Flag.SYN)
+        synack = client.receive()
+        self.assertEqual((synack.flag, synack.ack_nr), (Flag.SYNACK, 101))
+        client.send(101, synack.seq_nr + 1, Flag.ACK)
+        client.send(101, synack.seq_nr + 1, Flag.FIN)
+        finack = client.receive()
+        self.assertEqual((finack.flag, finack.ack_nr), (Flag.FINACK, 102))
+        server.join(10)
+        return client, connections[0], synack
+
+    @mock.patch('btcp.server_socket.FIN_TIMEOUT', 300)
+    def test_lingering_fin(self):
+        """a lingering connection answers the FIN request again when its FINACK was lost"""
+        client, connection, synack = self.disconnect_raw()
+        # The application already closed the connection, the network thread still answers for it
+        self.assertIs(connection.state, State.DISC_PEND)
+        client.send(101, synack.seq_nr + 1, Flag.FIN)
+        finack = client.receive()
+        self.assertEqual((finack.flag, finack.ack_nr), (Flag.FINACK, 102))
+        self.assertIs(connection.state, State.DISC_PEND)
+
+    @mock.patch('btcp.server_socket.FIN_TIMEOUT', 300)
+    def test_lingering_expiry(self):
+        """a lingering connection ends once its FIN timeout expires, also without any further traffic"""
+        client, connection, synack = self.disconnect_raw()
+        deadline = time.monotonic() + 3
+        while connection.state is not State.OPEN and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIs(connection.state, State.OPEN)
+        # The listener forgot the connection, so a retransmitted FIN request is no longer answered
+        client.sock.settimeout(0.5)
+        client.send(101, synack.seq_nr + 1, Flag.FIN)
+        with self.assertRaises(socket.timeout):
+            client.receive()
+
+    def test_teardown_threads(self):
+        """a retransmitted FIN request is only answered once the application sent its FINACK"""
+        listener = mock.Mock(_ack_every=ACK_EVERY, _ack_delay=ACK_DELAY)
+        connection = BTCPServerConnection(10, 100, False, True, listener, (SERVER_IP, 20000))
+        connection.state = State.CONN_EST
+        sending, sent, active = threading.Event(), [], []
+
+        def send_segment(segment, address):
+            active.append(segment)
+            sending.set()
+            time.sleep(0.1)
+            sent.append((len(active), decode(bytes(segment))))
+            active.remove(segment)
+
+        connection._lossy_layer = listener._lossy_layer = mock.Mock(send_segment=send_segment)
+        fin = bytes(SegmentEncoder().encode(101, connection.seq_nr, Flag.FIN, 10))
+        application = threading.Thread(target=connection.accept_disconnect, args=(decode(fin),))
+        application.start()
+        sending.wait(2)
+        # The network thread takes the retransmission while the application is still sending its FINACK
+        connection.lossy_layer_input(fin, (SERVER_IP, 20000))
+        application.join(2)
+        self.assertEqual([(count, message.flag, message.ack_nr) for count, message in sent],
+                         [(1, Flag.FINACK, 102), (1, Flag.FINACK, 102)])
+
+    def test_stats_export(self):
+        """the benchmark exports the final counters of the client socket of every run as a line of JSON"""
+        file = io.StringIO()
+        exporter = StatsExporter(json_lines(file), interval=60)
+        self.assertTrue(benchmark.run_once(10, 100, 20000, 'ideal', 0, exporter)['ok'])
+        exports = [json.loads(line) for line in file.getvalue().splitlines()]
+        self.assertEqual(len(exports), 1)
+        stats = exports[0]['sockets']['10 100 20000 ideal 0']
+        # Besides the data segments, the client sent the SYN and FIN requests and their ACKs
+        self.assertGreaterEqual(stats['bytes_sent'], 20000)
+        self.assertGreaterEqual(stats['segments_sent'] - stats['retransmissions'], 4 + 20000 // 1004 + 1)
+        self.assertGreater(stats['segments_received'], 0)
+        self.assertGreater(stats['rtt']['count'], 0)
+        self.assertIsNotNone(stats['handshake_time'])
+        self.assertEqual((stats['state'], stats['checksum_failures']), ('OPEN', 0))
+        self.assertIn('cwnd', stats)
+        # The socket of the run is no longer exported afterwards
+        exporter.export()
+        self.assertEqual(json.loads(file.getvalue().splitlines()[-1])['sockets'], {})
+
+    def test_benchmark_results(self):
+        """benchmark results read back from CSV and JSON give the same averages of the repeated runs"""
+        runs = [dict.fromkeys(benchmark.fields, 0) for _ in range(3)]
+        for seed, (run, goodput) in enumerate(zip(runs, (10.0, 20.0, 4.0))):
+            run.update(window=10, timeout=100, size=1000, profile='ideal', seed=seed, ok=True, goodput_mbit=goodput)
+        runs[2].update(window=30)
+        expected = {('10', '100', '1000', 'ideal'): 15.0, ('30', '100', '1000', 'ideal'): 4.0}
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('results.csv', 'results.json'):
+                path = os.path.join(directory, name)
+                benchmark.write_results(runs, path)
+                summary = benchmark.summarize(benchmark.read_results(path))
+                self.assertEqual({key: values['goodput_mbit'] for key, values in summary.items()}, expected)
+
+    def test_handle_flow_deadline(self):
+        """without traffic handle_flow sleeps until its deadline instead of polling, a segment wakes it up early"""
+        sock = BTCPSocket(10, 100, 'test')
+        start, cpu = time.monotonic(), time.process_time()
+        self.assertIsNone(sock.handle_flow([Flag.ACK], deadline=sock.time() + 300))
+        elapsed, cpu = time.monotonic() - start, time.process_time() - cpu
+        self.assertTrue(0.29 <= elapsed < 0.5, elapsed)
+        self.assertLess(cpu, 0.05)
+        segment = bytes(SegmentEncoder().encode(1, 2, Flag.ACK, 5))
+        threading.Timer(0.05, sock.enqueue, (segment,)).start()
+        start = time.monotonic()
+        message = sock.handle_flow([Flag.ACK], deadline=sock.time() + 2000)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual((message.flag, message.ack_nr, sock.others_recv_win), (Flag.ACK, 2, 5))
+
+    def test_split_data(self):
+        """bytes-like objects, file objects and iterables are split into payload sized chunks"""
+        data = bytes(range(250))
+        expected = [data[:100], data[100:200], data[200:]]
+        chunks = [data[:30], data[30:230], data[230:]]
+        for source in (data, bytearray(data), memoryview(data), io.BytesIO(data), chunks, iter(chunks)):
+            self.assertEqual([bytes(chunk) for chunk in split_data(source, 100)], expected)
+        # Slices of a buffer are views of it, without copying
+        view = memoryview(bytearray(data))
+        self.assertIs(next(split_data(view, 100)).obj, view.obj)
+        # Chunks which straddle the boundaries are joined, however small they are
+        self.assertEqual([bytes(chunk) for chunk in split_data(iter([b'a'] * 7), 3)], [b'aaa', b'aaa', b'a'])
+        self.assertEqual(list(split_data([], 100)), [])
+
+    def test_split_reused_buffer(self):
+        """an iterable may refill the same buffer for every chunk, the earlier chunks keep their contents"""
+        buffer = bytearray(150)
+
+        def refill():
+            for value in range(4):
+                buffer[:] = bytes([value]) * len(buffer)
+                yield buffer
+
+        chunks = list(split_data(refill(), 100))
+        self.assertEqual(b''.join(chunks), b''.join(bytes([value]) * 150 for value in range(4)))
+
+    def test_gso_fallback(self):
+        """a burst whose segmentation offload fails is sent per segment, offload is only turned off if unsupported"""
+        layer = LossyLayer(None, SERVER_IP, 0, SERVER_IP, SERVER_PORT)
+        self.addCleanup(layer._udp_sock.close)
+        udp_sock = layer._udp_sock = mock.Mock()
+        layer._gso = True
+        burst = memoryview(bytes(250))
+        for error, gso in ((errno.ENOBUFS, True), (errno.ECONNREFUSED, True), (errno.EINVAL, False)):
+            udp_sock.reset_mock()
+            udp_sock.sendmsg.side_effect = OSError(error, 'test')
+            layer.send_burst(burst, 100)
+            self.assertEqual(udp_sock.sendto.call_count, 3)
+            self.assertIs(layer._gso, gso)
+        # Without offload the segments are sent one by one right away
+        udp_sock.reset_mock()
+        layer.send_burst(burst, 100)
+        self.assertFalse(udp_sock.sendmsg.called)
+        self.assertEqual(udp_sock.sendto.call_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()